@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Answer Cache for Book Companion
+Caches model answers in front of the model call. The exact tier keys on the
+normalized question text plus the retrieval scope (vector store or local index)
+and model; the optional semantic tier reuses an answer whose question embedding
+is within a cosine-similarity threshold. Entries live in a pluggable backend:
+an in-process LRU with a TTL, or a SQLite file shared by every worker. Each
+backend keeps the semantic tier's embeddings in memory as one matrix per scope.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Only the semantic tier needs numpy
+    np = None
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+WHITESPACE_RE = re.compile(r"\s+")
+# Other workers' rows are re-read this far back, in case they committed out of timestamp order
+SYNC_OVERLAP_SECONDS = 10.0
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace ("Who is Cenn?" -> "who is cenn")."""
+    query = PUNCTUATION_RE.sub(" ", query.lower())
+    return WHITESPACE_RE.sub(" ", query).strip()
+
+
+def cache_key(query: str, scope: str) -> str:
+    """Exact-tier key for a question within a scope (retrieval source + model)."""
+    return hashlib.sha256(f"{scope}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+def unit_vector(vector) -> "np.ndarray":
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ScopeMatrix:
+    """One scope's question embeddings as unit rows of a float32 matrix, with their creation times"""
+
+    def __init__(self, dim: int):
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.created_at = np.zeros(16)
+
+    def add(self, key: str, vector, created_at: float) -> None:
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.matrix):
+                # Grow by doubling so a put is amortized O(dim), not a copy of the whole matrix
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+                self.created_at = np.concatenate([self.created_at, np.zeros_like(self.created_at)])
+            self.keys.append(key)
+            self.rows[key] = row
+        self.matrix[row] = unit_vector(vector)
+        self.created_at[row] = created_at
+
+    def discard(self, key: str) -> None:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        # Move the last row into the hole
+        last = len(self.keys) - 1
+        moved = self.keys.pop()
+        if row != last:
+            self.keys[row] = moved
+            self.rows[moved] = row
+            self.matrix[row] = self.matrix[last]
+            self.created_at[row] = self.created_at[last]
+
+    def nearest(self, embedding, not_before: float) -> Optional[Tuple[str, float]]:
+        size = len(self.keys)
+        scores = self.matrix[:size] @ unit_vector(embedding)
+        # Expired entries must not outrank a live one
+        scores[self.created_at[:size] < not_before] = -np.inf
+        if not size or np.isneginf(scores.max()):
+            return None
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+
+class SemanticIndex:
+    """
+    Question embeddings grouped by scope, so a semantic lookup is one
+    matrix-vector product over the scope's rows instead of a pass over
+    every stored vector.
+    """
+
+    def __init__(self):
+        self._scopes: Dict[str, ScopeMatrix] = {}
+        self._scope_of: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, scope: str, vector, created_at: float) -> None:
+        with self._lock:
+            if self._scope_of.get(key, scope) != scope:
+                self._scopes[self._scope_of[key]].discard(key)
+            matrix = self._scopes.get(scope)
+            if matrix is None or matrix.matrix.shape[1] != len(vector):
+                # A new scope, or a new embedding model
+                matrix = self._scopes[scope] = ScopeMatrix(len(vector))
+            matrix.add(key, vector, created_at)
+            self._scope_of[key] = scope
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            scope = self._scope_of.pop(key, None)
+            if scope is not None:
+                self._scopes[scope].discard(key)
+
+    def nearest(self, scope: str, embedding, not_before: float) -> Optional[Tuple[str, float]]:
+        """The key and cosine similarity of the scope's closest unexpired question, if any."""
+        with self._lock:
+            matrix = self._scopes.get(scope)
+            if matrix is None or matrix.matrix.shape[1] != len(embedding):
+                return None
+            return matrix.nearest(embedding, not_before)
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with a TTL; each worker keeps its own copy"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._vectors = SemanticIndex()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if time.time() - created_at > self.ttl:
+                self._entries.pop(key, None)
+                self._vectors.discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, scope: str, vector: Optional[List[float]] = None) -> None:
+        with self._lock:
+            now = time.time()
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            if vector is not None:
+                self._vectors.add(key, scope, vector, now)
+            else:
+                self._vectors.discard(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._vectors.discard(evicted)
+
+    def nearest(self, scope: str, embedding: List[float]) -> Optional[Tuple[str, float]]:
+        """Key and cosine similarity of the scope's most similar unexpired question."""
+        return self._vectors.nearest(scope, embedding, time.time() - self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """SQLite-backed cache shared by every worker on the host"""
+
+    def __init__(self, path: str = "answer_cache.sqlite3", max_entries: int = 10000, ttl: float = 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        # Embeddings read so far, and per scope the newest created_at read from the table
+        self._vectors = SemanticIndex()
+        self._synced: Dict[str, float] = {}
+        self._sync_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, scope TEXT, value TEXT,"
+            " vector BLOB, created_at REAL, last_access REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS answers_scope_created ON answers (scope, created_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, created_at FROM answers WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            # Evicted, perhaps by another worker
+            self._vectors.discard(key)
+            return None
+        value, created_at = row
+        now = time.time()
+        if now - created_at > self.ttl:
+            conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            conn.commit()
+            self._vectors.discard(key)
+            return None
+        conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return json.loads(value)
+
+    def set(self, key: str, value: dict, scope: str, vector: Optional[List[float]] = None) -> None:
+        conn = self._conn()
+        now = time.time()
+        blob = array("f", vector).tobytes() if vector is not None else None
+        conn.execute(
+            "INSERT OR REPLACE INTO answers (key, scope, value, vector, created_at, last_access)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, scope, json.dumps(value), blob, now, now),
+        )
+        # Expire old entries, then evict least recently used ones over the limit
+        conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM answers WHERE key IN (SELECT key FROM answers"
+            " ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        conn.commit()
+        if vector is not None:
+            self._vectors.add(key, scope, vector, now)
+        else:
+            self._vectors.discard(key)
+
+    def _sync(self, scope: str) -> None:
+        """Read the scope's embeddings written since the last sync (all of them the first time)."""
+        with self._sync_lock:
+            since = max(self._synced.get(scope, 0.0) - SYNC_OVERLAP_SECONDS, time.time() - self.ttl)
+            rows = self._conn().execute(
+                "SELECT key, vector, created_at FROM answers"
+                " WHERE scope = ? AND vector IS NOT NULL AND created_at >= ?",
+                (scope, since),
+            ).fetchall()
+            for key, blob, created_at in rows:
+                self._vectors.add(key, scope, np.frombuffer(blob, dtype=np.float32), created_at)
+            if rows:
+                self._synced[scope] = max(self._synced.get(scope, 0.0), max(row[2] for row in rows))
+
+    def nearest(self, scope: str, embedding: List[float]) -> Optional[Tuple[str, float]]:
+        """Key and cosine similarity of the scope's most similar unexpired question."""
+        self._sync(scope)
+        return self._vectors.nearest(scope, embedding, time.time() - self.ttl)
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+class AnswerCache:
+    """Exact + optional semantic answer cache with hit/miss accounting"""
+
+    def __init__(self, backend, semantic_threshold: Optional[float] = None):
+        if semantic_threshold is not None and np is None:
+            raise RuntimeError("numpy is required for the semantic answer cache (pip install numpy)")
+        self.backend = backend
+        self.semantic_threshold = semantic_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        # Lookups run in worker threads
+        self._lock = threading.Lock()
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold is not None
+
+    def _record_hit(self, value: dict, tier: str) -> dict:
+        with self._lock:
+            if tier == "exact":
+                self.exact_hits += 1
+            else:
+                self.semantic_hits += 1
+            self.saved_seconds += value.get("latency", 0.0)
+            self.saved_tokens += (value.get("usage") or {}).get("total_tokens", 0)
+        return value
+
+    def lookup(self, query: str, scope: str) -> Optional[dict]:
+        """Exact-tier lookup; does not count a miss so the semantic tier can still run."""
+        value = self.backend.get(cache_key(query, scope))
+        if value is not None:
+            return self._record_hit(value, "exact")
+        return None
+
+    def lookup_semantic(self, embedding: List[float], scope: str) -> Optional[dict]:
+        """Return the cached answer whose question embedding is most similar, if close enough."""
+        match = self.backend.nearest(scope, embedding)
+        if match is None or match[1] < self.semantic_threshold:
+            return None
+        value = self.backend.get(match[0])
+        if value is not None:
+            return self._record_hit(value, "semantic")
+        return None
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def store(self, query: str, scope: str, value: dict, embedding: Optional[List[float]] = None) -> None:
+        self.backend.set(cache_key(query, scope), value, scope, embedding)
+
+    def stats(self) -> dict:
+        entries = len(self.backend)
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": entries,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "saved_tokens": self.saved_tokens,
+            }
+
+
+def create_answer_cache(config) -> Optional[AnswerCache]:
+    """Build the answer cache described by config, or None if caching is disabled."""
+    if config.CACHE_BACKEND == "none":
+        return None
+    if config.CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend(config.CACHE_SQLITE_PATH, config.CACHE_MAX_ENTRIES, config.CACHE_TTL_SECONDS)
+    else:
+        backend = MemoryCacheBackend(config.CACHE_MAX_ENTRIES, config.CACHE_TTL_SECONDS)
+    return AnswerCache(backend, config.CACHE_SEMANTIC_THRESHOLD)
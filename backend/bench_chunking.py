@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Chunking Benchmark
+Builds a BM25 LocalIndex for several chunk sizes and reports, over the labelled
+questions in eval_questions.json, the context tokens sent per answer (top-k
+chunks) and retrieval hit quality (hit@k and MRR on the expected chapters).
+Two baselines are included: whole extractor files as the retrieval unit, and
+the local index's fixed 200-word windows.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from chunking import chunk_corpus, count_tokens, iter_records
+from local_index import LocalIndex, chunk_document
+
+DEFAULT_QUESTIONS = "eval_questions.json"
+
+
+def whole_file_passages(corpus_dirs: list) -> list:
+    return [
+        {"id": i, "source": r["source"], "text": r["text"]}
+        for i, r in enumerate(iter_records(corpus_dirs))
+    ]
+
+
+def word_window_passages(corpus_dirs: list) -> list:
+    passages = []
+    for record in iter_records(corpus_dirs):
+        for chunk in chunk_document(record["text"]):
+            passages.append({"id": len(passages), "source": record["source"], "text": chunk})
+    return passages
+
+
+def evaluate(name: str, passages: list, questions: list, k: int) -> dict:
+    """Index the passages and score every question; returns one result row."""
+    start = time.perf_counter()
+    index = LocalIndex(passages)
+    build_seconds = time.perf_counter() - start
+
+    hits, reciprocal_ranks, answer_tokens, search_seconds = 0, 0.0, 0, 0.0
+    for item in questions:
+        start = time.perf_counter()
+        results = index.search(item["question"], k=k)
+        search_seconds += time.perf_counter() - start
+
+        answer_tokens += sum(count_tokens(r["text"]) for r in results)
+        expected = set(item["sources"])
+        rank = next((i for i, r in enumerate(results, 1) if r["source"] in expected), None)
+        if rank is not None:
+            hits += 1
+            reciprocal_ranks += 1.0 / rank
+
+    n = len(questions)
+    return {
+        "name": name,
+        "passages": len(passages),
+        "tokens_per_passage": sum(count_tokens(p["text"]) for p in passages) / max(1, len(passages)),
+        "tokens_per_answer": answer_tokens / n,
+        "hit_at_k": hits / n,
+        "mrr": reciprocal_ranks / n,
+        "build_seconds": build_seconds,
+        "search_ms": search_seconds / n * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunk sizes for retrieval quality and context tokens')
+    parser.add_argument('dirs', nargs='*', default=["epub_extracted_chapters/"],
+                       help='Directories of extracted .txt files (default: epub_extracted_chapters/)')
+    parser.add_argument('-q', '--questions', default=DEFAULT_QUESTIONS,
+                       help=f'Labelled question set (default: {DEFAULT_QUESTIONS})')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[128, 256, 512, 1024],
+                       help='Chunk sizes in tokens to try (default: 128 256 512 1024)')
+    parser.add_argument('--overlap', type=float, default=0.125,
+                       help='Overlap as a fraction of the chunk size (default: 0.125)')
+    parser.add_argument('-k', type=int, default=5, help='Chunks retrieved per question (default: 5)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    args = parser.parse_args()
+
+    if not Path(args.questions).exists():
+        print(f"Error: question set not found: {args.questions}")
+        sys.exit(1)
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    rows = [
+        evaluate("whole files", whole_file_passages(args.dirs), questions, args.k),
+        evaluate("200 words", word_window_passages(args.dirs), questions, args.k),
+    ]
+    for size in args.sizes:
+        chunks = chunk_corpus(args.dirs, max_tokens=size, overlap_tokens=int(size * args.overlap))
+        rows.append(evaluate(f"{size} tokens", chunks, questions, args.k))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{len(questions)} questions, top-{args.k} retrieval")
+    print(f"{'chunking':<12} {'passages':>8} {'tok/chunk':>9} {'tok/answer':>10} "
+          f"{'hit@k':>6} {'MRR':>5} {'build (s)':>9} {'search (ms)':>11}")
+    for row in rows:
+        print(f"{row['name']:<12} {row['passages']:>8} {row['tokens_per_passage']:>9.0f} "
+              f"{row['tokens_per_answer']:>10.0f} {row['hit_at_k']:>6.2f} {row['mrr']:>5.2f} "
+              f"{row['build_seconds']:>9.2f} {row['search_ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
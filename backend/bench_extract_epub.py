@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+EPUB Extraction Benchmark
+Times extract_epub across parser backends and worker counts against the current
+single-process html5lib path, and checks that every configuration writes the
+same chapter files as that baseline.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+from extract_epub import PARSERS, extract_epub
+
+
+def read_chapters(output_dir: Path) -> dict:
+    """Map chapter filename -> content, ignoring the summary (it embeds the output path)."""
+    return {
+        p.name: p.read_text(encoding="utf-8")
+        for p in sorted(output_dir.glob("*.txt"))
+        if p.name != "extraction_summary.txt"
+    }
+
+
+def run_once(epub_path: str, output_dir: Path, workers: int, parser: str) -> float:
+    """Run one extraction with its console output suppressed and return the wall time."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = extract_epub(epub_path, str(output_dir), workers=workers, parser=parser)
+    elapsed = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError(f"extraction failed for parser={parser} workers={workers}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark EPUB extraction parsers and worker counts')
+    parser.add_argument('epub_path', help='Path to the EPUB file (the larger the better)')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                       help='Worker counts to try (default: 1 and the CPU count)')
+    parser.add_argument('-p', '--parsers', nargs='+', choices=PARSERS, default=PARSERS,
+                       help='Parser backends to try (default: all)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.epub_path):
+        print(f"Error: EPUB file not found: {args.epub_path}")
+        sys.exit(1)
+
+    warnings.filterwarnings("ignore")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+
+        baseline_dir = tmp_path / "baseline"
+        baseline_time = run_once(args.epub_path, baseline_dir, workers=1, parser='html5lib')
+        baseline = read_chapters(baseline_dir)
+
+        print(f"Benchmarking {args.epub_path} ({len(baseline)} chapters)")
+        print(f"{'parser':<12} {'workers':>7} {'wall (s)':>9} {'speedup':>8}  output")
+        print(f"{'html5lib':<12} {1:>7} {baseline_time:>9.2f} {1.0:>7.1f}x  baseline")
+
+        for parser_name in args.parsers:
+            for workers in args.workers:
+                if parser_name == 'html5lib' and workers == 1:
+                    continue
+                output_dir = tmp_path / f"{parser_name}_{workers}"
+                elapsed = run_once(args.epub_path, output_dir, workers=workers, parser=parser_name)
+                chapters = read_chapters(output_dir)
+                if chapters == baseline:
+                    verdict = "matches"
+                else:
+                    differing = sum(1 for name in baseline.keys() | chapters.keys()
+                                    if baseline.get(name) != chapters.get(name))
+                    verdict = f"DIFFERS ({differing} files)"
+                print(f"{parser_name:<12} {workers:>7} {elapsed:>9.2f} "
+                      f"{baseline_time / elapsed:>7.1f}x  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
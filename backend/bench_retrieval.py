@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Offline Retrieval Benchmark
+Replays the labelled questions in eval_questions.json against the corpus and
+reports recall@k, MRR, p50/p95/p99 retrieval latency, index build time and
+memory. Runs without network access: either the local BM25 index (optionally
+with deterministic hashed embeddings to exercise the hybrid path), or a
+recording of OpenAI vector store search results made earlier with --record.
+
+Use --output to save a run and --baseline to fail (exit 1) when a later run
+regresses past --tolerance, so it can gate changes to extraction, chunking or
+retrieval:
+    python bench_retrieval.py --output baseline.json
+    python bench_retrieval.py --baseline baseline.json
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+from chunking import chunk_corpus, read_jsonl
+from local_index import LocalIndex, load_passages, tokenize
+from retrieval import RERANKERS, create_reranker, passage_tokens, select_passages
+from vector_index import CODECS
+
+DEFAULT_QUESTIONS = "eval_questions.json"
+DEFAULT_CORPUS = "epub_extracted_chapters/"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def hashed_embed_fn(dim: int = 256) -> Callable[[List[str]], List[List[float]]]:
+    """Deterministic bag-of-words embeddings via the hashing trick; a network-free stand-in."""
+    def embed(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * dim
+            for token in tokenize(text):
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest()
+                vector[int.from_bytes(digest, "little") % dim] += 1.0
+            vectors.append(vector)
+        return vectors
+    return embed
+
+
+def ranked_sources(results: List[dict]) -> List[str]:
+    """Distinct sources in rank order (several passages can come from one chapter)."""
+    seen = []
+    for result in results:
+        if result["source"] not in seen:
+            seen.append(result["source"])
+    return seen
+
+
+def score_question(sources: List[str], expected: List[str], ks: List[int]) -> dict:
+    expected_set = set(expected)
+    first = next((rank for rank, source in enumerate(sources, 1) if source in expected_set), None)
+    return {
+        "reciprocal_rank": 1.0 / first if first else 0.0,
+        "recall": {k: len(expected_set & set(sources[:k])) / len(expected_set) for k in ks},
+    }
+
+
+def load_corpus_passages(args) -> List[dict]:
+    if args.chunks:
+        return [dict(chunk, id=i) for i, chunk in enumerate(read_jsonl(args.chunks))]
+    if args.max_tokens:
+        return chunk_corpus([args.corpus], max_tokens=args.max_tokens, overlap_tokens=args.max_tokens // 8)
+    return load_passages([args.corpus])
+
+
+def build_index(passages: List[dict], embeddings: bool, codec: str = "float32") -> tuple:
+    """Build the index and measure (index, build seconds, peak traced MB, on-disk MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = LocalIndex(passages)
+    if embeddings:
+        index.add_embeddings(hashed_embed_fn(), codec=codec)
+    build_seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index.save(tmp)
+        disk_bytes = sum(p.stat().st_size for p in Path(tmp).iterdir())
+    return index, build_seconds, peak / 1e6, disk_bytes / 1e6
+
+
+def run_local(args, questions: List[dict], ks: List[int]) -> dict:
+    passages = load_corpus_passages(args)
+    index, build_seconds, peak_mb, disk_mb = build_index(passages, args.embeddings, args.codec)
+    embed = hashed_embed_fn() if args.embeddings else None
+    reranker = create_reranker(args.reranker, args.rerank_model) if args.reranker else None
+
+    def retrieve(question: str) -> List[dict]:
+        query_embedding = embed([question])[0] if embed else None
+        if not args.reranker:
+            return index.search(question, k=max(ks), query_embedding=query_embedding)
+        # The /ask pipeline: fuse lexical and vector candidates, rerank, pack into the budget
+        rankings = [index.lexical_search(question, args.candidates)]
+        if query_embedding is not None:
+            rankings.append(index.vector_search(query_embedding, args.candidates, rescore=args.rescore))
+        return select_passages(question, rankings, reranker, candidates=args.candidates,
+                               token_budget=args.budget, max_passages=max(ks))
+
+    per_question, latencies = [], []
+    for item in questions:
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = retrieve(item["question"])
+            latencies.append(time.perf_counter() - start)
+        scores = score_question(ranked_sources(results), item["sources"], ks)
+        scores["context_tokens"] = sum(passage_tokens(p) for p in results)
+        per_question.append(scores)
+
+    retriever = f"bm25+embeddings:{args.codec}" if args.embeddings else "bm25"
+    if args.reranker:
+        retriever = f"{retriever.replace('+', '|')} -> rrf -> {args.reranker}" + (f" (budget {args.budget})" if args.budget else "")
+    return {
+        "retriever": retriever,
+        "passages": len(passages),
+        "build_seconds": build_seconds,
+        "build_peak_mb": peak_mb,
+        "index_disk_mb": disk_mb,
+        "per_question": per_question,
+        "latencies": latencies,
+    }
+
+
+def record_openai(args, questions: List[dict], ks: List[int]) -> None:
+    """Run the questions against a real vector store once and save the results for offline replay."""
+    from openai import OpenAI
+    from config import config
+
+    client = OpenAI(api_key=config.OPENAI_API_KEY)
+    vector_store_id = args.vector_store_id or Path("vector_store_id.txt").read_text().strip()
+    recording = {"retriever": f"openai:{vector_store_id}", "results": {}}
+    for item in questions:
+        start = time.perf_counter()
+        page = client.vector_stores.search(vector_store_id=vector_store_id, query=item["question"],
+                                           max_num_results=max(ks))
+        recording["results"][item["question"]] = {
+            "sources": [hit.filename for hit in page.data],
+            "seconds": time.perf_counter() - start,
+        }
+    with open(args.record, "w", encoding="utf-8") as f:
+        json.dump(recording, f, indent=2)
+    print(f"💾 Recorded {len(questions)} searches to {args.record}")
+
+
+def run_replay(args, questions: List[dict], ks: List[int]) -> dict:
+    with open(args.replay, "r", encoding="utf-8") as f:
+        recording = json.load(f)
+
+    per_question, latencies = [], []
+    for item in questions:
+        recorded = recording["results"].get(item["question"])
+        if recorded is None:
+            raise SystemExit(f"Error: no recording for question: {item['question']}")
+        sources = ranked_sources([{"source": s} for s in recorded["sources"]])
+        per_question.append(score_question(sources, item["sources"], ks))
+        latencies.append(recorded["seconds"])
+
+    return {"retriever": recording["retriever"], "per_question": per_question, "latencies": latencies}
+
+
+def summarize(run: dict, ks: List[int]) -> dict:
+    per_question, latencies = run.pop("per_question"), run.pop("latencies")
+    n = len(per_question)
+    return dict(
+        run,
+        questions=n,
+        recall_at_k={str(k): sum(q["recall"][k] for q in per_question) / n for k in ks},
+        mrr=sum(q["reciprocal_rank"] for q in per_question) / n,
+        **({"context_tokens": sum(q["context_tokens"] for q in per_question) / n}
+           if "context_tokens" in per_question[0] else {}),
+        latency_ms={f"p{p}": percentile(latencies, p) * 1000 for p in (50, 95, 99)},
+        max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+
+def compare(summary: dict, baseline: dict, tolerance: float, latency_slack_ms: float = 1.0) -> List[str]:
+    """
+    Regressions beyond tolerance: quality dropping or latency/build time growing.
+    Latency must also grow by more than latency_slack_ms, since sub-millisecond
+    local searches jitter by more than any sensible relative tolerance.
+    """
+    problems = []
+    for k, recall in baseline.get("recall_at_k", {}).items():
+        current = summary["recall_at_k"].get(k)
+        if current is not None and current < recall - tolerance * max(recall, 1e-9):
+            problems.append(f"recall@{k} fell from {recall:.3f} to {current:.3f}")
+    if summary["mrr"] < baseline["mrr"] * (1 - tolerance):
+        problems.append(f"MRR fell from {baseline['mrr']:.3f} to {summary['mrr']:.3f}")
+    before, after = baseline["latency_ms"]["p95"], summary["latency_ms"]["p95"]
+    if after > before * (1 + tolerance) and after - before > latency_slack_ms:
+        problems.append(f"p95 latency rose from {before:.2f}ms to {after:.2f}ms")
+    if "build_seconds" in baseline and "build_seconds" in summary:
+        if summary["build_seconds"] > baseline["build_seconds"] * (1 + tolerance):
+            problems.append(f"build time rose from {baseline['build_seconds']:.2f}s "
+                            f"to {summary['build_seconds']:.2f}s")
+    return problems
+
+
+def print_summary(summary: dict) -> None:
+    print(f"📊 {summary['retriever']}: {summary['questions']} questions"
+          + (f", {summary['passages']} passages" if "passages" in summary else ""))
+    print("   " + "  ".join(f"recall@{k} {v:.3f}" for k, v in summary["recall_at_k"].items())
+          + f"  MRR {summary['mrr']:.3f}"
+          + (f"  context {summary['context_tokens']:.0f} tokens" if "context_tokens" in summary else ""))
+    lat = summary["latency_ms"]
+    print(f"   ⏱️  latency p50 {lat['p50']:.2f}ms  p95 {lat['p95']:.2f}ms  p99 {lat['p99']:.2f}ms")
+    if "build_seconds" in summary:
+        print(f"   🔨 build {summary['build_seconds']:.2f}s, peak {summary['build_peak_mb']:.1f}MB allocated, "
+              f"{summary['index_disk_mb']:.1f}MB on disk")
+    print(f"   🧠 max RSS {summary['max_rss_mb']:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline retrieval quality and latency benchmark')
+    parser.add_argument('-q', '--questions', default=DEFAULT_QUESTIONS,
+                       help=f'Labelled question set (default: {DEFAULT_QUESTIONS})')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help=f'Extracted corpus directory (default: {DEFAULT_CORPUS})')
+    parser.add_argument('--chunks', default=None, help='Index chunking.py JSONL output instead of the corpus')
+    parser.add_argument('--max-tokens', type=int, default=None,
+                       help='Chunk the corpus with chunking.py at this size (default: 200-word windows)')
+    parser.add_argument('--embeddings', action='store_true',
+                       help='Add deterministic hashed embeddings to exercise the hybrid search path')
+    parser.add_argument('--codec', choices=CODECS, default='float32',
+                       help='How --embeddings are stored: float32, int8 or pq (default: float32)')
+    parser.add_argument('--rescore', type=int, default=0,
+                       help='Quantized vector candidates re-scored exactly with --reranker (default: 0)')
+    parser.add_argument('--reranker', choices=RERANKERS, default=None,
+                       help='Evaluate the /ask pipeline (fusion, this reranker, token budget) instead of plain search')
+    parser.add_argument('--rerank-model', default='cross-encoder/ms-marco-MiniLM-L-6-v2',
+                       help='Cross-encoder model for --reranker cross-encoder')
+    parser.add_argument('--candidates', type=int, default=20, help='Candidates per retriever for --reranker (default: 20)')
+    parser.add_argument('--budget', type=int, default=0, help='Context token budget for --reranker (default: none)')
+    parser.add_argument('-k', type=int, nargs='+', default=[1, 3, 5, 10], help='Cutoffs for recall@k (default: 1 3 5 10)')
+    parser.add_argument('--repeat', type=int, default=5, help='Searches per question for latency (default: 5)')
+    parser.add_argument('--record', default=None,
+                       help='Record OpenAI vector store search results to this file (needs the API)')
+    parser.add_argument('--vector-store-id', default=None, help='Vector store to record (default: vector_store_id.txt)')
+    parser.add_argument('--replay', default=None, help='Score a recording made with --record instead of a local index')
+    parser.add_argument('-o', '--output', default=None, help='Write the summary as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='Compare against a previous --output and exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                       help='Allowed relative regression against the baseline (default: 0.1)')
+    parser.add_argument('--latency-slack-ms', type=float, default=1.0,
+                       help='Ignore p95 latency increases smaller than this (default: 1.0)')
+
+    args = parser.parse_args()
+
+    if not Path(args.questions).exists():
+        print(f"Error: question set not found: {args.questions}")
+        sys.exit(1)
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    ks = sorted(set(args.k))
+
+    if args.record:
+        record_openai(args, questions, ks)
+        return
+
+    run = run_replay(args, questions, ks) if args.replay else run_local(args, questions, ks)
+    summary = summarize(run, ks)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Summary written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(summary, baseline, args.tolerance, args.latency_slack_ms)
+        if problems:
+            print("❌ Regressions against baseline:")
+            for problem in problems:
+                print(f"   - {problem}")
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
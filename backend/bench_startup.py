@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Cold-Start Benchmark
+Measures how long `import main` takes in a fresh interpreter, which modules
+dominate it (python -X importtime), and how long a uvicorn worker takes from
+launch until GET /health answers. Run it before and after touching main.py's
+imports or startup path to catch cold-start regressions.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def time_import(module: str, env: dict) -> float:
+    """Wall time of importing the module in a fresh interpreter."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, env: dict, top: int) -> list:
+    """(cumulative microseconds, module name) for the slowest top-level imports."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only imports made directly by the module under test (two spaces of nesting)
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def time_to_ready(module: str, env: dict, port: int, timeout: float = 30.0) -> float:
+    """Seconds from launching uvicorn until /health returns 200."""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"server did not become healthy within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold-start import time and time to first healthy response')
+    parser.add_argument('-n', '--runs', type=int, default=5, help='Runs per measurement (default: 5)')
+    parser.add_argument('-m', '--module', default='main', help='Module to import (default: main)')
+    parser.add_argument('--port', type=int, default=8199, help='Port for the time-to-ready server (default: 8199)')
+    parser.add_argument('--top', type=int, default=8, help='Slowest imports to list (default: 8)')
+    parser.add_argument('--no-server', action='store_true', help='Skip the time-to-ready measurement')
+
+    args = parser.parse_args()
+
+    # Cold starts must not depend on an API key being present
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+
+    imports = [time_import(args.module, env) for _ in range(args.runs)]
+    print(f"import {args.module}: median {statistics.median(imports) * 1000:.0f}ms, "
+          f"min {min(imports) * 1000:.0f}ms over {args.runs} runs")
+
+    print("Slowest imports:")
+    for cumulative, name in slowest_imports(args.module, env, args.top):
+        print(f"  {cumulative / 1000:>8.1f}ms  {name}")
+
+    if not args.no_server:
+        ready = [time_to_ready(args.module, env, args.port) for _ in range(args.runs)]
+        print(f"uvicorn launch -> /health 200: median {statistics.median(ready) * 1000:.0f}ms, "
+              f"min {min(ready) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
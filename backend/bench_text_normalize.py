@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Text Normalization Micro-Benchmark
+Times the extractors' text cleaning and chapter classification against the
+original multi-pass implementations (kept below as the reference) over the
+real extracted chapter and page files, and checks both give identical results.
+The files are also re-wrapped into short lines to stand in for raw parser
+output, which still has its newlines and indentation.
+"""
+
+import argparse
+import re
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+from extract_epub import extract_chapter_title, is_actual_chapter
+from text_normalize import clean_epub_text, clean_pdf_text
+
+
+def reference_clean_epub(text):
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text.strip())
+    text = re.sub(r'\[.*?\]', '', text)
+    text = re.sub(r'^\s*[0-9]+\s*$', '', text, flags=re.MULTILINE)
+    return text
+
+
+def reference_clean_pdf(text):
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text.strip())
+    text = re.sub(r'[^\x00-\x7F]+', '', text)
+    text = re.sub(r'\f', '\n', text)
+    return text
+
+
+def reference_is_actual_chapter(text_content, item_id=""):
+    if not text_content or len(text_content.strip()) < 100:
+        return False
+    text_lower = text_content.lower()
+    skip_patterns = [
+        'acknowledgments', 'acknowledgements', 'copyright', 'all rights reserved',
+        'contents', 'table of contents', 'dedication', 'for emily',
+        'tor books by brandon sanderson', 'map of', 'created by his majesty',
+        'ars arcanum', 'endnote'
+    ]
+    for pattern in skip_patterns:
+        if pattern in text_lower:
+            return False
+    if len(text_content.strip()) < 300:
+        return False
+    upper_ratio = sum(1 for c in text_content if c.isupper()) / len(text_content)
+    if upper_ratio > 0.8 and len(text_content.strip()) < 1000:
+        return False
+    story_indicators = [
+        '"', 'said', 'asked', 'replied', 'he', 'she', 'they',
+        'walked', 'ran', 'looked', 'chapter', 'part', 'prologue', 'epilogue', 'prelude'
+    ]
+    return any(indicator in text_lower for indicator in story_indicators)
+
+
+def reference_extract_chapter_title(text_content):
+    for line in text_content.split('\n'):
+        line = line.strip()
+        if line and len(line) > 5 and len(line) < 200:
+            if any(keyword in line.lower() for keyword in ['chapter', 'part', 'prologue', 'epilogue', 'prelude']):
+                return line
+            if line.isupper() and len(line.split()) <= 10:
+                return line
+            if re.match(r'^[0-9]+\.?\s+', line):
+                return line
+    return ""
+
+
+# Short inputs that exercise the edge cases the real files rarely hit
+EDGE_CASES = [
+    "", "   ", "42", "  \n 17 \t", "[note] 12", "[a] [b]", "Title [1]\n\ntext [unclosed",
+    "café – naïve\f next page", " indented text\x1c", "ALL CAPS HEADER " * 30,
+    "Copyright 2010. All rights reserved. " * 20, "CHAPTER ONE\n" + "He said hello. " * 30,
+]
+
+
+def load_inputs(dirs):
+    texts = []
+    for directory in dirs:
+        for path in sorted(Path(directory).glob("*.txt")):
+            if path.name == "extraction_summary.txt":
+                continue
+            text = path.read_text(encoding="utf-8")
+            texts.append(text)
+            texts.append(textwrap.fill(text, width=70, initial_indent="    "))
+    return texts
+
+
+def best_time(fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text cleaning and chapter classification')
+    parser.add_argument('dirs', nargs='*', default=['epub_extracted_chapters', 'pdf_extracted_pages'],
+                       help='Directories of extracted .txt files (default: epub_extracted_chapters pdf_extracted_pages)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timing runs per function, best kept (default: 5)')
+
+    args = parser.parse_args()
+
+    texts = load_inputs(args.dirs)
+    if not texts:
+        print(f"Error: no .txt files found in {', '.join(args.dirs)}")
+        sys.exit(1)
+    print(f"Benchmarking {len(texts)} texts, {sum(map(len, texts)) / 1e6:.1f}M characters")
+
+    pairs = [
+        ("clean_text (epub)", reference_clean_epub, clean_epub_text),
+        ("clean_text (pdf)", reference_clean_pdf, clean_pdf_text),
+        ("is_actual_chapter", reference_is_actual_chapter, is_actual_chapter),
+        ("extract_chapter_title", reference_extract_chapter_title, extract_chapter_title),
+    ]
+
+    mismatches = 0
+    print(f"{'function':<22} {'before (ms)':>11} {'after (ms)':>11} {'speedup':>8}  output")
+    for name, before_fn, after_fn in pairs:
+        differing = sum(1 for text in texts + EDGE_CASES if before_fn(text) != after_fn(text))
+        mismatches += differing
+        before = best_time(before_fn, texts, args.repeat)
+        after = best_time(after_fn, texts, args.repeat)
+        verdict = "matches" if not differing else f"DIFFERS ({differing} inputs)"
+        print(f"{name:<22} {before * 1000:>11.1f} {after * 1000:>11.1f} {before / after:>7.1f}x  {verdict}")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
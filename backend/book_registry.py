@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Book Registry for Book Companion
+Maps book IDs to their retrieval indexes (an OpenAI vector store and/or a local
+index directory) and groups books into series, so one deployment can serve a
+whole catalog. Local index handles are loaded on first use and kept in an LRU
+cache so memory stays bounded as the catalog grows.
+
+books.json:
+    {
+      "default_book": "way-of-kings",
+      "books": {
+        "way-of-kings": {"title": "The Way of Kings", "series_id": "stormlight",
+                         "vector_store_id": "vs_...", "local_index_dir": "local_index/way-of-kings",
+                         "entity_index": "entities/way-of-kings.json"}
+      }
+    }
+"""
+
+import fcntl
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+DEFAULT_REGISTRY_PATH = "books.json"
+DEFAULT_BOOK_ID = "default"
+
+
+class UnknownBookError(KeyError):
+    """A book or series ID that is not in the registry"""
+
+    def __str__(self) -> str:
+        return self.args[0] if self.args else "Unknown book"
+
+
+@contextmanager
+def registry_lock(path: str = DEFAULT_REGISTRY_PATH) -> Iterator[None]:
+    """
+    Exclusive lock on books.json's sidecar lock file, held across a reload,
+    register and save so writers in other processes do not drop each other's books.
+    """
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class BookRegistry:
+    """Book ID -> {title, series_id, vector_store_id, local_index_dir, entity_index}"""
+
+    def __init__(self, books: Optional[dict] = None, default_book: Optional[str] = None):
+        self.books = {}
+        for book_id, entry in (books or {}).items():
+            self.books[book_id] = dict(entry, book_id=book_id)
+        self.default_book = default_book or next(iter(sorted(self.books)), None)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_REGISTRY_PATH) -> "BookRegistry":
+        """Read books.json; a missing file is an empty registry."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(data.get("books", {}), data.get("default_book"))
+
+    def save(self, path: str = DEFAULT_REGISTRY_PATH) -> None:
+        # Write to a temp file first so a reader never sees a half-written registry
+        books = {book_id: {k: v for k, v in entry.items() if k != "book_id"}
+                 for book_id, entry in sorted(self.books.items())}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"default_book": self.default_book, "books": books}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def register(self, book_id: str, **fields) -> dict:
+        """Add or update a book; fields left as None keep their current value."""
+        entry = self.books.setdefault(book_id, {"book_id": book_id})
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        if self.default_book is None:
+            self.default_book = book_id
+        return entry
+
+    def ensure_default(self, vector_store_id: Optional[str] = None,
+                       local_index_dir: Optional[str] = None, entity_index: Optional[str] = None) -> None:
+        """With no books registered, serve the single-book setup (vector_store_id.txt / LOCAL_INDEX_DIR)."""
+        if not self.books:
+            self.register(DEFAULT_BOOK_ID, title="", vector_store_id=vector_store_id,
+                          local_index_dir=local_index_dir, entity_index=entity_index)
+
+    def get(self, book_id: str) -> dict:
+        try:
+            return self.books[book_id]
+        except KeyError:
+            raise UnknownBookError(f"Unknown book: {book_id}") from None
+
+    def series(self, series_id: str) -> List[dict]:
+        books = [entry for _, entry in sorted(self.books.items()) if entry.get("series_id") == series_id]
+        if not books:
+            raise UnknownBookError(f"Unknown series: {series_id}")
+        return books
+
+    def resolve(self, book_id: Optional[str] = None, series_id: Optional[str] = None) -> List[dict]:
+        """Books a query should search: one book, every book in a series, or the default book."""
+        if book_id:
+            book = self.get(book_id)
+            if series_id and book.get("series_id") != series_id:
+                raise UnknownBookError(f"Book {book_id} is not in series {series_id}")
+            return [book]
+        if series_id:
+            return self.series(series_id)
+        if self.default_book is None:
+            raise UnknownBookError("No books registered")
+        return [self.get(self.default_book)]
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+
+def _load_local_index(index_dir: str):
+    from local_index import LocalIndex
+    return LocalIndex.load(index_dir)
+
+
+class IndexCache:
+    """LRU cache of loaded local index handles, keyed by index directory"""
+
+    def __init__(self, max_entries: int = 4, loader: Callable = _load_local_index):
+        self.max_entries = max_entries
+        self.loader = loader
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, index_dir: str):
+        """The cached handle (marked as recently used), or None without loading."""
+        with self._lock:
+            index = self._entries.get(index_dir)
+            if index is not None:
+                self._entries.move_to_end(index_dir)
+                self.hits += 1
+            return index
+
+    def get(self, index_dir: str):
+        """The handle for index_dir, loading it (and evicting the least recently used) on a miss."""
+        index = self.peek(index_dir)
+        if index is not None:
+            return index
+
+        # Loads run outside the lock so one slow load does not block hits on other books
+        index = self.loader(index_dir)
+        with self._lock:
+            self.misses += 1
+            if index_dir in self._entries:
+                return self._entries[index_dir]
+            self._entries[index_dir] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return index
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
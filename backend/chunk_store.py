@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Chunk Store for Book Companion
+A compact on-disk format for the extracted corpus: one contiguous UTF-8 text blob,
+an offsets array and a metadata table. Readers memory-map the files so every
+worker process shares the same pages instead of loading thousands of strings.
+
+Layout of a store directory:
+    text.bin     UTF-8 text of every record, back to back
+    offsets.bin  int64 byte offsets, one per record plus a final end offset
+    records.bin  int32 (source id, title id, page number) triples, one per record
+    meta.json    format version, record count and the source/title string tables
+"""
+
+import argparse
+import json
+import mmap
+import re
+import sys
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional
+
+FORMAT_VERSION = 1
+
+TEXT_FILENAME = "text.bin"
+OFFSETS_FILENAME = "offsets.bin"
+RECORDS_FILENAME = "records.bin"
+META_FILENAME = "meta.json"
+
+PAGE_FILENAME_RE = re.compile(r"page_(\d+)\.txt$")
+
+
+class ChunkStoreWriter:
+    """Append-only writer that streams text straight to the blob file"""
+
+    def __init__(self, store_dir: str):
+        self.store_path = Path(store_dir)
+        self.store_path.mkdir(parents=True, exist_ok=True)
+
+        self._text_file = open(self.store_path / TEXT_FILENAME, "wb")
+        self._offsets = array("q", [0])
+        self._records = array("i")
+        self._sources = {}
+        self._titles = {"": 0}
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _intern(self, table: dict, value: str) -> int:
+        if value not in table:
+            table[value] = len(table)
+        return table[value]
+
+    def add(self, text: str, source: str, title: str = "", page: int = 0) -> int:
+        """Append one record and return its index."""
+        data = text.encode("utf-8")
+        self._text_file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._records.extend((
+            self._intern(self._sources, source),
+            self._intern(self._titles, title or ""),
+            page or 0,
+        ))
+        return len(self) - 1
+
+    def close(self) -> None:
+        """Flush the blob and write the offsets, records and metadata files."""
+        if self._closed:
+            return
+        self._text_file.close()
+
+        with open(self.store_path / OFFSETS_FILENAME, "wb") as f:
+            self._offsets.tofile(f)
+        with open(self.store_path / RECORDS_FILENAME, "wb") as f:
+            self._records.tofile(f)
+
+        meta = {
+            "version": FORMAT_VERSION,
+            "count": len(self),
+            "sources": list(self._sources),
+            "titles": list(self._titles),
+        }
+        with open(self.store_path / META_FILENAME, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _mmap_file(path: Path):
+    """Memory-map a file read-only; empty files cannot be mapped."""
+    with open(path, "rb") as f:
+        if path.stat().st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view over a chunk store directory"""
+
+    def __init__(self, store_dir: str):
+        self.store_path = Path(store_dir)
+        with open(self.store_path / META_FILENAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {meta.get('version')}")
+
+        self.sources = meta["sources"]
+        self.titles = meta["titles"]
+        self._count = meta["count"]
+
+        self._text = _mmap_file(self.store_path / TEXT_FILENAME)
+        self._offsets_map = _mmap_file(self.store_path / OFFSETS_FILENAME)
+        self._records_map = _mmap_file(self.store_path / RECORDS_FILENAME)
+        self._offsets = memoryview(self._offsets_map).cast("q")
+        self._records = memoryview(self._records_map).cast("i") if self._count else []
+
+    def __len__(self) -> int:
+        return self._count
+
+    def text(self, i: int) -> str:
+        """Decode the text of record i."""
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._text[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    __getitem__ = text
+
+    def record(self, i: int) -> dict:
+        """Metadata for record i (without the text)."""
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        source_id, title_id, page = self._records[3 * i:3 * i + 3]
+        return {
+            "id": i,
+            "source": self.sources[source_id],
+            "title": self.titles[title_id],
+            "page": page,
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(self._count):
+            yield dict(self.record(i), text=self.text(i))
+
+    def close(self) -> None:
+        self._offsets.release()
+        if self._count:
+            self._records.release()
+        for mapped in (self._text, self._offsets_map, self._records_map):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_summary_titles(directory: Path) -> dict:
+    """Map filename -> title from an extractor's extraction_summary.txt."""
+    titles = {}
+    summary_path = directory / "extraction_summary.txt"
+    if not summary_path.exists():
+        return titles
+
+    filename = None
+    with open(summary_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("Filename: "):
+                filename = line[len("Filename: "):]
+            elif line.startswith("Title: ") and filename:
+                titles[filename] = line[len("Title: "):]
+    return titles
+
+
+def build_chunk_store(store_dir: str, corpus_dirs: Optional[list] = None) -> int:
+    """Pack existing per-chapter/per-page .txt files into a chunk store."""
+    from local_index import CORPUS_DIRS, SUMMARY_FILENAME
+
+    with ChunkStoreWriter(store_dir) as writer:
+        for directory in corpus_dirs or CORPUS_DIRS:
+            dir_path = Path(directory)
+            if not dir_path.exists():
+                continue
+            titles = read_summary_titles(dir_path)
+            for file_path in sorted(dir_path.glob("*.txt")):
+                if file_path.name == SUMMARY_FILENAME:
+                    continue
+                page_match = PAGE_FILENAME_RE.search(file_path.name)
+                writer.add(
+                    file_path.read_text(encoding="utf-8"),
+                    source=file_path.name,
+                    title=titles.get(file_path.name, ""),
+                    page=int(page_match.group(1)) if page_match else 0,
+                )
+        return len(writer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack extracted text files into a memory-mapped chunk store')
+    parser.add_argument('dirs', nargs='*',
+                       help='Directories of extracted .txt files (default: epub and pdf output directories)')
+    parser.add_argument('-o', '--output', default='corpus_store',
+                       help='Output directory for the chunk store (default: corpus_store)')
+
+    args = parser.parse_args()
+
+    count = build_chunk_store(args.output, args.dirs or None)
+    if not count:
+        print("Error: no extracted text files found")
+        sys.exit(1)
+    print(f"Packed {count} records into {Path(args.output).absolute()}")
+
+
+if __name__ == "__main__":
+    main()
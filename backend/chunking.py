@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Chunking Stage for Book Companion
+Turns extractor output (per-chapter / per-page .txt files or a chunk store) into
+token-bounded, overlapping, sentence-aware chunks with chapter and page provenance.
+Consecutive PDF pages are chunked as one stream, so sentences cut at a page break
+are rejoined and a chunk records the page span it covers.
+
+The output feeds both retrieval paths:
+    - JSONL (default) for the local index:      rag_setup.py --local --chunks chunks.jsonl
+    - a directory of .txt files for uploading:  rag_setup.py --corpus-dir chunks/
+"""
+
+import argparse
+import bisect
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from chunk_store import PAGE_FILENAME_RE, ChunkStore, ChunkStoreWriter, read_summary_titles
+from local_index import CORPUS_DIRS, SUMMARY_FILENAME
+
+TOKEN_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional (and may be unable to fetch its encoding offline)
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """Model tokens with tiktoken if available, else words + punctuation as an estimate."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode_ordinary(text))
+    return len(TOKEN_ESTIMATE_RE.findall(text))
+
+
+# Terminal punctuation plus any closing quotes/brackets, followed by whitespace
+SENTENCE_END_RE = re.compile(r"[.!?…]+[”\"’')\]]*(?=\s)")
+
+
+def split_sentences(text: str) -> List[tuple]:
+    """Split text into (start, end) character spans of sentences."""
+    spans = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        end = match.end()
+        if text[start:end].strip():
+            spans.append((start, end))
+        start = end
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+
+def iter_records(corpus_dirs: Optional[List[str]] = None, store_dir: Optional[str] = None) -> Iterator[dict]:
+    """Yield extractor records ({source, title, page, text}) from .txt directories or a chunk store."""
+    if store_dir:
+        with ChunkStore(store_dir) as store:
+            yield from store
+        return
+
+    for directory in corpus_dirs or CORPUS_DIRS:
+        dir_path = Path(directory)
+        if not dir_path.exists():
+            continue
+        titles = read_summary_titles(dir_path)
+        for file_path in sorted(dir_path.glob("*.txt")):
+            if file_path.name == SUMMARY_FILENAME:
+                continue
+            page_match = PAGE_FILENAME_RE.search(file_path.name)
+            yield {
+                "source": file_path.name,
+                "title": titles.get(file_path.name, ""),
+                "page": int(page_match.group(1)) if page_match else 0,
+                "text": file_path.read_text(encoding="utf-8"),
+            }
+
+
+def group_records(records: Iterable[dict]) -> Iterator[List[dict]]:
+    """Group records into chunking streams: each chapter alone, consecutive pages together."""
+    group = []
+    for record in records:
+        continues_pages = (
+            group and record["page"] and group[-1]["page"]
+            and record["page"] == group[-1]["page"] + 1
+        )
+        if group and not continues_pages:
+            yield group
+            group = []
+        group.append(record)
+    if group:
+        yield group
+
+
+def _split_long_sentence(text: str, max_tokens: int) -> List[str]:
+    """Break a sentence longer than max_tokens into word-aligned pieces."""
+    pieces, current, current_tokens = [], [], 0
+    for word in text.split():
+        # Counted a word at a time, so a long sentence costs one pass rather than one per word
+        tokens = count_tokens(word)
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_group(group: List[dict], max_tokens: int = 256, overlap_tokens: int = 32) -> Iterator[dict]:
+    """Pack the sentences of one stream into overlapping chunks of at most max_tokens."""
+    # Join the stream and remember where each record starts, for provenance
+    texts, starts, offset = [], [], 0
+    for record in group:
+        starts.append(offset)
+        texts.append(record["text"])
+        offset += len(record["text"]) + 1
+    stream = " ".join(texts)
+
+    def record_at(position: int) -> dict:
+        return group[bisect.bisect_right(starts, position) - 1]
+
+    # (text, tokens, record where it starts, record where it ends)
+    sentences = []
+    for start, end in split_sentences(stream):
+        raw = stream[start:end]
+        text = raw.strip()
+        # Spans begin with the whitespace after the previous sentence, which may be the page join
+        first, last = record_at(start + len(raw) - len(raw.lstrip())), record_at(end - 1)
+        tokens = count_tokens(text)
+        if tokens > max_tokens:
+            for piece in _split_long_sentence(text, max_tokens):
+                sentences.append((piece, count_tokens(piece), first, last))
+        else:
+            sentences.append((text, tokens, first, last))
+
+    def make_chunk(parts: list) -> dict:
+        first, last = parts[0][2], parts[-1][3]
+        text = " ".join(p[0] for p in parts)
+        return {
+            "source": first["source"],
+            "title": first.get("title", ""),
+            "page_start": first["page"],
+            "page_end": last["page"],
+            "tokens": count_tokens(text),
+            "text": text,
+        }
+
+    current, current_tokens = [], 0
+    for sentence in sentences:
+        if current and current_tokens + sentence[1] > max_tokens:
+            yield make_chunk(current)
+            # Carry trailing sentences forward as overlap
+            carried, carried_tokens = [], 0
+            for prev in reversed(current):
+                if carried_tokens + prev[1] > overlap_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev[1]
+            # Overlap gives way to the next sentence rather than push the chunk over max_tokens
+            while carried and carried_tokens + sentence[1] > max_tokens:
+                carried_tokens -= carried.pop(0)[1]
+            current, current_tokens = carried, carried_tokens
+        current.append(sentence)
+        current_tokens += sentence[1]
+    if current:
+        yield make_chunk(current)
+
+
+def chunk_corpus(corpus_dirs: Optional[List[str]] = None, store_dir: Optional[str] = None,
+                 max_tokens: int = 256, overlap_tokens: int = 32) -> List[dict]:
+    """Chunk the whole corpus; every chunk gets a sequential id."""
+    chunks = []
+    for group in group_records(iter_records(corpus_dirs, store_dir)):
+        for chunk in chunk_group(group, max_tokens, overlap_tokens):
+            chunk["id"] = len(chunks)
+            chunks.append(chunk)
+    return chunks
+
+
+def chunk_label(chunk: dict) -> str:
+    """Human-readable provenance, e.g. "chapter_003.txt" or "pages 12-13"."""
+    if chunk["page_start"]:
+        if chunk["page_end"] != chunk["page_start"]:
+            return f"pages {chunk['page_start']}-{chunk['page_end']}"
+        return f"page {chunk['page_start']}"
+    return chunk["title"] or chunk["source"]
+
+
+def write_jsonl(chunks: List[dict], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_chunk_dir(chunks: List[dict], output_dir: str) -> None:
+    """One .txt file per chunk, with a provenance header line, for vector store uploads."""
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    for stale in output_path.glob("*.txt"):
+        stale.unlink()
+
+    counters = {}
+    for chunk in chunks:
+        stem = Path(chunk["source"]).stem
+        counters[stem] = counters.get(stem, 0) + 1
+        with open(output_path / f"{stem}_{counters[stem]:03d}.txt", "w", encoding="utf-8") as f:
+            f.write(f"[{chunk_label(chunk)}]\n{chunk['text']}")
+
+
+def write_chunk_store(chunks: List[dict], store_dir: str) -> None:
+    with ChunkStoreWriter(store_dir) as writer:
+        for chunk in chunks:
+            writer.add(chunk["text"], source=chunk["source"], title=chunk["title"], page=chunk["page_start"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split extracted text into token-bounded, sentence-aware chunks')
+    parser.add_argument('dirs', nargs='*',
+                       help='Directories of extracted .txt files (default: epub and pdf output directories)')
+    parser.add_argument('--store', default=None, help='Read records from a chunk store instead of .txt files')
+    parser.add_argument('--max-tokens', type=int, default=256, help='Maximum tokens per chunk (default: 256)')
+    parser.add_argument('--overlap', type=int, default=32,
+                       help='Tokens of trailing sentences repeated in the next chunk (default: 32)')
+    parser.add_argument('-o', '--output', default='chunks.jsonl', help='JSONL output path (default: chunks.jsonl)')
+    parser.add_argument('--dir', default=None, help='Also write one .txt file per chunk to this directory')
+    parser.add_argument('--chunk-store', default=None, help='Also write the chunks to a chunk store')
+
+    args = parser.parse_args()
+
+    if args.overlap >= args.max_tokens:
+        print("Error: --overlap must be smaller than --max-tokens")
+        sys.exit(1)
+
+    chunks = chunk_corpus(args.dirs or None, args.store, args.max_tokens, args.overlap)
+    if not chunks:
+        print("Error: no extracted text found")
+        sys.exit(1)
+
+    write_jsonl(chunks, args.output)
+    if args.dir:
+        write_chunk_dir(chunks, args.dir)
+    if args.chunk_store:
+        write_chunk_store(chunks, args.chunk_store)
+
+    total_tokens = sum(c["tokens"] for c in chunks)
+    print(f"Wrote {len(chunks)} chunks ({total_tokens} tokens, "
+          f"{total_tokens / len(chunks):.0f} per chunk) to {args.output}")
+    counter = "tiktoken o200k_base" if _ENCODING is not None else "estimated (install tiktoken for exact counts)"
+    print(f"Token counts: {counter}")
+
+
+if __name__ == "__main__":
+    main()
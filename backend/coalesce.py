@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Request Coalescing for Book Companion
+Concurrent requests for the same answer (same normalized question, books and
+model) share one upstream call: the first becomes the leader of a "flight",
+the rest follow it and receive the same events - streamed deltas, then the
+final answer or the error.
+
+The leader's work runs in its own task, so a client that disconnects does not
+cut off the others. SQLite calls run in threads, so a busy database file
+delays only the flights waiting on it, not the worker's event loop. Within a
+process, followers read the flight's events from memory. With the SQLite
+backend, workers on the same host coordinate through a shared database: a
+flight row makes one worker the leader (the row is taken over if its process
+has died), the leader appends its events, and followers in other workers poll
+them. Events belong to one flight (an ID issued when the flight is claimed),
+so a new flight for the same question never mixes its events with, or clears,
+the events an earlier flight's followers are still reading.
+
+Events are (kind, data) pairs:
+    ("delta", {"text": ...})   part of a streamed answer
+    ("done", result)           the final result
+    ("error", {"http", "status", "detail", "headers"})
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from metrics import COALESCED_REQUESTS
+
+TERMINAL_EVENTS = ("done", "error")
+SCHEMA_VERSION = 2  # 2: events keyed by flight ID rather than by question key
+
+
+def error_event(error: Exception) -> dict:
+    """An exception as error event data; in-process followers also get the exception itself."""
+    return {
+        "http": hasattr(error, "status_code"),
+        "status": getattr(error, "status_code", 500),
+        "detail": getattr(error, "detail", None) or str(error),
+        "headers": getattr(error, "headers", None),
+        "exception": error,
+    }
+
+
+class Flight:
+    """One upstream call and the events it has produced so far"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def publish(self, kind: str, data: dict) -> None:
+        self.events.append((kind, data))
+        if kind in TERMINAL_EVENTS:
+            self.finished = True
+        # Wake everyone waiting on the old event; later waiters get a fresh one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[tuple]:
+        """Every event of the flight, from the first, until it finishes."""
+        seen = 0
+        while True:
+            while seen < len(self.events):
+                seen += 1
+                yield self.events[seen - 1]
+            if self.finished:
+                return
+            await self._changed.wait()
+
+
+class SQLiteFlightStore:
+    """Flight leadership and events in a SQLite file shared by the workers on a host"""
+
+    def __init__(self, path: str = "inflight.sqlite3", max_age: float = 300.0, retention: float = 60.0):
+        self.path = path
+        self.max_age = max_age
+        self.retention = retention
+        self.pid = os.getpid()
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # Only in-flight state lives here; an older layout is dropped rather than migrated
+            conn.execute("DROP TABLE IF EXISTS flights")
+            conn.execute("DROP TABLE IF EXISTS flight_events")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("CREATE TABLE IF NOT EXISTS flights ("
+                     " key TEXT PRIMARY KEY, flight_id TEXT, pid INTEGER, started_at REAL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flight_events ("
+            " flight_id TEXT, seq INTEGER, kind TEXT, data TEXT, created_at REAL, PRIMARY KEY (flight_id, seq))"
+        )
+        conn.execute("COMMIT")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads; isolation_level=None so
+        # BEGIN IMMEDIATE below is the only transaction
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _process_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _leader_alive(self, row) -> bool:
+        pid, started_at = row
+        return time.time() - started_at < self.max_age and self._process_alive(pid)
+
+    def claim(self, key: str) -> Tuple[bool, str]:
+        """
+        Become the leader for key unless a live leader holds it. Returns (True,
+        the new flight's ID) or (False, the live leader's flight ID to follow).
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT pid, started_at, flight_id FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._leader_alive(row[:2]):
+                conn.execute("ROLLBACK")
+                return False, row[2]
+            flight_id = uuid.uuid4().hex
+            conn.execute("INSERT OR REPLACE INTO flights (key, flight_id, pid, started_at) VALUES (?, ?, ?, ?)",
+                         (key, flight_id, self.pid, now))
+            # Finished flights' events, once their followers have had time to read them
+            conn.execute("DELETE FROM flight_events WHERE created_at < ? "
+                         "AND flight_id NOT IN (SELECT flight_id FROM flights)", (now - self.retention,))
+            conn.execute("COMMIT")
+            return True, flight_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append(self, flight_id: str, seq: int, kind: str, data: dict) -> None:
+        data = {k: v for k, v in data.items() if k != "exception"}
+        self._conn().execute(
+            "INSERT OR REPLACE INTO flight_events (flight_id, seq, kind, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (flight_id, seq, kind, json.dumps(data), time.time()),
+        )
+
+    def release(self, key: str, flight_id: str) -> None:
+        """End the leader's hold on key; its events stay readable for the retention period."""
+        self._conn().execute("DELETE FROM flights WHERE key = ? AND flight_id = ?", (key, flight_id))
+
+    def events_since(self, flight_id: str, seq: int) -> list:
+        rows = self._conn().execute(
+            "SELECT seq, kind, data FROM flight_events WHERE flight_id = ? AND seq > ? ORDER BY seq", (flight_id, seq)
+        ).fetchall()
+        return [(s, kind, json.loads(data)) for s, kind, data in rows]
+
+    def leader_alive(self, key: str, flight_id: str) -> bool:
+        """Whether flight_id still holds key and its process is alive."""
+        row = self._conn().execute("SELECT pid, started_at FROM flights WHERE key = ? AND flight_id = ?",
+                                   (key, flight_id)).fetchone()
+        return row is not None and self._leader_alive(row)
+
+
+class Coalescer:
+    """Runs each distinct in-flight request once and fans its events out to every caller"""
+
+    def __init__(self, store: Optional[SQLiteFlightStore] = None, poll_seconds: float = 0.05):
+        self.store = store
+        self.poll_seconds = poll_seconds
+        self._flights = {}
+        self._tasks = set()
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key: str, produce: Callable[[], AsyncIterator[tuple]]) -> AsyncIterator[tuple]:
+        """
+        Yield the events of the flight for key, starting one with produce() if
+        none is in the air. produce() is an async generator of events ending
+        with a "done" event; an exception it raises becomes an "error" event.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Flight()
+            self._start(self._drive(key, flight, produce))
+        else:
+            self.followers += 1
+            COALESCED_REQUESTS.inc(scope="process")
+
+        async for event in flight.subscribe():
+            yield event
+
+    def _start(self, coroutine) -> None:
+        # Keep a reference so the task is not garbage collected mid-flight
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drive(self, key: str, flight: Flight, produce: Callable[[], AsyncIterator[tuple]]) -> None:
+        try:
+            flight_id = None
+            if self.store is not None:
+                counted = False
+                while True:
+                    leading, flight_id = await asyncio.to_thread(self.store.claim, key)
+                    if leading:
+                        break
+                    if not counted:
+                        self.followers += 1
+                        COALESCED_REQUESTS.inc(scope="host")
+                        counted = True
+                    if await self._follow_store(key, flight_id, flight):
+                        return
+                    # The other worker died before its first event; try to answer here instead
+            await self._lead(key, flight_id, flight, produce)
+        except Exception as e:
+            if not flight.finished:
+                flight.publish("error", error_event(e))
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def _lead(self, key: str, flight_id: Optional[str], flight: Flight,
+                    produce: Callable[[], AsyncIterator[tuple]]) -> None:
+        self.leaders += 1
+        seq, pending, flushed_at = 0, "", time.monotonic()
+
+        async def share(kind: str, data: dict) -> None:
+            nonlocal seq
+            seq += 1
+            await asyncio.to_thread(self.store.append, flight_id, seq, kind, data)
+
+        try:
+            try:
+                async for kind, data in produce():
+                    flight.publish(kind, data)
+                    if self.store is None:
+                        continue
+                    # Deltas are written in batches, at most once per poll interval
+                    if kind == "delta":
+                        pending += data["text"]
+                        if time.monotonic() - flushed_at < self.poll_seconds:
+                            continue
+                        kind, data = "delta", {"text": pending}
+                    elif pending:
+                        await share("delta", {"text": pending})
+                    pending, flushed_at = "", time.monotonic()
+                    await share(kind, data)
+            except Exception as e:
+                event = error_event(e)
+                flight.publish("error", event)
+                if self.store is not None:
+                    if pending:
+                        await share("delta", {"text": pending})
+                    await share("error", event)
+        finally:
+            if self.store is not None:
+                await asyncio.to_thread(self.store.release, key, flight_id)
+
+    async def _follow_store(self, key: str, flight_id: str, flight: Flight) -> bool:
+        """
+        Republish another worker's flight events into the local flight. False if
+        that worker disappeared before producing anything (the caller may retry).
+        """
+        seq = 0
+        while True:
+            for seq, kind, data in await asyncio.to_thread(self.store.events_since, flight_id, seq):
+                flight.publish(kind, data)
+                if kind in TERMINAL_EVENTS:
+                    return True
+            if not await asyncio.to_thread(self.store.leader_alive, key, flight_id):
+                # Events written just before the leader let go
+                for seq, kind, data in await asyncio.to_thread(self.store.events_since, flight_id, seq):
+                    flight.publish(kind, data)
+                    if kind in TERMINAL_EVENTS:
+                        return True
+                if flight.events:
+                    flight.publish("error", {"http": True, "status": 502,
+                                            "detail": "The worker answering this question stopped"})
+                    return True
+                return False
+            await asyncio.sleep(self.poll_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite" if self.store is not None else "memory",
+            "in_flight": len(self._flights),
+            "upstream_calls": self.leaders,
+            "coalesced_requests": self.followers,
+        }
+
+
+def create_coalescer(config) -> Optional[Coalescer]:
+    """The coalescer described by config, or None if coalescing is disabled."""
+    if config.COALESCE_BACKEND == "none":
+        return None
+    store = None
+    if config.COALESCE_BACKEND == "sqlite":
+        # A flight older than a whole model call with retries is presumed stuck
+        max_age = config.OPENAI_TIMEOUT * (config.OPENAI_MAX_RETRIES + 1) + 30
+        store = SQLiteFlightStore(config.COALESCE_SQLITE_PATH, max_age=max_age)
+    return Coalescer(store, config.COALESCE_POLL_SECONDS)
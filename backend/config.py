@@ -7,12 +7,153 @@ class Config:
     # OpenAI Configuration
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    OPENAI_BASE_URL: Optional[str] = os.getenv("OPENAI_BASE_URL") or None
+
+    # Client / Concurrency Configuration
+    OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    OPENAI_MAX_KEEPALIVE: int = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "32"))
+
+    # Batch Configuration (/ask/batch)
+    BATCH_MAX_QUERIES: int = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))  # per batch, within MAX_CONCURRENT_REQUESTS
+
+    # Upload Configuration (rag_setup.py)
+    UPLOAD_MAX_CONCURRENCY: int = int(os.getenv("UPLOAD_MAX_CONCURRENCY", "16"))
+    UPLOAD_MAX_RETRIES: int = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))
+
+    # Retrieval Configuration
+    RETRIEVAL_BACKEND: str = os.getenv("RETRIEVAL_BACKEND", "openai")  # "openai" or "local"
+    LOCAL_INDEX_DIR: str = os.getenv("LOCAL_INDEX_DIR", "local_index")
+    RETRIEVAL_TOP_K: int = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+    # Retrieval pipeline (see retrieval.py): candidates per retriever, reranker and context budget
+    RETRIEVAL_CANDIDATES: int = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+    RERANKER: str = os.getenv("RERANKER", "none")  # "none", "lexical" or "cross-encoder"
+    RERANK_MODEL: str = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # 0 = RETRIEVAL_TOP_K only
+    # Single-book questions on the openai backend: let the model search with the file_search tool
+    # instead (no reranking, budget or chapter titles)
+    OPENAI_FILE_SEARCH: bool = os.getenv("OPENAI_FILE_SEARCH", "").lower() in ("1", "true", "yes")
+    # Multi-book catalog: book ID -> vector store / local index (see book_registry.py)
+    BOOK_REGISTRY_PATH: str = os.getenv("BOOK_REGISTRY_PATH", "books.json")
+    INDEX_CACHE_SIZE: int = int(os.getenv("INDEX_CACHE_SIZE", "4"))  # local indexes kept loaded
+    # Local index embeddings (see vector_index.py): "float32", "int8" (4x smaller) or "pq" (product quantization)
+    LOCAL_EMBEDDING_CODEC: str = os.getenv("LOCAL_EMBEDDING_CODEC", "int8")
+    LOCAL_PQ_SUBSPACES: int = int(os.getenv("LOCAL_PQ_SUBSPACES", "0"))  # 0 = about one per 16 dimensions
+    # Quantized candidates re-scored exactly against the float32 vectors; 0 = no re-scoring
+    LOCAL_RESCORE_CANDIDATES: int = int(os.getenv("LOCAL_RESCORE_CANDIDATES", "100"))
+    # Passage embeddings by chunk hash, so rebuilds only embed changed chunks; empty disables the cache
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+    # Entity index (see entity_index.py) of the single-book setup; registered books name their own
+    ENTITY_INDEX_PATH: str = os.getenv("ENTITY_INDEX_PATH", "entity_index.json")
+    # Answer "where does X first appear" / "how often is X mentioned" from the entity index without the model
+    ENTITY_ANSWERS: bool = os.getenv("ENTITY_ANSWERS", "true").lower() in ("1", "true", "yes")
+    # Load the index when main.py is imported, for fork-based servers (gunicorn --preload)
+    PRELOAD_INDEX: bool = os.getenv("PRELOAD_INDEX", "").lower() in ("1", "true", "yes")
+
+    # Model Routing Configuration (see routing.py): lookups get the small model and fewer passages
+    ROUTING: bool = os.getenv("ROUTING", "true").lower() in ("1", "true", "yes")
+    LOOKUP_MODEL: str = os.getenv("LOOKUP_MODEL", OPENAI_MODEL)
+    LOOKUP_TOP_K: int = int(os.getenv("LOOKUP_TOP_K", "3"))
+    LOOKUP_MAX_OUTPUT_TOKENS: int = int(os.getenv("LOOKUP_MAX_OUTPUT_TOKENS", "400"))  # 0 = no cap
+    ANALYSIS_MODEL: str = os.getenv("ANALYSIS_MODEL", "gpt-4o")  # also the only model with ROUTING off
+    ANALYSIS_MAX_OUTPUT_TOKENS: int = int(os.getenv("ANALYSIS_MAX_OUTPUT_TOKENS", "1500"))  # 0 = no cap
+    # Prompt, passages and answer of one question; passages get what the output cap leaves
+    REQUEST_TOKEN_BUDGET: int = int(os.getenv("REQUEST_TOKEN_BUDGET", "6000"))
+    TOKENS_PER_MINUTE: int = int(os.getenv("TOKENS_PER_MINUTE", "0"))  # per process; 0 = unlimited
+    # JSONL log of routing decisions, e.g. routing_decisions.jsonl; off by default since entries include questions
+    ROUTING_LOG_PATH: str = os.getenv("ROUTING_LOG_PATH", "")
+    ROUTING_LOG_MAX_MB: int = int(os.getenv("ROUTING_LOG_MAX_MB", "50"))  # rotated beyond this size
+    ROUTING_LOG_BACKUPS: int = int(os.getenv("ROUTING_LOG_BACKUPS", "3"))  # rotated files kept
+
+    # Answer Cache Configuration
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")  # "memory", "sqlite" or "none"
+    CACHE_TTL_SECONDS: float = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+    CACHE_SQLITE_PATH: str = os.getenv("CACHE_SQLITE_PATH", "answer_cache.sqlite3")
+    # Cosine similarity for reusing an answer to a similar question; unset disables the semantic tier
+    CACHE_SEMANTIC_THRESHOLD: Optional[float] = (
+        float(os.getenv("CACHE_SEMANTIC_THRESHOLD")) if os.getenv("CACHE_SEMANTIC_THRESHOLD") else None
+    )
     
+    # Request Coalescing Configuration (see coalesce.py): identical in-flight questions share one model call
+    COALESCE_BACKEND: str = os.getenv("COALESCE_BACKEND", "memory")  # "memory", "sqlite" (across workers) or "none"
+    COALESCE_SQLITE_PATH: str = os.getenv("COALESCE_SQLITE_PATH", "inflight.sqlite3")
+    COALESCE_POLL_SECONDS: float = float(os.getenv("COALESCE_POLL_SECONDS", "0.05"))
+
+    # Session Configuration (see sessions.py): follow-up questions that share a session_id
+    SESSION_MODE: str = os.getenv("SESSION_MODE", "chain")  # "chain" (previous_response_id) or "local"
+    SESSION_MAX: int = int(os.getenv("SESSION_MAX", "1000"))  # sessions kept per worker, LRU beyond that
+    SESSION_TTL_SECONDS: float = float(os.getenv("SESSION_TTL_SECONDS", "1800"))  # idle time before expiry
+    SESSION_HISTORY_TURNS: int = int(os.getenv("SESSION_HISTORY_TURNS", "4"))  # turns repeated in local mode
+    SESSION_MAX_PASSAGES: int = int(os.getenv("SESSION_MAX_PASSAGES", "50"))  # excerpts remembered per session
+
+    # Ingestion Configuration (see ingest.py): books uploaded to POST /ingest
+    INGEST_DIR: str = os.getenv("INGEST_DIR", "ingest_jobs")  # one directory per job, shared by all workers
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "1"))  # jobs running at once per server worker
+    INGEST_EXTRACT_WORKERS: int = int(os.getenv("INGEST_EXTRACT_WORKERS", "1"))  # extraction processes per job
+    INGEST_MAX_UPLOAD_MB: int = int(os.getenv("INGEST_MAX_UPLOAD_MB", "200"))
+
+    # Observability Configuration
+    # Requests slower than this many seconds are logged; unset disables the slow-request log
+    SLOW_REQUEST_SECONDS: Optional[float] = (
+        float(os.getenv("SLOW_REQUEST_SECONDS")) if os.getenv("SLOW_REQUEST_SECONDS") else None
+    )
+    SLOW_REQUEST_PROFILE_RATE: float = float(os.getenv("SLOW_REQUEST_PROFILE_RATE", "0.05"))
+    SLOW_REQUEST_LOG_DIR: str = os.getenv("SLOW_REQUEST_LOG_DIR", "slow_requests")
+
     @classmethod
-    def validate(cls) -> None:
+    def validate(cls, require_api_key: bool = True) -> None:
         """Validate that required configuration is present"""
-        if not cls.OPENAI_API_KEY:
+        if require_api_key and not cls.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY environment variable is required")
+        if cls.RETRIEVAL_BACKEND not in ("openai", "local"):
+            raise ValueError("RETRIEVAL_BACKEND must be 'openai' or 'local'")
+        if cls.RERANKER not in ("none", "lexical", "cross-encoder"):
+            raise ValueError("RERANKER must be 'none', 'lexical' or 'cross-encoder'")
+        if cls.RETRIEVAL_TOP_K < 1 or cls.RETRIEVAL_CANDIDATES < cls.RETRIEVAL_TOP_K:
+            raise ValueError("RETRIEVAL_TOP_K must be at least 1 and RETRIEVAL_CANDIDATES at least RETRIEVAL_TOP_K")
+        if cls.CONTEXT_TOKEN_BUDGET < 0:
+            raise ValueError("CONTEXT_TOKEN_BUDGET must not be negative")
+        if cls.LOOKUP_TOP_K < 1 or cls.LOOKUP_TOP_K > cls.RETRIEVAL_CANDIDATES:
+            raise ValueError("LOOKUP_TOP_K must be between 1 and RETRIEVAL_CANDIDATES")
+        if cls.LOOKUP_MAX_OUTPUT_TOKENS < 0 or cls.ANALYSIS_MAX_OUTPUT_TOKENS < 0 or cls.TOKENS_PER_MINUTE < 0:
+            raise ValueError("LOOKUP_MAX_OUTPUT_TOKENS, ANALYSIS_MAX_OUTPUT_TOKENS and TOKENS_PER_MINUTE "
+                             "must not be negative")
+        # Leave room for the prompt and at least a few hundred tokens of passages on every route
+        if cls.REQUEST_TOKEN_BUDGET < max(cls.LOOKUP_MAX_OUTPUT_TOKENS, cls.ANALYSIS_MAX_OUTPUT_TOKENS) + 400:
+            raise ValueError("REQUEST_TOKEN_BUDGET must exceed the output-token caps by at least 400")
+        if cls.ROUTING_LOG_MAX_MB < 1 or cls.ROUTING_LOG_BACKUPS < 0:
+            raise ValueError("ROUTING_LOG_MAX_MB must be at least 1 and ROUTING_LOG_BACKUPS not negative")
+        if cls.TOKENS_PER_MINUTE and cls.TOKENS_PER_MINUTE < cls.REQUEST_TOKEN_BUDGET:
+            raise ValueError("TOKENS_PER_MINUTE must be 0 or at least REQUEST_TOKEN_BUDGET")
+        if cls.MAX_CONCURRENT_REQUESTS < 1:
+            raise ValueError("MAX_CONCURRENT_REQUESTS must be at least 1")
+        if cls.INDEX_CACHE_SIZE < 1:
+            raise ValueError("INDEX_CACHE_SIZE must be at least 1")
+        if cls.LOCAL_EMBEDDING_CODEC not in ("float32", "int8", "pq"):
+            raise ValueError("LOCAL_EMBEDDING_CODEC must be 'float32', 'int8' or 'pq'")
+        if cls.LOCAL_PQ_SUBSPACES < 0 or cls.LOCAL_RESCORE_CANDIDATES < 0:
+            raise ValueError("LOCAL_PQ_SUBSPACES and LOCAL_RESCORE_CANDIDATES must not be negative")
+        if cls.BATCH_MAX_QUERIES < 1 or cls.BATCH_CONCURRENCY < 1:
+            raise ValueError("BATCH_MAX_QUERIES and BATCH_CONCURRENCY must be at least 1")
+        if cls.CACHE_BACKEND not in ("memory", "sqlite", "none"):
+            raise ValueError("CACHE_BACKEND must be 'memory', 'sqlite' or 'none'")
+        if cls.SESSION_MODE not in ("chain", "local"):
+            raise ValueError("SESSION_MODE must be 'chain' or 'local'")
+        if cls.SESSION_MAX < 1 or cls.SESSION_HISTORY_TURNS < 1 or cls.SESSION_MAX_PASSAGES < 1:
+            raise ValueError("SESSION_MAX, SESSION_HISTORY_TURNS and SESSION_MAX_PASSAGES must be at least 1")
+        if cls.COALESCE_BACKEND not in ("memory", "sqlite", "none"):
+            raise ValueError("COALESCE_BACKEND must be 'memory', 'sqlite' or 'none'")
+        if cls.COALESCE_POLL_SECONDS <= 0:
+            raise ValueError("COALESCE_POLL_SECONDS must be positive")
+        if cls.INGEST_WORKERS < 1 or cls.INGEST_EXTRACT_WORKERS < 1 or cls.INGEST_MAX_UPLOAD_MB < 1:
+            raise ValueError("INGEST_WORKERS, INGEST_EXTRACT_WORKERS and INGEST_MAX_UPLOAD_MB must be at least 1")
+        if not 0.0 <= cls.SLOW_REQUEST_PROFILE_RATE <= 1.0:
+            raise ValueError("SLOW_REQUEST_PROFILE_RATE must be between 0 and 1")
     
     @classmethod
     def get_openai_config(cls) -> dict:
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Entity Index for Book Companion
+An offline pass over the extracted chapters that finds named entities
+(characters, places, orders) and records, for each one, how often it is
+mentioned, where it first appears and how its mentions spread over the
+chapters. The result is a small JSON file that main.py serves from GET
+/entities and uses in /ask: questions like "where does Cenn first appear?"
+are answered straight from the index, and for other questions the facts about
+any entity they name are added to the model's context.
+
+Names are found without a tagger. A capitalized word counts as a name when it
+is capitalized mid-sentence at least min_mentions times and almost never
+appears in lowercase, which separates "Kaladin" from "The" or "Bridge"; runs
+of capitalized words mid-sentence ("Bridge Four", "Shattered Plains") are
+names of their own.
+
+entity_index.json:
+    {
+      "version": 1,
+      "chapters": [{"source": "chapter_002.txt", "title": "..."}, ...],
+      "entities": {
+        "cenn": {"name": "Cenn", "mentions": 57,
+                 "chapters": [[1, 52, 8120], [2, 5, 301]],   # [chapter, mentions, first offset]
+                 "snippet": "..."}                              # sentence of the first mention
+      }
+    }
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Iterable, List, Optional
+
+FORMAT_VERSION = 1
+DEFAULT_INDEX_PATH = "entity_index.json"
+
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z’'-]*")
+POSSESSIVE_RE = re.compile(r"[’']s?$")
+SENTENCE_END_CHARS = ".!?…"
+# Skipped looking back from a word for the end of the previous sentence
+OPENERS = " \t\n“\"‘'(—"
+CLOSERS = "”\"’')"
+# Dropped from the front of a run: "the Shattered Plains" -> "Shattered Plains"
+RUN_DETERMINERS = frozenset({"The", "A", "An", "Your", "My", "His", "Her", "Their", "Our"})
+# Capitalized mid-sentence often enough (after a quote) but never names
+INTERJECTIONS = frozenset({"Oh", "Ah", "Eh", "Ha", "Hmm", "Ho", "Hey", "Ow", "Ugh"})
+MAX_RUN_WORDS = 3
+SNIPPET_CHARS = 160
+
+# Questions answered from the index alone
+FIRST_APPEARANCE_RE = re.compile(
+    r"\b(?:first (?:appear|appearance|appears|mention|mentioned|introduced|show up|shows up)|"
+    r"(?:appear|appears|mentioned|introduced) (?:for the )?first)\b", re.IGNORECASE
+)
+MENTION_COUNT_RE = re.compile(r"\bhow (?:many times|often)\b", re.IGNORECASE)
+CHAPTER_LIST_RE = re.compile(r"\b(?:which|what) chapters\b", re.IGNORECASE)
+# Chapters listed in a direct answer before "and N more"
+LISTED_CHAPTERS = 10
+
+
+def is_sentence_start(text: str, start: int) -> bool:
+    """Whether the word at start opens a sentence (so its capital letter says nothing)."""
+    j = start - 1
+    while j >= 0 and text[j] in OPENERS:
+        if text[j] == "—":
+            return True
+        j -= 1
+    if j < 0:
+        return True
+    while j >= 0 and text[j] in CLOSERS:
+        j -= 1
+    return j < 0 or text[j] in SENTENCE_END_CHARS
+
+
+def sentence_around(text: str, start: int, end: int) -> str:
+    """The sentence containing text[start:end] (with the one before if it is short), within SNIPPET_CHARS."""
+    limit = max(0, start - SNIPPET_CHARS)
+    boundary = start
+    while True:
+        boundary = max(text.rfind(c, limit, boundary) for c in SENTENCE_END_CHARS)
+        if boundary == -1:
+            left = limit
+            break
+        left = boundary
+        while left + 1 < start and text[left + 1] in CLOSERS:
+            left += 1
+        if start - left >= SNIPPET_CHARS // 4:
+            break
+    right = min((i for i in (text.find(c, end, end + SNIPPET_CHARS) for c in SENTENCE_END_CHARS) if i != -1),
+                default=min(len(text), end + SNIPPET_CHARS) - 1) + 1
+    while right < len(text) and text[right] in CLOSERS:
+        right += 1
+    return text[left:right].lstrip(SENTENCE_END_CHARS + CLOSERS + " ").strip()
+
+
+class EntityIndexBuilder:
+    """Collects capitalized words and runs chapter by chapter, then keeps the ones that are names"""
+
+    def __init__(self, min_mentions: int = 3, max_lowercase_ratio: float = 0.1):
+        self.min_mentions = min_mentions
+        self.max_lowercase_ratio = max_lowercase_ratio
+        self.chapters: List[dict] = []
+        self.lowercase = Counter()
+        # name -> [mid-sentence capitalized count, {chapter: [mentions, first offset]}, snippet]
+        self.candidates = {}
+
+    def _mention(self, name: str, chapter: int, text: str, start: int, end: int, mid_sentence: bool) -> None:
+        entry = self.candidates.get(name)
+        if entry is None:
+            entry = self.candidates[name] = [0, {}, sentence_around(text, start, end)]
+        entry[0] += mid_sentence
+        positions = entry[1].get(chapter)
+        if positions is None:
+            entry[1][chapter] = [1, start]
+        else:
+            positions[0] += 1
+
+    def add(self, record: dict) -> None:
+        """Scan one extracted chapter or page ({source, title, text})."""
+        chapter = len(self.chapters)
+        self.chapters.append({"source": record["source"], "title": record.get("title", "")})
+        text = record["text"]
+        run = []  # (word, start, end) of consecutive mid-sentence capitalized words
+
+        def close_run():
+            words = run[1:] if run and run[0][0] in RUN_DETERMINERS else run
+            if 2 <= len(words) <= MAX_RUN_WORDS:
+                name = " ".join(word for word, _, _ in words)
+                self._mention(name, chapter, text, words[0][1], words[-1][2], True)
+            run.clear()
+
+        for match in WORD_RE.finditer(text):
+            word, start = match.group(), match.start()
+            if not word[0].isupper():
+                self.lowercase[word.lower()] += 1
+                close_run()
+                continue
+
+            possessive = POSSESSIVE_RE.search(word)
+            if possessive:
+                word = word[:possessive.start()]
+            end = start + len(word)
+            # Acronyms, "I", contractions ("I’m") and interjections are not names
+            if len(word) < 2 or word.isupper() or "’" in word or "'" in word or word in INTERJECTIONS:
+                close_run()
+                continue
+
+            mid_sentence = not is_sentence_start(text, start)
+            self._mention(word, chapter, text, start, end, mid_sentence)
+
+            # Runs start mid-sentence and continue across single spaces only; punctuation or a
+            # possessive ends them
+            if run and text[run[-1][2]:start] != " ":
+                close_run()
+            if mid_sentence or run:
+                run.append((word, start, end))
+            if possessive:
+                close_run()
+        close_run()
+
+    def build(self) -> "EntityIndex":
+        entities = {}
+        for name, (mid_count, chapters, snippet) in self.candidates.items():
+            if mid_count < self.min_mentions:
+                continue
+            mentions = sum(count for count, _ in chapters.values())
+            if " " not in name and self.lowercase[name.lower()] > self.max_lowercase_ratio * mentions:
+                continue
+            entities[name.lower()] = {
+                "name": name,
+                "mentions": mentions,
+                "chapters": [[chapter, count, offset] for chapter, (count, offset) in sorted(chapters.items())],
+                "snippet": snippet,
+            }
+        return EntityIndex({"version": FORMAT_VERSION, "chapters": self.chapters, "entities": entities})
+
+
+class EntityIndex:
+    """Loaded entity_index.json with lookups by name and by question"""
+
+    def __init__(self, data: dict):
+        self.chapters = data["chapters"]
+        self.entities = data["entities"]
+        self.max_name_words = max((key.count(" ") + 1 for key in self.entities), default=1)
+
+    @classmethod
+    def load(cls, path: str) -> "EntityIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported entity index version in {path}: {data.get('version')}")
+        return cls(data)
+
+    def save(self, path: str) -> None:
+        # Written to a temp file first so a running server never reads half an index
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "chapters": self.chapters, "entities": self.entities},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def get(self, name: str) -> Optional[dict]:
+        """An entity's facts with chapter sources and titles filled in, or None."""
+        entry = self.entities.get(" ".join(POSSESSIVE_RE.sub("", name).split()).lower())
+        if entry is None:
+            return None
+        chapters = [
+            dict(self.chapters[chapter], mentions=count, offset=offset)
+            for chapter, count, offset in entry["chapters"]
+        ]
+        return {
+            "name": entry["name"],
+            "mentions": entry["mentions"],
+            "first_appearance": dict(chapters[0], snippet=entry["snippet"]),
+            "chapters": chapters,
+        }
+
+    def top(self, limit: int = 20) -> List[dict]:
+        """The most-mentioned entities, without their per-chapter positions."""
+        ranked = sorted(self.entities.values(), key=lambda e: e["mentions"], reverse=True)[:limit]
+        return [
+            {"name": e["name"], "mentions": e["mentions"], "chapter_count": len(e["chapters"]),
+             "first_appearance": self.chapters[e["chapters"][0][0]]}
+            for e in ranked
+        ]
+
+    def find_in_query(self, query: str, limit: int = 3) -> List[str]:
+        """Keys of the entities a question names, longest names first, in question order."""
+        words = [POSSESSIVE_RE.sub("", w).lower() for w in WORD_RE.findall(query)]
+        found, i = [], 0
+        while i < len(words) and len(found) < limit:
+            for n in range(min(self.max_name_words, len(words) - i), 0, -1):
+                key = " ".join(words[i:i + n])
+                if key in self.entities:
+                    if key not in found:
+                        found.append(key)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def describe(self, key: str) -> str:
+        """One line of facts about an entity for the model's context."""
+        entry = self.entities[key]
+        chapters = [chapter_label(self.chapters[chapter]) for chapter, _, _ in entry["chapters"][:LISTED_CHAPTERS]]
+        more = len(entry["chapters"]) - len(chapters)
+        return (
+            f"{entry['name']}: mentioned {entry['mentions']} times in {len(entry['chapters'])} chapters "
+            f"({', '.join(chapters)}{f' and {more} more' if more else ''}); "
+            f"first mention: \"{entry['snippet']}\""
+        )
+
+    def answer(self, query: str) -> Optional[tuple]:
+        """
+        (answer, chapters cited) for a question the index answers on its own:
+        where an entity first appears, how often it is mentioned or in which
+        chapters. None for anything else, or when the question names no entity.
+        """
+        if FIRST_APPEARANCE_RE.search(query):
+            kind = "first"
+        elif MENTION_COUNT_RE.search(query) or CHAPTER_LIST_RE.search(query):
+            kind = "chapters"
+        else:
+            return None
+        keys = self.find_in_query(query, limit=1)
+        if not keys:
+            return None
+
+        entity = self.get(keys[0])
+        first = entity["first_appearance"]
+        spread = f"{entity['name']} is mentioned {entity['mentions']} times in {len(entity['chapters'])} chapters"
+        if kind == "first":
+            answer = (f"{entity['name']} first appears in {chapter_label(first)}: \"{first['snippet']}\" "
+                      f"{spread}.")
+            return answer, [first]
+
+        listed = entity["chapters"][:LISTED_CHAPTERS]
+        more = len(entity["chapters"]) - len(listed)
+        answer = f"{spread}: " + ", ".join(f"{chapter_label(c)} ({c['mentions']})" for c in listed)
+        answer += f" and {more} more." if more else "."
+        return answer, listed
+
+
+def chapter_label(chapter: dict) -> str:
+    return f"{chapter['source']} ({chapter['title']})" if chapter.get("title") else chapter["source"]
+
+
+def build_entity_index(records: Iterable[dict], min_mentions: int = 3) -> EntityIndex:
+    builder = EntityIndexBuilder(min_mentions=min_mentions)
+    for record in records:
+        builder.add(record)
+    return builder.build()
+
+
+def main():
+    from chunking import iter_records
+
+    parser = argparse.ArgumentParser(description='Build the entity index served by GET /entities and used in /ask')
+    parser.add_argument('--corpus-dir', action='append', default=None,
+                       help='Directory of extracted .txt files (repeatable; default: epub and pdf output directories)')
+    parser.add_argument('--store', default=None, help='Read the chapters from a chunk store instead')
+    parser.add_argument('-o', '--output', default=None,
+                       help=f'Output file (default: {DEFAULT_INDEX_PATH}, or entities/<book-id>.json with --book-id)')
+    parser.add_argument('--min-mentions', type=int, default=3,
+                       help='Mid-sentence capitalized mentions needed to count as a name (default: 3)')
+    parser.add_argument('--book-id', default=None, help='Register the index for this book in the book registry')
+
+    args = parser.parse_args()
+
+    output = args.output or (os.path.join("entities", f"{args.book_id}.json") if args.book_id else DEFAULT_INDEX_PATH)
+    start = time.perf_counter()
+    index = build_entity_index(iter_records(args.corpus_dir, args.store), args.min_mentions)
+    if not index.chapters:
+        print("Error: no extracted chapters found")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    index.save(output)
+    print(f"✅ Indexed {len(index)} entities over {len(index.chapters)} chapters "
+          f"in {time.perf_counter() - start:.2f}s ({os.path.getsize(output) / 1024:.0f} KB)")
+    for entity in index.top(5):
+        print(f"  {entity['name']}: {entity['mentions']} mentions in {entity['chapter_count']} chapters")
+    print(f"💾 Entity index saved to {output}")
+
+    if args.book_id:
+        from book_registry import BookRegistry, registry_lock
+        from config import config
+
+        with registry_lock(config.BOOK_REGISTRY_PATH):
+            registry = BookRegistry.load(config.BOOK_REGISTRY_PATH)
+            registry.register(args.book_id, entity_index=output)
+            registry.save(config.BOOK_REGISTRY_PATH)
+        print(f"📚 Registered entity index for '{args.book_id}' in {config.BOOK_REGISTRY_PATH}")
+
+
+if __name__ == "__main__":
+    main()
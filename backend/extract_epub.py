@@ -2,40 +2,106 @@
 """
 EPUB Text Extractor
 Extracts text from EPUB files and saves each chapter as a separate text file.
+Chapters are streamed one at a time, so memory use does not grow with the book;
+they can also go to a JSONL file or a chunk store (see extraction_sinks.py).
 """
 
 import os
+import posixpath
 import re
 import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
 from pathlib import Path
-import ebooklib
+from urllib.parse import unquote
+from xml.etree import ElementTree
 from ebooklib import epub
 from bs4 import BeautifulSoup
 import argparse
+from extraction_sinks import (SUMMARY_FILENAME, ChunkStoreSink, JsonlSink, SinkGroup, SummarySink,
+                              TextDirSink, bounded_map, preview)
+from text_normalize import KeywordMatcher, clean_epub_text, upper_ratio
+
+TITLE_KEYWORDS = KeywordMatcher(['chapter', 'part', 'prologue', 'epilogue', 'prelude'])
+TITLE_NUMBER_RE = re.compile(r'^[0-9]+\.?\s+')
+
+# Skip acknowledgments, copyright, contents, etc.
+SKIP_PATTERNS = KeywordMatcher([
+    'acknowledgments', 'acknowledgements',
+    'copyright', 'all rights reserved',
+    'contents', 'table of contents',
+    'dedication', 'for emily',
+    'tor books by brandon sanderson',
+    'map of', 'created by his majesty',
+    'ars arcanum', 'endnote'
+])
+
+# Look for story-like content indicators
+STORY_INDICATORS = KeywordMatcher([
+    '"',  # Dialogue quotes
+    'said', 'asked', 'replied',
+    'he', 'she', 'they',
+    'walked', 'ran', 'looked',
+    'chapter', 'part', 'prologue', 'epilogue', 'prelude'
+])
+
+CONTAINER_PATH = 'META-INF/container.xml'
+CONTAINER_NS = 'urn:oasis:names:tc:opendocument:xmlns:container'
+OPF_NS = 'http://www.idpf.org/2007/opf'
+
+FILENAME_UNSAFE_RE = re.compile(r'[^\w\s-]')
+WHITESPACE_RE = re.compile(r'\s+')
 
 
 def clean_text(text):
     """Clean and normalize extracted text."""
-    if not text:
-        return ""
+    return clean_epub_text(text)
+
+
+# Parser backends for extract_chapter_text; "strip" skips building a parse tree
+PARSERS = ['html5lib', 'lxml', 'html.parser', 'strip']
+
+
+class TextStripper(HTMLParser):
+    """Streaming tag stripper: keeps text nodes, drops script/style contents."""
     
-    # Remove extra whitespace and normalize
-    text = re.sub(r'\s+', ' ', text.strip())
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
     
-    # Remove common HTML artifacts
-    text = re.sub(r'\[.*?\]', '', text)  # Remove bracketed content
-    text = re.sub(r'^\s*[0-9]+\s*$', '', text, flags=re.MULTILINE)  # Remove standalone numbers
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip_depth += 1
     
-    return text
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip_depth:
+            self._skip_depth -= 1
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def strip_tags(html_content):
+    """Return the text of an HTML document without building a tree."""
+    stripper = TextStripper()
+    stripper.feed(html_content)
+    stripper.close()
+    return ''.join(stripper.parts)
 
 
-def extract_chapter_text(html_content):
+def extract_chapter_text(html_content, parser='html5lib'):
     """Extract clean text from HTML content."""
     if not html_content:
         return ""
     
+    if parser == 'strip':
+        return clean_text(strip_tags(html_content))
+    
     # Parse HTML content
-    soup = BeautifulSoup(html_content, 'html5lib')
+    soup = BeautifulSoup(html_content, parser)
     
     # Remove script and style elements
     for script in soup(["script", "style"]):
@@ -54,61 +120,40 @@ def extract_chapter_title(text_content):
         line = line.strip()
         if line and len(line) > 5 and len(line) < 200:
             # Look for chapter-like titles
-            if any(keyword in line.lower() for keyword in ['chapter', 'part', 'prologue', 'epilogue', 'prelude']):
+            if TITLE_KEYWORDS.search(line.lower()):
                 return line
             # Look for all-caps lines that might be titles
             if line.isupper() and len(line.split()) <= 10:
                 return line
             # Look for lines with numbers that might be chapter numbers
-            if re.match(r'^[0-9]+\.?\s+', line):
+            if TITLE_NUMBER_RE.match(line):
                 return line
     return ""
 
 
 def is_actual_chapter(text_content, item_id=""):
     """Determine if this content is actually a story chapter."""
-    if not text_content or len(text_content.strip()) < 100:
+    if not text_content:
+        return False
+    stripped_length = len(text_content.strip())
+    if stripped_length < 100:
         return False
     
     # Filter out common non-chapter content
     text_lower = text_content.lower()
-    
-    # Skip acknowledgments, copyright, contents, etc.
-    skip_patterns = [
-        'acknowledgments', 'acknowledgements',
-        'copyright', 'all rights reserved',
-        'contents', 'table of contents',
-        'dedication', 'for emily',
-        'tor books by brandon sanderson',
-        'map of', 'created by his majesty',
-        'ars arcanum', 'endnote'
-    ]
-    
-    for pattern in skip_patterns:
-        if pattern in text_lower:
-            return False
+    if SKIP_PATTERNS.search(text_lower):
+        return False
     
     # Skip very short content (likely metadata)
-    if len(text_content.strip()) < 300:
+    if stripped_length < 300:
         return False
     
-    # Skip content that's mostly all caps (likely headers) unless it's a title
-    upper_ratio = sum(1 for c in text_content if c.isupper()) / len(text_content)
-    if upper_ratio > 0.8 and len(text_content.strip()) < 1000:
+    # Skip content that's mostly all caps (likely headers) unless it's a title;
+    # the ratio only matters for short content, so skip the per-character count otherwise
+    if stripped_length < 1000 and upper_ratio(text_content) > 0.8:
         return False
     
-    # Look for story-like content indicators
-    story_indicators = [
-        '"',  # Dialogue quotes
-        'said', 'asked', 'replied',
-        'he', 'she', 'they',
-        'walked', 'ran', 'looked',
-        'chapter', 'part', 'prologue', 'epilogue', 'prelude'
-    ]
-    
-    has_story_content = any(indicator in text_lower for indicator in story_indicators)
-    
-    return has_story_content
+    return STORY_INDICATORS.search(text_lower)
 
 
 def get_chapter_filename(chapter_title, chapter_count):
@@ -117,8 +162,8 @@ def get_chapter_filename(chapter_title, chapter_count):
         return f"chapter_{chapter_count:03d}.txt"
     
     # Clean the title for filename
-    clean_title = re.sub(r'[^\w\s-]', '', chapter_title)
-    clean_title = re.sub(r'\s+', '_', clean_title.strip())
+    clean_title = FILENAME_UNSAFE_RE.sub('', chapter_title)
+    clean_title = WHITESPACE_RE.sub('_', clean_title.strip())
     clean_title = clean_title.lower()
     
     # Limit length
@@ -128,77 +173,153 @@ def get_chapter_filename(chapter_title, chapter_count):
     return f"{clean_title}_{chapter_count:03d}.txt"
 
 
-def extract_epub(epub_path, output_dir="extracted_chapters"):
-    """Extract chapters from EPUB file."""
+def process_document(document):
+    """Parse and classify one EPUB document.
+    
+    Takes (html_content, item_id, parser) and returns (text_content, chapter_title),
+    or None if the document is not a story chapter. Runs in worker processes, so it
+    only does CPU work; numbering and writing stay in the parent for deterministic output.
+    """
+    html_content, item_id, parser = document
+    text_content = extract_chapter_text(html_content, parser)
+    
+    # Check if this is actually a story chapter
+    if not is_actual_chapter(text_content, item_id):
+        return None
+    
+    # Extract chapter title
+    return text_content, extract_chapter_title(text_content)
+
+
+def iter_epub_documents(epub_path):
+    """Yield (html_content, item_id) for each XHTML document, in manifest order.
+    
+    Reads one zip entry at a time instead of loading the whole book with
+    epub.read_epub. Each document is still rendered through ebooklib's EpubHtml,
+    exactly as read_epub's items were, so the extracted text is unchanged.
+    """
+    # Supplies the templates and default language EpubHtml renders with; items
+    # are never added to it, so it does not accumulate content
+    book = epub.EpubBook()
+    with zipfile.ZipFile(epub_path) as zf:
+        container = ElementTree.fromstring(zf.read(CONTAINER_PATH))
+        opf_file = None
+        for rootfile in container.iter(f'{{{CONTAINER_NS}}}rootfile'):
+            if rootfile.get('media-type') == 'application/oebps-package+xml':
+                opf_file = rootfile.get('full-path')
+        if opf_file is None:
+            raise ValueError(f"No OPF package file listed in {CONTAINER_PATH}")
+        opf_dir = posixpath.dirname(opf_file)
+        
+        manifest = ElementTree.fromstring(zf.read(opf_file)).find(f'{{{OPF_NS}}}manifest')
+        for entry in manifest.iter(f'{{{OPF_NS}}}item'):
+            if entry.get('media-type') != 'application/xhtml+xml':
+                continue
+            properties = entry.get('properties', '').split()
+            href = entry.get('href')
+            if 'nav' in properties:
+                item = epub.EpubNav(uid=entry.get('id'), file_name=unquote(href))
+                name = href
+            elif 'cover' in properties:
+                item = epub.EpubCoverHtml()
+                name = unquote(href)
+            else:
+                item = epub.EpubHtml(uid=entry.get('id'), file_name=unquote(href))
+                name = unquote(href)
+            item.content = zf.read(posixpath.normpath(posixpath.join(opf_dir, name)))
+            item.book = book
+            yield item.get_content().decode('utf-8'), item.get_id()
+
+
+def iter_epub_chapters(epub_path, workers=1, parser='html5lib'):
+    """Yield one record ({source, title, page, text}) per story chapter, in book order.
+    
+    With workers > 1 the documents are parsed in a process pool, with only a few
+    documents in flight at a time; numbering stays in this process, so the output
+    is the same as a single-process run.
+    """
+    documents = ((html_content, item_id, parser) for html_content, item_id in iter_epub_documents(epub_path))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
     try:
-        # Open EPUB file
-        book = epub.read_epub(epub_path)
+        if executor is not None:
+            results = bounded_map(executor, process_document, documents, window=workers * 4)
+        else:
+            results = map(process_document, documents)
         
+        chapter_count = 0
+        for result in results:
+            if result is None:
+                continue
+            text_content, chapter_title = result
+            chapter_count += 1
+            yield {
+                'source': get_chapter_filename(chapter_title, chapter_count),
+                'title': chapter_title,
+                'page': 0,
+                'text': text_content,
+            }
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def extract_epub(epub_path, output_dir="extracted_chapters", store_dir=None, write_files=True,
+                 workers=1, parser='html5lib', jsonl_path=None):
+    """Extract chapters from EPUB file.
+
+    Chapters stream one at a time into the sinks: individual text files (unless
+    write_files is False), a chunk store if store_dir is given and a JSONL file if
+    jsonl_path is given. The summary is written as chapters arrive, so memory use
+    does not grow with the size of the book.
+    """
+    sinks = SinkGroup()
+    summary = None
+    try:
         # Create output directory
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True)
         
         print(f"Extracting chapters from: {epub_path}")
         print(f"Output directory: {output_path.absolute()}")
+        if write_files:
+            sinks.add(TextDirSink(output_dir))
+        if store_dir:
+            sinks.add(ChunkStoreSink(store_dir))
+            print(f"Chunk store: {Path(store_dir).absolute()}")
+        if jsonl_path:
+            sinks.add(JsonlSink(jsonl_path))
+            print(f"JSONL: {Path(jsonl_path).absolute()}")
         
-        chapter_count = 0
-        extracted_chapters = []
+        def format_header(chapter_count):
+            return (f"EPUB Extraction Summary\n"
+                    f"======================\n"
+                    f"Source file: {epub_path}\n"
+                    f"Total chapters extracted: {chapter_count}\n"
+                    f"Output directory: {output_path.absolute()}\n\n")
         
-        # Process each document in the EPUB
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                # Extract text content
-                html_content = item.get_content().decode('utf-8')
-                text_content = extract_chapter_text(html_content)
-                
-                # Check if this is actually a story chapter
-                if is_actual_chapter(text_content, item.get_id()):
-                    chapter_count += 1
-                    
-                    # Extract chapter title
-                    chapter_title = extract_chapter_title(text_content)
-                    
-                    # Generate chapter filename
-                    chapter_filename = get_chapter_filename(chapter_title, chapter_count)
-                    chapter_path = output_path / chapter_filename
-                    
-                    # Save chapter to file
-                    with open(chapter_path, 'w', encoding='utf-8') as f:
-                        f.write(text_content)
-                    
-                    # Store chapter info
-                    extracted_chapters.append({
-                        'filename': chapter_filename,
-                        'title': chapter_title,
-                        'length': len(text_content),
-                        'preview': text_content[:200] + "..." if len(text_content) > 200 else text_content
-                    })
-                    
-                    print(f"  Chapter {chapter_count}: {chapter_filename}")
-                    if chapter_title:
-                        print(f"    Title: {chapter_title}")
-                    print(f"    Length: {len(text_content)} characters")
-                    print(f"    Preview: {text_content[:100]}...")
-                    print()
+        def format_entry(i, chapter):
+            entry = f"Chapter {i}:\n  Filename: {chapter['source']}\n"
+            if chapter['title']:
+                entry += f"  Title: {chapter['title']}\n"
+            return entry + f"  Length: {len(chapter['text'])} characters\n  Preview: {preview(chapter['text'])}\n\n"
         
-        # Create summary file
-        summary_path = output_path / "extraction_summary.txt"
-        with open(summary_path, 'w', encoding='utf-8') as f:
-            f.write(f"EPUB Extraction Summary\n")
-            f.write(f"======================\n")
-            f.write(f"Source file: {epub_path}\n")
-            f.write(f"Total chapters extracted: {chapter_count}\n")
-            f.write(f"Output directory: {output_path.absolute()}\n\n")
+        summary_path = output_path / SUMMARY_FILENAME
+        summary = SummarySink(summary_path, format_header, format_entry)
+        
+        for chapter in iter_epub_chapters(epub_path, workers=workers, parser=parser):
+            sinks.write(chapter)
+            summary.write(chapter)
             
-            for i, chapter in enumerate(extracted_chapters, 1):
-                f.write(f"Chapter {i}:\n")
-                f.write(f"  Filename: {chapter['filename']}\n")
-                if chapter['title']:
-                    f.write(f"  Title: {chapter['title']}\n")
-                f.write(f"  Length: {chapter['length']} characters\n")
-                f.write(f"  Preview: {chapter['preview']}\n\n")
+            text_content = chapter['text']
+            print(f"  Chapter {summary.count}: {chapter['source']}")
+            if chapter['title']:
+                print(f"    Title: {chapter['title']}")
+            print(f"    Length: {len(text_content)} characters")
+            print(f"    Preview: {text_content[:100]}...")
+            print()
         
-        print(f"\nExtraction complete! {chapter_count} chapters extracted.")
+        summary.close()
+        print(f"\nExtraction complete! {summary.count} chapters extracted.")
         print(f"Summary saved to: {summary_path}")
         
         return True
@@ -206,6 +327,11 @@ def extract_epub(epub_path, output_dir="extracted_chapters"):
     except Exception as e:
         print(f"Error extracting EPUB: {e}")
         return False
+    
+    finally:
+        sinks.close()
+        if summary is not None:
+            summary.discard()
 
 
 def main():
@@ -213,6 +339,16 @@ def main():
     parser.add_argument('epub_path', help='Path to the EPUB file')
     parser.add_argument('-o', '--output', default='extracted_chapters', 
                        help='Output directory for extracted chapters (default: extracted_chapters)')
+    parser.add_argument('--store', default=None,
+                       help='Also write chapters to a memory-mapped chunk store in this directory')
+    parser.add_argument('--jsonl', default=None,
+                       help='Also write chapters as JSON lines ({source, title, page, text}) to this file')
+    parser.add_argument('--no-files', action='store_true',
+                       help='Skip the per-chapter text files (use with --store or --jsonl)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                       help='Number of worker processes for parsing (default: 1)')
+    parser.add_argument('--parser', choices=PARSERS, default='html5lib',
+                       help='HTML parser backend (default: html5lib); "strip" is a streaming tag stripper')
     
     args = parser.parse_args()
     
@@ -221,8 +357,13 @@ def main():
         print(f"Error: EPUB file not found: {args.epub_path}")
         sys.exit(1)
     
+    if args.no_files and not (args.store or args.jsonl):
+        print("Error: --no-files requires --store or --jsonl")
+        sys.exit(1)
+    
     # Extract EPUB
-    success = extract_epub(args.epub_path, args.output)
+    success = extract_epub(args.epub_path, args.output, store_dir=args.store, write_files=not args.no_files,
+                           workers=args.workers, parser=args.parser, jsonl_path=args.jsonl)
     
     if not success:
         sys.exit(1)
@@ -2,106 +2,202 @@
 """
 PDF Text Extractor
 Extracts text from PDF files and saves each page as a separate text file.
+Pages are streamed one shard at a time, so memory use does not grow with the
+PDF; they can also go to a JSONL file or a chunk store (see extraction_sinks.py).
 """
 
 import os
-import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import PyPDF2
 import argparse
+from extraction_sinks import (SUMMARY_FILENAME, ChunkStoreSink, JsonlSink, SinkGroup, SummarySink,
+                              TextDirSink, bounded_map, preview)
+from text_normalize import clean_pdf_text
+
+# PyPDF2 caches every object it parses for the lifetime of a reader, so pages are
+# read in shards of at most this many, each with a fresh reader
+MAX_SHARD_PAGES = 64
 
 
 def clean_text(text):
     """Clean and normalize extracted text."""
-    if not text:
-        return ""
+    return clean_pdf_text(text)
+
+
+def extract_page_text(page):
+    """Extract and clean one page; None means the raw text was too short or empty."""
+    text_content = page.extract_text()
+    
+    if text_content and len(text_content.strip()) > 50:  # Filter out very short content
+        return clean_text(text_content)
+    return None
+
+
+def extract_page_range(task):
+    """Extract a shard of pages, in this process or a worker.
     
-    # Remove extra whitespace and normalize
-    text = re.sub(r'\s+', ' ', text.strip())
+    Takes (pdf_path, page_numbers) and returns [(page_number, text)] in order. Each
+    shard opens the PDF itself so no parser state crosses process boundaries, and
+    the reader's object cache is freed when the shard is done.
+    """
+    pdf_path, page_numbers = task
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [(page_number, extract_page_text(pdf_reader.pages[page_number - 1]))
+                for page_number in page_numbers]
+
+
+def shard_pages(page_numbers, shards):
+    """Split page numbers into contiguous, roughly equal shards."""
+    size = max(1, -(-len(page_numbers) // shards))
+    return [page_numbers[i:i + size] for i in range(0, len(page_numbers), size)]
+
+
+def parse_page_ranges(spec, total_pages):
+    """Parse a 1-based page spec like "1-20,25,40-" into a sorted list of page numbers."""
+    pages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start = int(start) if start else 1
+            end = int(end) if end else total_pages
+        else:
+            start = end = int(part)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part}")
+        pages.update(range(start, min(end, total_pages) + 1))
+    return sorted(pages)
+
+
+def count_pages(pdf_path):
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def page_record(page_number, text):
+    return {'source': f"page_{page_number:03d}.txt", 'title': "", 'page': page_number, 'text': text}
+
+
+def iter_page_texts(pdf_path, page_numbers, workers=1):
+    """Yield (page_number, text) in page order; text is None for pages that were too short or empty.
     
-    # Remove common PDF artifacts
-    text = re.sub(r'[^\x00-\x7F]+', '', text)  # Remove non-ASCII characters
-    text = re.sub(r'\f', '\n', text)  # Replace form feeds with newlines
+    Pages are split into contiguous shards of at most MAX_SHARD_PAGES. With
+    workers > 1 each shard is extracted by a worker process that opens the PDF
+    independently, with only a few shards in flight at a time.
+    """
+    shards = shard_pages(page_numbers, max(workers * 2, -(-len(page_numbers) // MAX_SHARD_PAGES)))
+    tasks = ((pdf_path, shard) for shard in shards)
+    if workers <= 1:
+        for task in tasks:
+            yield from extract_page_range(task)
+        return
     
-    return text
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for results in bounded_map(executor, extract_page_range, tasks, window=workers * 2):
+            yield from results
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_pdf_pages(pdf_path, workers=1, pages=None):
+    """Yield one record ({source, title, page, text}) per extracted page, in page order."""
+    total_pages = count_pages(pdf_path)
+    page_numbers = parse_page_ranges(pages, total_pages) if pages else list(range(1, total_pages + 1))
+    for page_number, cleaned_text in iter_page_texts(pdf_path, page_numbers, workers):
+        if cleaned_text:
+            yield page_record(page_number, cleaned_text)
+
 
+def extract_pdf(pdf_path, output_dir="pdf_extracted_pages", store_dir=None, write_files=True,
+                workers=1, pages=None, jsonl_path=None):
+    """Extract pages from PDF file.
 
-def extract_pdf(pdf_path, output_dir="pdf_extracted_pages"):
-    """Extract pages from PDF file."""
+    Pages stream one at a time into the sinks: individual text files (unless
+    write_files is False), a chunk store if store_dir is given and a JSONL file if
+    jsonl_path is given, and the summary is written as they arrive. With workers > 1
+    the pages are split into contiguous shards, each extracted by a worker process
+    that opens the PDF independently; results are merged in page order. pages is
+    an optional range spec (see parse_page_ranges) for partial re-extraction.
+    """
+    sinks = SinkGroup()
+    summary = None
     try:
-        # Open PDF file
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            
-            # Create output directory
-            output_path = Path(output_dir)
-            output_path.mkdir(exist_ok=True)
-            
-            print(f"Extracting pages from: {pdf_path}")
-            print(f"Output directory: {output_path.absolute()}")
-            print(f"Total pages: {len(pdf_reader.pages)}")
-            
-            extracted_pages = []
-            
-            # Process each page
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                
-                # Extract text content
-                text_content = page.extract_text()
-                
-                if text_content and len(text_content.strip()) > 50:  # Filter out very short content
-                    # Clean the text
-                    cleaned_text = clean_text(text_content)
-                    
-                    if cleaned_text:
-                        # Generate page filename
-                        page_filename = f"page_{page_num + 1:03d}.txt"
-                        page_path = output_path / page_filename
-                        
-                        # Save page to file
-                        with open(page_path, 'w', encoding='utf-8') as f:
-                            f.write(cleaned_text)
-                        
-                        # Store page info
-                        extracted_pages.append({
-                            'filename': page_filename,
-                            'page_number': page_num + 1,
-                            'length': len(cleaned_text),
-                            'preview': cleaned_text[:200] + "..." if len(cleaned_text) > 200 else cleaned_text
-                        })
-                        
-                        print(f"  Page {page_num + 1}: {page_filename} ({len(cleaned_text)} characters)")
-                        print(f"    Preview: {cleaned_text[:100]}...")
-                        print()
-                else:
-                    print(f"  Page {page_num + 1}: Skipped (too short or empty)")
+        total_pages = count_pages(pdf_path)
+        
+        # Create output directory
+        output_path = Path(output_dir)
+        output_path.mkdir(exist_ok=True)
+        
+        print(f"Extracting pages from: {pdf_path}")
+        print(f"Output directory: {output_path.absolute()}")
+        print(f"Total pages: {total_pages}")
+        if write_files:
+            sinks.add(TextDirSink(output_dir))
+        if store_dir:
+            sinks.add(ChunkStoreSink(store_dir))
+            print(f"Chunk store: {Path(store_dir).absolute()}")
+        if jsonl_path:
+            sinks.add(JsonlSink(jsonl_path))
+            print(f"JSONL: {Path(jsonl_path).absolute()}")
+        
+        page_numbers = parse_page_ranges(pages, total_pages) if pages else list(range(1, total_pages + 1))
+        if pages:
+            print(f"Page range: {pages} ({len(page_numbers)} pages)")
+        
+        def format_header(page_count):
+            header = (f"PDF Extraction Summary\n"
+                      f"=====================\n"
+                      f"Source file: {pdf_path}\n"
+                      f"Total pages in PDF: {total_pages}\n")
+            if pages:
+                header += f"Page range: {pages}\n"
+            return header + (f"Pages extracted: {page_count}\n"
+                             f"Output directory: {output_path.absolute()}\n\n")
+        
+        def format_entry(_, page):
+            return (f"Page {page['page']}:\n"
+                    f"  Filename: {page['source']}\n"
+                    f"  Length: {len(page['text'])} characters\n"
+                    f"  Preview: {preview(page['text'])}\n\n")
+        
+        summary_path = output_path / SUMMARY_FILENAME
+        summary = SummarySink(summary_path, format_header, format_entry)
+        
+        # Process each page
+        for page_number, cleaned_text in iter_page_texts(pdf_path, page_numbers, workers):
+            if cleaned_text is None:
+                print(f"  Page {page_number}: Skipped (too short or empty)")
+                continue
             
-            # Create summary file
-            summary_path = output_path / "extraction_summary.txt"
-            with open(summary_path, 'w', encoding='utf-8') as f:
-                f.write(f"PDF Extraction Summary\n")
-                f.write(f"=====================\n")
-                f.write(f"Source file: {pdf_path}\n")
-                f.write(f"Total pages in PDF: {len(pdf_reader.pages)}\n")
-                f.write(f"Pages extracted: {len(extracted_pages)}\n")
-                f.write(f"Output directory: {output_path.absolute()}\n\n")
+            if cleaned_text:
+                page = page_record(page_number, cleaned_text)
+                sinks.write(page)
+                summary.write(page)
                 
-                for page_info in extracted_pages:
-                    f.write(f"Page {page_info['page_number']}:\n")
-                    f.write(f"  Filename: {page_info['filename']}\n")
-                    f.write(f"  Length: {page_info['length']} characters\n")
-                    f.write(f"  Preview: {page_info['preview']}\n\n")
-            
-            print(f"\nExtraction complete! {len(extracted_pages)} pages extracted.")
-            print(f"Summary saved to: {summary_path}")
-            
-            return True
-            
+                print(f"  Page {page_number}: {page['source']} ({len(cleaned_text)} characters)")
+                print(f"    Preview: {cleaned_text[:100]}...")
+                print()
+        
+        summary.close()
+        print(f"\nExtraction complete! {summary.count} pages extracted.")
+        print(f"Summary saved to: {summary_path}")
+        
+        return True
+        
     except Exception as e:
         print(f"Error extracting PDF: {e}")
         return False
+    
+    finally:
+        sinks.close()
+        if summary is not None:
+            summary.discard()
 
 
 def main():
@@ -109,6 +205,16 @@ def main():
     parser.add_argument('pdf_path', help='Path to the PDF file')
     parser.add_argument('-o', '--output', default='pdf_extracted_pages', 
                        help='Output directory for extracted pages (default: pdf_extracted_pages)')
+    parser.add_argument('--store', default=None,
+                       help='Also write pages to a memory-mapped chunk store in this directory')
+    parser.add_argument('--jsonl', default=None,
+                       help='Also write pages as JSON lines ({source, title, page, text}) to this file')
+    parser.add_argument('--no-files', action='store_true',
+                       help='Skip the per-page text files (use with --store or --jsonl)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                       help='Number of worker processes, each extracting a page-range shard (default: 1)')
+    parser.add_argument('--pages', default=None,
+                       help='Only extract these 1-based pages, e.g. "1-20,25,40-" (default: all pages)')
     
     args = parser.parse_args()
     
@@ -117,8 +223,13 @@ def main():
         print(f"Error: PDF file not found: {args.pdf_path}")
         sys.exit(1)
     
+    if args.no_files and not (args.store or args.jsonl):
+        print("Error: --no-files requires --store or --jsonl")
+        sys.exit(1)
+    
     # Extract PDF
-    success = extract_pdf(args.pdf_path, args.output)
+    success = extract_pdf(args.pdf_path, args.output, store_dir=args.store, write_files=not args.no_files,
+                          workers=args.workers, pages=args.pages, jsonl_path=args.jsonl)
     
     if not success:
         sys.exit(1)
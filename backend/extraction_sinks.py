@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Extraction Sinks
+Destinations for the records the extractors yield one at a time
+({source, title, page, text}, the same shape chunking.iter_records reads).
+Each sink writes a record as soon as it arrives and keeps nothing but
+counters, so extracting a book takes the same memory whatever its size.
+
+    TextDirSink     one <source> text file per record in a directory
+    JsonlSink       one JSON object per line
+    ChunkStoreSink  appends to a chunk store (see chunk_store.py)
+    SummarySink     the human-readable extraction_summary.txt
+
+bounded_map keeps the pipeline lazy when a process pool does the parsing.
+"""
+
+import json
+import os
+import shutil
+from collections import deque
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List
+
+from chunk_store import ChunkStoreWriter
+
+SUMMARY_FILENAME = "extraction_summary.txt"
+PREVIEW_CHARS = 200
+
+
+def preview(text: str) -> str:
+    return text[:PREVIEW_CHARS] + "..." if len(text) > PREVIEW_CHARS else text
+
+
+class TextDirSink:
+    """Writes each record's text to <output_dir>/<source>"""
+
+    def __init__(self, output_dir: str):
+        self.output_path = Path(output_dir)
+        self.output_path.mkdir(parents=True, exist_ok=True)
+
+    def write(self, record: dict) -> None:
+        with open(self.output_path / record["source"], "w", encoding="utf-8") as f:
+            f.write(record["text"])
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink:
+    """Writes each record as one JSON line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ChunkStoreSink:
+    """Appends each record to a chunk store"""
+
+    def __init__(self, store_dir: str):
+        self.writer = ChunkStoreWriter(store_dir)
+
+    def write(self, record: dict) -> None:
+        self.writer.add(record["text"], source=record["source"], title=record.get("title", ""),
+                        page=record.get("page", 0))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class SummarySink:
+    """
+    Writes extraction_summary.txt incrementally.
+
+    The header holds totals that are only known at the end, so entries are
+    streamed to a .part file and copied in after the header on close.
+    format_entry(n, record) renders the n-th (1-based) record's entry and
+    format_header(count) the header.
+    """
+
+    def __init__(self, path: str, format_header: Callable[[int], str],
+                 format_entry: Callable[[int, dict], str]):
+        self.path = Path(path)
+        self.format_header = format_header
+        self.format_entry = format_entry
+        self.count = 0
+        self._part_path = self.path.with_name(self.path.name + ".part")
+        self._part = open(self._part_path, "w", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self.count += 1
+        self._part.write(self.format_entry(self.count, record))
+
+    def close(self) -> None:
+        if self._part.closed:
+            return
+        self._part.close()
+        with open(self.path, "w", encoding="utf-8") as f, open(self._part_path, "r", encoding="utf-8") as part:
+            f.write(self.format_header(self.count))
+            shutil.copyfileobj(part, f)
+        os.remove(self._part_path)
+
+    def discard(self) -> None:
+        """Drop the entries written so far (after a failed extraction); a no-op once closed."""
+        if self._part.closed:
+            return
+        self._part.close()
+        os.remove(self._part_path)
+
+
+class SinkGroup:
+    """Fans each record out to several sinks and closes them all"""
+
+    def __init__(self, sinks: Iterable = ()):
+        self.sinks: List = list(sinks)
+
+    def add(self, sink) -> None:
+        self.sinks.append(sink)
+
+    def write(self, record: dict) -> None:
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def bounded_map(executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Like executor.map, but submits at most window tasks ahead of the consumer.
+    executor.map submits its whole input up front, which would pull every
+    document of a book into memory before the first result comes back.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
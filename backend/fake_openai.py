@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI Server for Book Companion
+A local stand-in for the OpenAI endpoints the backend calls, so load tests can
+run without an API key and without paying for tokens. Point the backend at it
+with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Calls take a latency drawn from a distribution (--latency 0.2, or e.g.
+lognormal:0.3,0.5), a fraction of them fail with the given statuses
+(--error-rate, --error-status), and streamed answers arrive one word at a time
+(--tokens-per-second). GET /stats reports the calls seen; POST /config changes
+the settings and POST /reset clears the counters, so a load generator in
+another process can drive it (see load_test.py).
+"""
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Union
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+
+class Latency:
+    """
+    Seconds a simulated call takes, drawn from a distribution:
+
+        0.2 or fixed:0.2         always 0.2s
+        uniform:0.1,0.5          between 0.1s and 0.5s
+        normal:0.2,0.05          mean 0.2s, standard deviation 0.05s (never below 0)
+        lognormal:0.3,0.5        median 0.3s, sigma 0.5 (a long right tail, like real APIs)
+        exponential:0.2          mean 0.2s
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, kind: str = "fixed", *params: float):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {kind} (expected one of {', '.join(self.KINDS)})")
+        expected = {"fixed": 1, "exponential": 1}.get(kind, 2)
+        if len(params) != expected or any(p < 0 for p in params):
+            raise ValueError(f"{kind} latency takes {expected} non-negative parameter(s)")
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec: Union[str, float]) -> "Latency":
+        if isinstance(spec, (int, float)):
+            return cls("fixed", float(spec))
+        kind, _, params = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        return cls(kind, *(float(p) for p in params.split(",")))
+
+    def sample(self) -> float:
+        a = self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(a, self.params[1])
+        if self.kind == "normal":
+            return max(0.0, random.gauss(a, self.params[1]))
+        if self.kind == "lognormal":
+            return random.lognormvariate(math.log(a), self.params[1]) if a else 0.0
+        if self.kind == "exponential":
+            return random.expovariate(1 / a) if a else 0.0
+        return a
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{','.join(f'{p:g}' for p in self.params)}"
+
+
+class FakeState:
+    """Counters shared by every fake endpoint"""
+
+    def __init__(self, latency: float = 0.2, error_rate: float = 0.0):
+        # Seconds per call: a number, or a Latency distribution
+        self.latency = latency
+        self.error_rate = error_rate
+        # Statuses injected errors are drawn from (429 rate limits, 5xx server errors)
+        self.error_statuses = [429]
+        # Streamed and non-streamed answers take this long per word on top of the latency; 0 streams
+        # every answer within the latency itself
+        self.tokens_per_second = 0.0
+        # Answer length in words; 0 echoes the end of the question
+        self.output_tokens = 0
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+        # In-memory Files / Vector Stores objects
+        self.files = {}
+        self.vector_stores = {}
+        self.file_batches = {}
+        self.file_contents = {}
+        self.batches = {}
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def sample_latency(self) -> float:
+        return self.latency.sample() if isinstance(self.latency, Latency) else self.latency
+
+    def settings(self) -> dict:
+        return {"latency": str(self.latency), "error_rate": self.error_rate, "error_statuses": self.error_statuses,
+                "tokens_per_second": self.tokens_per_second, "output_tokens": self.output_tokens}
+
+
+state = FakeState()
+app = FastAPI(title="Fake OpenAI API")
+
+
+def answer_text(body: dict) -> str:
+    question = body.get("input") if isinstance(body.get("input"), str) else "your question"
+    text = f"Fake answer to: {question[-200:]}"
+    if state.output_tokens:
+        words = text.split(" ")[:state.output_tokens]
+        text = " ".join(words + ["lorem"] * (state.output_tokens - len(words)))
+    return text
+
+
+def input_tokens(body: dict) -> int:
+    """Roughly four characters per token, like English text through the real tokenizer."""
+    return max(1, len(json.dumps(body.get("input", ""))) // 4)
+
+
+def fake_response(model: str, text: str, prompt_tokens: int = 100) -> dict:
+    """A minimal Responses API object that the openai SDK can parse."""
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": prompt_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(text.split()),
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": prompt_tokens + len(text.split()),
+        },
+    }
+
+
+async def stream_response(model: str, text: str, prompt_tokens: int = 100):
+    """
+    Yield Responses API streaming events: one delta per word, then completed.
+    With tokens_per_second the first word comes after the latency and the rest
+    at that rate; otherwise the words are spread over the latency.
+    """
+    item_id = f"msg_{uuid.uuid4().hex}"
+    words = text.split(" ")
+    latency = state.sample_latency()
+    for i, word in enumerate(words):
+        if state.tokens_per_second:
+            await asyncio.sleep(latency if i == 0 else 1 / state.tokens_per_second)
+        else:
+            await asyncio.sleep(latency / len(words))
+        event = {
+            "type": "response.output_text.delta",
+            "item_id": item_id,
+            "output_index": 0,
+            "content_index": 0,
+            "delta": word if i == 0 else " " + word,
+        }
+        yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    event = {"type": "response.completed", "response": fake_response(model, text, prompt_tokens)}
+    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def tracked_stream(events):
+    """Count a streamed answer as in flight until its last event."""
+    state.in_flight += 1
+    state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        state.in_flight -= 1
+
+
+@app.post("/v1/responses")
+async def create_response(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4o")
+    text = answer_text(body)
+
+    if body.get("stream"):
+        state.requests += 1
+        error = injected_error()
+        if error:
+            return error
+        return StreamingResponse(tracked_stream(stream_response(model, text, input_tokens(body))),
+                                 media_type="text/event-stream")
+
+    generation = len(text.split()) / state.tokens_per_second if state.tokens_per_second else 0.0
+    error = await simulate_call(generation)
+    if error:
+        return error
+    return fake_response(model, text, input_tokens(body))
+
+
+def rate_limited() -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": "0.05"},
+        content={"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+    )
+
+
+def injected_error():
+    """An error response for error_rate of the calls (status drawn from error_statuses), else None."""
+    if not state.error_rate or random.random() >= state.error_rate:
+        return None
+    state.errors += 1
+    status = random.choice(state.error_statuses)
+    if status == 429:
+        return rate_limited()
+    return JSONResponse(status_code=status,
+                        content={"error": {"message": f"Server error (fake {status})", "type": "server_error"}})
+
+
+async def simulate_call(extra_seconds: float = 0.0):
+    """Count the call, wait out the simulated latency and maybe inject an error.
+
+    Returns an error response to send instead of the real result, or None.
+    """
+    state.requests += 1
+    state.in_flight += 1
+    state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+    try:
+        await asyncio.sleep(state.sample_latency() + extra_seconds)
+    finally:
+        state.in_flight -= 1
+    return injected_error()
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def not_found(what: str) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": {"message": f"No such {what}", "type": "invalid_request_error"}})
+
+
+def parse_upload(body: bytes, content_type: str) -> dict:
+    """Pull the form fields and the uploaded file out of a multipart/form-data body."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    fields = {"filename": "upload.txt", "content": b""}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if part.get_filename():
+            fields["filename"] = part.get_filename()
+            fields["content"] = part.get_payload(decode=True) or b""
+        elif name:
+            fields[name] = part.get_content().strip()
+    return fields
+
+
+@app.post("/v1/files")
+async def create_file(request: Request):
+    body = await request.body()
+    error = await simulate_call()
+    if error:
+        return error
+    upload = parse_upload(body, request.headers.get("content-type", ""))
+    file_obj = {
+        "id": new_id("file"),
+        "object": "file",
+        "bytes": len(upload["content"]),
+        "created_at": int(time.time()),
+        "filename": upload["filename"],
+        "purpose": upload.get("purpose", "assistants"),
+        "status": "processed",
+    }
+    state.files[file_obj["id"]] = file_obj
+    state.file_contents[file_obj["id"]] = upload["content"]
+    return file_obj
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in state.file_contents:
+        return not_found("file")
+    return PlainTextResponse(state.file_contents[file_id].decode("utf-8"))
+
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str):
+    error = await simulate_call()
+    if error:
+        return error
+    state.files.pop(file_id, None)
+    state.file_contents.pop(file_id, None)
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+def vector_store_object(vs_id: str) -> dict:
+    vs = state.vector_stores[vs_id]
+    count = len(vs["files"])
+    return {
+        "id": vs_id,
+        "object": "vector_store",
+        "created_at": vs["created_at"],
+        "name": vs["name"],
+        "status": "completed",
+        "usage_bytes": 0,
+        "last_active_at": None,
+        "metadata": None,
+        "file_counts": {"in_progress": 0, "completed": count, "failed": 0, "cancelled": 0, "total": count},
+    }
+
+
+@app.post("/v1/vector_stores")
+async def create_vector_store(request: Request):
+    body = await request.json()
+    error = await simulate_call()
+    if error:
+        return error
+    vs_id = new_id("vs")
+    state.vector_stores[vs_id] = {"name": body.get("name"), "created_at": int(time.time()), "files": set()}
+    return vector_store_object(vs_id)
+
+
+@app.get("/v1/vector_stores/{vs_id}")
+async def retrieve_vector_store(vs_id: str):
+    error = await simulate_call()
+    if error:
+        return error
+    if vs_id not in state.vector_stores:
+        return not_found("vector store")
+    return vector_store_object(vs_id)
+
+
+def vector_store_file_object(vs_id: str, file_id: str) -> dict:
+    return {
+        "id": file_id,
+        "object": "vector_store.file",
+        "created_at": int(time.time()),
+        "vector_store_id": vs_id,
+        "status": "completed",
+        "usage_bytes": 0,
+        "last_error": None,
+    }
+
+
+@app.post("/v1/vector_stores/{vs_id}/files")
+async def attach_file(vs_id: str, request: Request):
+    body = await request.json()
+    error = await simulate_call()
+    if error:
+        return error
+    if vs_id not in state.vector_stores:
+        return not_found("vector store")
+    state.vector_stores[vs_id]["files"].add(body["file_id"])
+    return vector_store_file_object(vs_id, body["file_id"])
+
+
+@app.delete("/v1/vector_stores/{vs_id}/files/{file_id}")
+async def detach_file(vs_id: str, file_id: str):
+    error = await simulate_call()
+    if error:
+        return error
+    if vs_id in state.vector_stores:
+        state.vector_stores[vs_id]["files"].discard(file_id)
+    return {"id": file_id, "object": "vector_store.file.deleted", "deleted": True}
+
+
+@app.post("/v1/vector_stores/{vs_id}/file_batches")
+async def create_file_batch(vs_id: str, request: Request):
+    body = await request.json()
+    error = await simulate_call()
+    if error:
+        return error
+    if vs_id not in state.vector_stores:
+        return not_found("vector store")
+    file_ids = body.get("file_ids", [])
+    state.vector_stores[vs_id]["files"].update(file_ids)
+    batch = {
+        "id": new_id("vsfb"),
+        "object": "vector_store.files_batch",
+        "created_at": int(time.time()),
+        "vector_store_id": vs_id,
+        "status": "completed",
+        "file_counts": {"in_progress": 0, "completed": len(file_ids), "failed": 0,
+                        "cancelled": 0, "total": len(file_ids)},
+    }
+    state.file_batches[batch["id"]] = batch
+    return batch
+
+
+@app.get("/v1/vector_stores/{vs_id}/file_batches/{batch_id}")
+async def retrieve_file_batch(vs_id: str, batch_id: str):
+    if batch_id not in state.file_batches:
+        return not_found("file batch")
+    return state.file_batches[batch_id]
+
+
+@app.post("/v1/vector_stores/{vs_id}/search")
+async def search_vector_store(vs_id: str, request: Request):
+    body = await request.json()
+    error = await simulate_call()
+    if error:
+        return error
+    return {"object": "vector_store.search_results.page", "search_query": body.get("query"),
+            "data": [], "has_more": False, "next_page": None}
+
+
+def store_output_file(filename: str, lines: list) -> str:
+    content = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+    file_id = new_id("file")
+    state.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                            "filename": filename, "purpose": "batch_output", "status": "processed"}
+    state.file_contents[file_id] = content
+    return file_id
+
+
+async def run_batch(batch_id: str) -> None:
+    """Answer every request in a batch's input file after one simulated latency period."""
+    batch = state.batches[batch_id]
+    await asyncio.sleep(state.sample_latency())
+    outputs, errors = [], []
+    for line in state.file_contents[batch["input_file_id"]].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = request.get("body", {})
+        if injected_error() is not None:
+            errors.append({"id": new_id("batch_req"), "custom_id": request["custom_id"], "response": {
+                "status_code": 429, "request_id": new_id("req"),
+                "body": {"error": {"message": "Rate limit reached (fake)", "type": "requests"}}}, "error": None})
+            continue
+        outputs.append({"id": new_id("batch_req"), "custom_id": request["custom_id"], "response": {
+            "status_code": 200, "request_id": new_id("req"),
+            "body": fake_response(body.get("model", "gpt-4o"), answer_text(body), input_tokens(body))},
+            "error": None})
+
+    batch["output_file_id"] = store_output_file("batch_output.jsonl", outputs)
+    if errors:
+        batch["error_file_id"] = store_output_file("batch_errors.jsonl", errors)
+    batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    state.requests += 1
+    if body.get("input_file_id") not in state.file_contents:
+        return not_found("file")
+    batch = {
+        "id": new_id("batch"),
+        "object": "batch",
+        "endpoint": body.get("endpoint"),
+        "input_file_id": body["input_file_id"],
+        "completion_window": body.get("completion_window", "24h"),
+        "status": "in_progress",
+        "created_at": int(time.time()),
+        "output_file_id": None,
+        "error_file_id": None,
+        "metadata": body.get("metadata"),
+    }
+    state.batches[batch["id"]] = batch
+    asyncio.create_task(run_batch(batch["id"]))
+    return batch
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str):
+    if batch_id not in state.batches:
+        return not_found("batch")
+    return state.batches[batch_id]
+
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: Request):
+    body = await request.json()
+    inputs = body.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    error = await simulate_call()
+    if error:
+        return error
+    return {
+        "object": "list",
+        "model": body.get("model", "text-embedding-3-small"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": [float(len(text) % 7), 1.0, 0.5]}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "requests": state.requests,
+        "errors": state.errors,
+        "in_flight": state.in_flight,
+        "peak_in_flight": state.peak_in_flight,
+        "settings": state.settings(),
+    }
+
+
+@app.post("/reset")
+async def reset_stats():
+    state.reset()
+    return await get_stats()
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    """Change latency, error_rate, error_statuses, tokens_per_second or output_tokens."""
+    body = await request.json()
+    try:
+        configure(**body)
+    except (TypeError, ValueError) as e:
+        return JSONResponse(status_code=400, content={"error": {"message": str(e)}})
+    return state.settings()
+
+
+def configure(latency=None, error_rate=None, error_statuses=None, tokens_per_second=None,
+              output_tokens=None) -> None:
+    """Apply settings given as numbers or, for latency, a distribution spec (see Latency)."""
+    if latency is not None:
+        state.latency = Latency.parse(latency)
+    if error_rate is not None:
+        if not 0.0 <= float(error_rate) <= 1.0:
+            raise ValueError("error_rate must be between 0 and 1")
+        state.error_rate = float(error_rate)
+    if error_statuses is not None:
+        if not error_statuses or any(not 400 <= int(s) <= 599 for s in error_statuses):
+            raise ValueError("error_statuses must be HTTP error statuses")
+        state.error_statuses = [int(s) for s in error_statuses]
+    if tokens_per_second is not None:
+        state.tokens_per_second = max(0.0, float(tokens_per_second))
+    if output_tokens is not None:
+        state.output_tokens = max(0, int(output_tokens))
+
+
+def start_in_thread(app_to_serve, host: str = "127.0.0.1", port: int = 8100) -> uvicorn.Server:
+    """Run an ASGI app with uvicorn on a background thread and wait until it is up."""
+    server = uvicorn.Server(uvicorn.Config(app_to_serve, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a fake OpenAI API server for local testing')
+    parser.add_argument('--port', type=int, default=8100, help='Port to listen on (default: 8100)')
+    parser.add_argument('--latency', default='0.2',
+                       help='Seconds each call takes, or a distribution such as lognormal:0.3,0.5 '
+                            '(fixed, uniform, normal, lognormal, exponential; default: 0.2)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                       help='Fraction of calls that fail (default: 0)')
+    parser.add_argument('--error-status', type=int, nargs='+', default=[429],
+                       help='Statuses failed calls return, chosen at random (default: 429)')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                       help='Answer generation speed in words per second (default: 0, no generation time)')
+    parser.add_argument('--output-tokens', type=int, default=0,
+                       help='Answer length in words (default: 0, echo the question)')
+
+    args = parser.parse_args()
+    try:
+        configure(args.latency, args.error_rate, args.error_status, args.tokens_per_second, args.output_tokens)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"🚀 Fake OpenAI API on http://127.0.0.1:{args.port}/v1 ({state.settings()})")
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Background Ingestion for Book Companion
+POST /ingest takes an uploaded EPUB or PDF and queues a job that does what
+extract_epub.py / extract_pdf.py and rag_setup.py do by hand: extract the
+chapters or pages into a chunk store, build the book's index (a local index,
+or a new OpenAI vector store) and its entity index, then hand the result back
+to the server, which registers the book and switches to the new index.
+
+Jobs run in a pool of worker processes, so extraction never competes with
+request handling for the GIL. Each job lives in its own directory under
+INGEST_DIR:
+
+    <job_id>/status.json   stage, counts, throughput, result or error
+    <job_id>/upload.epub   the uploaded file
+    <job_id>/store/        extracted records (see chunk_store.py)
+    <job_id>/text/         one .txt file per record (OpenAI backend only)
+    <job_id>/index/        the local index
+    <job_id>/entities.json the entity index
+    <job_id>/job.log       everything the pipeline printed
+
+The job process rewrites status.json as it goes, so any server worker can
+report any job's progress. Every job builds into a fresh directory (or vector
+store), so the index being served is never modified: switching books.json to
+the new one is a single atomic rename, and requests already in flight finish
+on the index they started with.
+"""
+
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from metrics import INGEST_JOBS
+
+STATUS_FILENAME = "status.json"
+EXTENSIONS = {".epub": "epub", ".pdf": "pdf"}
+BOOK_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+# How often a running job rewrites its status file
+PROGRESS_INTERVAL_SECONDS = 0.5
+# Upload bytes gathered before each write to disk
+UPLOAD_FLUSH_BYTES = 1 << 20
+# Ready jobs per book whose artifacts are kept: the current index and the one it replaced
+KEEP_VERSIONS = 2
+
+
+class UploadTooLargeError(ValueError):
+    """An upload over the configured size limit"""
+
+
+def read_status(job_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(job_dir, STATUS_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_status(job_dir: str, status: dict) -> None:
+    # Write to a temp file first so a reader never sees a half-written status
+    path = os.path.join(job_dir, STATUS_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def book_id_for(filename: str) -> str:
+    """A book ID from an upload's file name: "The Way of Kings.epub" -> "the-way-of-kings"."""
+    slug = re.sub(r"[^a-z0-9]+", "-", Path(filename).stem.lower()).strip("-")
+    return slug[:64] or "book"
+
+
+class JobProgress:
+    """Stage timings, counters and throughput of a running job, saved to its status file"""
+
+    def __init__(self, job_dir: str, status: dict):
+        self.job_dir = job_dir
+        self.status = status
+        self._stage_start = time.time()
+        self._saved_at = 0.0
+
+    def stage(self, name: str) -> None:
+        now = time.time()
+        previous = self.status.get("stage")
+        if previous in self.status["stage_seconds"]:
+            self.status["stage_seconds"][previous] = round(now - self._stage_start, 3)
+        self.status["stage"] = self.status["status"] = name
+        self.status["stage_seconds"][name] = 0.0
+        self._stage_start = now
+        self.save()
+
+    def add(self, **counts) -> None:
+        for name, value in counts.items():
+            self.status[name] = self.status.get(name, 0) + value
+        if time.time() - self._saved_at >= PROGRESS_INTERVAL_SECONDS:
+            self.save()
+
+    def save(self) -> None:
+        now = time.time()
+        status = self.status
+        stage = status.get("stage")
+        if stage in status["stage_seconds"]:
+            status["stage_seconds"][stage] = round(now - self._stage_start, 3)
+        extracting = status["stage_seconds"].get("extracting") or 0.0
+        if extracting:
+            status["throughput"] = {
+                "records_per_second": round(status["records"] / extracting, 2),
+                "mb_per_second": round(status["bytes"] / 1e6 / extracting, 3),
+            }
+        write_status(self.job_dir, status)
+        self._saved_at = now
+
+
+def iter_upload_records(path: str, kind: str, workers: int = 1):
+    if kind == "epub":
+        from extract_epub import iter_epub_chapters
+        return iter_epub_chapters(path, workers=workers)
+    from extract_pdf import iter_pdf_pages
+    return iter_pdf_pages(path, workers=workers)
+
+
+def run_job(job_dir: str, options: dict) -> dict:
+    """
+    Extract, index and entity-index one upload (runs in a worker process).
+    Returns the registry fields for the new indexes; raises on failure, after
+    recording the error in the status file.
+    """
+    status = read_status(job_dir)
+    status["started_at"] = time.time()
+    progress = JobProgress(job_dir, status)
+    job = Path(job_dir)
+
+    with open(job / "job.log", "a", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        try:
+            from chunk_store import ChunkStoreWriter
+            from chunking import iter_records
+            from entity_index import build_entity_index
+            from extraction_sinks import TextDirSink
+
+            # 1) Extract records into the chunk store (and .txt files for the vector store upload)
+            progress.stage("extracting")
+            text_dir = job / "text"
+            text_sink = TextDirSink(str(text_dir)) if options["backend"] == "openai" else None
+            with ChunkStoreWriter(str(job / "store")) as store:
+                for record in iter_upload_records(str(job / status["upload"]), status["kind"],
+                                                  options["extract_workers"]):
+                    store.add(record["text"], record["source"], record["title"], record["page"])
+                    if text_sink is not None:
+                        text_sink.write(record)
+                    progress.add(records=1, chars=len(record["text"]))
+            if not status["records"]:
+                raise ValueError("No chapters or pages with text found in the upload")
+
+            # 2) Build the indexes into this job's directory, never over the ones being served
+            progress.stage("indexing")
+            result = {}
+            if options["backend"] == "local":
+                result["local_index_dir"] = build_job_index(job, options.get("embeddings", False))
+            else:
+                from rag_setup import setup_rag_system
+                # Upload only: the CLI's sample query is about a particular book and would fail other uploads
+                vector_store_id = setup_rag_system(corpus_dirs=[str(text_dir)], book_id=status["book_id"],
+                                                   fresh=True, smoke_test=False)
+                if not vector_store_id:
+                    raise RuntimeError("Vector store upload failed (see job.log)")
+                result["vector_store_id"] = vector_store_id
+
+            entities = build_entity_index(iter_records(store_dir=str(job / "store")))
+            if len(entities):
+                entities.save(str(job / "entities.json"))
+                result["entity_index"] = str(job / "entities.json")
+            status["entities"] = len(entities)
+
+            progress.stage("publishing")
+            status["result"] = result
+            progress.save()
+            return result
+        except Exception as e:
+            status["status"] = "failed"
+            status["error"] = f"{type(e).__name__}: {e}"
+            status["finished_at"] = time.time()
+            progress.save()
+            raise
+
+
+def build_job_index(job: Path, with_embeddings: bool = False) -> str:
+    from local_index import LocalIndex, load_passages_from_store, openai_embed_fn
+
+    passages = load_passages_from_store(str(job / "store"))
+    index = LocalIndex(passages)
+    if with_embeddings:
+        from openai import OpenAI
+        from config import config
+        from vector_index import create_embedding_cache
+
+        client = OpenAI(api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL)
+        # A re-ingested book only pays for the chunks that changed
+        cache = create_embedding_cache(config)
+        try:
+            reused = index.add_embeddings(openai_embed_fn(client, config.EMBEDDING_MODEL),
+                                          codec=config.LOCAL_EMBEDDING_CODEC, subspaces=config.LOCAL_PQ_SUBSPACES,
+                                          cache=cache, model=config.EMBEDDING_MODEL)
+        finally:
+            if cache is not None:
+                cache.close()
+        print(f"🧮 Embedded {len(passages) - reused} passages ({reused} from the cache)")
+    return str(index.save(str(job / "index")))
+
+
+class IngestQueue:
+    """Ingestion jobs: their directories, the worker pool running them, and publishing the results"""
+
+    def __init__(self, jobs_dir: str = "ingest_jobs", workers: int = 1, extract_workers: int = 1,
+                 backend: str = "local", max_bytes: int = 200 * 1024 * 1024):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.extract_workers = extract_workers
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self._executor = None
+        self._tasks = set()
+        self.submitted = 0
+        Path(jobs_dir).mkdir(parents=True, exist_ok=True)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # spawn: forking a server process with live threads and sockets is not safe
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def create(self, filename: str, book_id: Optional[str] = None, title: Optional[str] = None,
+               series_id: Optional[str] = None, embeddings: bool = False) -> dict:
+        """A queued job's status for an upload; raises ValueError for an unsupported file or bad book ID."""
+        kind = EXTENSIONS.get(Path(filename).suffix.lower())
+        if kind is None:
+            raise ValueError(f"Unsupported file type: {filename} (expected .epub or .pdf)")
+        book_id = book_id or book_id_for(filename)
+        if not BOOK_ID_RE.match(book_id):
+            raise ValueError(f"Invalid book ID: {book_id} (letters, digits, '-' and '_')")
+
+        # Time-ordered IDs, so a book's versions sort by age
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        status = {
+            "job_id": job_id, "book_id": book_id, "title": title or Path(filename).stem, "series_id": series_id,
+            "filename": Path(filename).name, "kind": kind, "upload": f"upload.{kind}", "embeddings": embeddings,
+            "status": "receiving", "stage": None, "stage_seconds": {}, "created_at": time.time(),
+            "started_at": None, "finished_at": None, "bytes": 0, "records": 0, "chars": 0,
+            "result": None, "error": None,
+        }
+        os.makedirs(self.job_dir(job_id))
+        write_status(self.job_dir(job_id), status)
+        return status
+
+    async def receive(self, status: dict, chunks: AsyncIterator[bytes]) -> None:
+        """Write the upload body to the job directory as it arrives; raises UploadTooLargeError over the limit."""
+        job_dir = self.job_dir(status["job_id"])
+        size, buffer = 0, bytearray()
+        try:
+            # Disk writes run in a thread, a buffer's worth at a time, so the event loop never waits on them
+            f = await asyncio.to_thread(open, os.path.join(job_dir, status["upload"]), "wb")
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB")
+                    buffer += chunk
+                    if len(buffer) >= UPLOAD_FLUSH_BYTES:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+            finally:
+                await asyncio.to_thread(f.close)
+            if not size:
+                raise ValueError("Empty upload")
+        except Exception:
+            await asyncio.to_thread(shutil.rmtree, job_dir, ignore_errors=True)
+            raise
+        status["bytes"] = size
+
+    def submit(self, status: dict, publish: Callable[[dict], Awaitable[None]]) -> None:
+        """Queue a received job; publish(status) registers its result once the indexes are built."""
+        status["status"] = "queued"
+        write_status(self.job_dir(status["job_id"]), status)
+        options = {"backend": self.backend, "extract_workers": self.extract_workers,
+                   "embeddings": status["embeddings"]}
+        future = self._pool().submit(run_job, self.job_dir(status["job_id"]), options)
+        self.submitted += 1
+        # Keep a reference so the task is not garbage collected while the job runs
+        task = asyncio.create_task(self._finish(status["job_id"], asyncio.wrap_future(future), publish))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _finish(self, job_id: str, future, publish: Callable[[dict], Awaitable[None]]) -> None:
+        job_dir = self.job_dir(job_id)
+        try:
+            await future
+            status = read_status(job_dir)
+            start = time.time()
+            await publish(status)
+            status["stage_seconds"]["publishing"] = round(time.time() - start, 3)
+            status.update(status="ready", stage="ready", finished_at=time.time())
+            write_status(job_dir, status)
+            INGEST_JOBS.inc(outcome="ready")
+            await asyncio.to_thread(self.prune, status["book_id"])
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker process died; later jobs get a new pool
+                self._executor = None
+            # run_job records its own errors; this covers a crashed worker or a failed publish
+            status = read_status(job_dir) or {"job_id": job_id}
+            if status.get("status") != "failed":
+                status.update(status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+                write_status(job_dir, status)
+            INGEST_JOBS.inc(outcome="failed")
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not re.match(r"^[\w-]+$", job_id):
+            return None
+        return read_status(self.job_dir(job_id))
+
+    def jobs(self, book_id: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """Jobs from every worker, newest first."""
+        jobs = []
+        for job_id in sorted(os.listdir(self.jobs_dir), reverse=True):
+            status = read_status(self.job_dir(job_id))
+            if status is not None and (book_id is None or status.get("book_id") == book_id):
+                jobs.append(status)
+                if len(jobs) >= limit:
+                    break
+        return jobs
+
+    def prune(self, book_id: str) -> None:
+        """Delete the artifacts of a book's older versions, keeping the current and the previous index."""
+        ready = [s for s in self.jobs(book_id, limit=10_000) if s.get("status") == "ready"]
+        for status in ready[KEEP_VERSIONS:]:
+            job_dir = Path(self.job_dir(status["job_id"]))
+            for name in ("store", "text", "index"):
+                shutil.rmtree(job_dir / name, ignore_errors=True)
+            for name in (status["upload"], "entities.json"):
+                with contextlib.suppress(FileNotFoundError):
+                    (job_dir / name).unlink()
+
+    def stats(self) -> dict:
+        counts = {}
+        for status in self.jobs(limit=10_000):
+            counts[status.get("status")] = counts.get(status.get("status"), 0) + 1
+        return {"backend": self.backend, "workers": self.workers, "submitted_here": self.submitted,
+                "running_here": len(self._tasks), "jobs": counts}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_ingest_queue(config) -> IngestQueue:
+    return IngestQueue(config.INGEST_DIR, config.INGEST_WORKERS, config.INGEST_EXTRACT_WORKERS,
+                       config.RETRIEVAL_BACKEND, config.INGEST_MAX_UPLOAD_MB * 1024 * 1024)
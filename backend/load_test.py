@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Load Test for Book Companion
+Capacity-plans the backend against the fake OpenAI server (fake_openai.py), so
+no load reaches the paid API.
+
+    ask        Open-loop load on /ask (or /ask/stream): requests are sent on a
+               schedule at each target rate, whether or not earlier ones have
+               finished, the way independent users arrive. Latency is measured
+               from each request's scheduled send time, so a backed-up server
+               cannot hide its queueing delay. Each level reports throughput,
+               latency percentiles, errors and the upstream calls in flight;
+               the first level the backend cannot sustain is its saturation point.
+    rag-setup  Times rag_setup.py uploading a synthetic corpus to the fake
+               Files / Vector Stores API, per corpus size.
+
+By default the fake server and the backend run in this process. Pass
+--app-url / --fake-url to load a separately started backend (e.g. uvicorn with
+several workers) and fake server instead; the numbers are then not skewed by
+the load generator sharing their CPU. Results are written as JSON (--output)
+and can be compared with an earlier run (--baseline).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+import fake_openai
+
+DEFAULT_QUESTIONS = ["Who is Cenn?", "Who is Kaladin?", "What does Szeth do at the king's feast?",
+                     "Why does Kaladin distrust lighteyes?", "Who is Shallan and what does she want from Jasnah?"]
+
+
+def percentile(sorted_values: list, pct: float):
+    """Nearest-rank percentile of an ascending list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(seconds: list) -> dict:
+    values = sorted(seconds)
+    summary = {f"p{p}_ms": percentile(values, p) for p in (50, 90, 95, 99)}
+    summary["max_ms"] = values[-1] if values else None
+    summary["mean_ms"] = sum(values) / len(values) if values else None
+    return {k: round(v * 1000, 1) if v is not None else None for k, v in summary.items()}
+
+
+def load_questions(path: str = None) -> list:
+    """Questions from eval_questions.json-style files ([{"question": ...}] or a list of strings)."""
+    path = path or ("eval_questions.json" if os.path.exists("eval_questions.json") else None)
+    if path is None:
+        return DEFAULT_QUESTIONS
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    return [item["question"] if isinstance(item, dict) else item for item in items] or DEFAULT_QUESTIONS
+
+
+async def send_one(http: httpx.AsyncClient, path: str, question: str, stream: bool, scheduled: float) -> dict:
+    """One request; times are from its scheduled send time (perf_counter)."""
+    result = {"ok": False, "status": None, "seconds": None, "ttft": None}
+    try:
+        if stream:
+            async with http.stream("POST", path, json={"query": question}) as response:
+                result["status"] = response.status_code
+                done = False
+                async for line in response.aiter_lines():
+                    if line.startswith("event: delta") and result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - scheduled
+                    elif line.startswith("event: done"):
+                        done = True
+                    elif line.startswith("event: error"):
+                        result["status"] = "stream_error"
+                result["ok"] = response.status_code == 200 and done
+        else:
+            response = await http.post(path, json={"query": question})
+            result["status"] = response.status_code
+            result["ok"] = response.status_code == 200
+    except httpx.TimeoutException:
+        result["status"] = "timeout"
+    except httpx.HTTPError as e:
+        result["status"] = type(e).__name__
+    result["seconds"] = time.perf_counter() - scheduled
+    return result
+
+
+async def run_level(app_url: str, fake_url: str, rps: float, duration: float, questions: list, args) -> dict:
+    """Send requests at rps for duration seconds and summarize how the backend kept up."""
+    path = "/ask/stream" if args.stream else "/ask"
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_outstanding, max_keepalive_connections=args.max_outstanding)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as http, \
+            httpx.AsyncClient(base_url=fake_url, timeout=10) as fake:
+        await fake.post("/reset")
+        tasks, dropped, sent = [], 0, 0
+        start = time.perf_counter()
+        offset = 0.0
+        while offset < duration:
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if sum(not t.done() for t in tasks[-args.max_outstanding:]) >= args.max_outstanding:
+                dropped += 1
+            else:
+                question = questions[sent % len(questions)]
+                if not args.repeat_questions:
+                    # Distinct questions, so the answer cache and coalescing do not hide model calls
+                    question = f"{question} ({sent})"
+                tasks.append(asyncio.create_task(send_one(http, path, question, args.stream, scheduled)))
+                sent += 1
+            offset += rng.expovariate(rps) if args.arrivals == "poisson" else 1 / rps
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        upstream = (await fake.get("/stats")).json()
+
+    ok = [r for r in results if r["ok"]]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    latency = latency_summary([r["seconds"] for r in ok])
+    # Time past the last send beyond one typical request is backlog the server could not keep up with
+    backlog = max(0.0, elapsed - duration - (latency["p50_ms"] or 0) / 1000)
+    level = {
+        "target_rps": rps,
+        "duration_seconds": duration,
+        "sent": sent,
+        "ok": len(ok),
+        "errors": errors,
+        "dropped": dropped,
+        # Poisson arrivals offer a little more or less than the target in a finite run
+        "offered_rps": round((sent + dropped) / duration, 2),
+        "error_rate": round((sent - len(ok) + dropped) / max(1, sent + dropped), 4),
+        "achieved_rps": round(len(ok) / (duration + backlog), 2),
+        "backlog_seconds": round(backlog, 2),
+        "latency": latency,
+        "upstream": {k: upstream[k] for k in ("requests", "errors", "peak_in_flight")},
+    }
+    if args.stream:
+        level["time_to_first_token"] = latency_summary([r["ttft"] for r in ok if r["ttft"] is not None])
+    return level
+
+
+def sustained(level: dict, args) -> bool:
+    """Whether the backend kept up with a level: throughput, errors and (optionally) p99 within bounds."""
+    if level["achieved_rps"] < level["offered_rps"] * (1 - args.tolerance):
+        return False
+    if level["error_rate"] > args.max_error_rate:
+        return False
+    p99 = level["latency"]["p99_ms"]
+    return args.slo_ms is None or (p99 is not None and p99 <= args.slo_ms)
+
+
+def start_in_process(args) -> tuple:
+    """Start the fake server and the backend in this process; returns their URLs."""
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    # Point the backend at the fake server before main.py reads its config
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    os.environ["OPENAI_BASE_URL"] = f"{fake_url}/v1"
+    fake_openai.start_in_thread(fake_openai.app, port=args.fake_port)
+    if args.command == "rag-setup":
+        return None, fake_url
+
+    os.environ.setdefault("MAX_CONCURRENT_REQUESTS", str(args.max_outstanding))
+    # Distinct questions never hit the cache anyway; keep its bookkeeping out of the measurement
+    os.environ.setdefault("CACHE_BACKEND", "none")
+    import main as backend
+    backend.VECTOR_STORE_ID = backend.VECTOR_STORE_ID or "vs_fake"
+    fake_openai.start_in_thread(backend.app, port=args.app_port)
+    return f"http://127.0.0.1:{args.app_port}", fake_url
+
+
+def configure_fake(fake_url: str, args) -> dict:
+    settings = {"latency": args.latency, "error_rate": args.error_rate, "error_statuses": args.error_status,
+                "tokens_per_second": args.tokens_per_second, "output_tokens": args.output_tokens}
+    response = httpx.post(f"{fake_url}/config", json=settings, timeout=10)
+    if response.status_code != 200:
+        raise SystemExit(f"❌ Fake server rejected the settings: {response.text}")
+    return response.json()
+
+
+def run_ask(args, app_url: str, fake_url: str) -> dict:
+    questions = load_questions(args.queries)
+    print(f"🚀 Open-loop load on {'/ask/stream' if args.stream else '/ask'} at {app_url} "
+          f"({args.duration:g}s per level, {args.arrivals} arrivals)")
+    print(f"{'target rps':>10} {'offered':>8} {'achieved':>9} {'ok':>6} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'backlog s':>9} {'upstream peak':>14}")
+
+    levels = []
+    report = {"max_sustained_rps": None, "saturated_at_rps": None}
+    for rps in args.rps:
+        level = asyncio.run(run_level(app_url, fake_url, rps, args.duration, questions, args))
+        level["sustained"] = sustained(level, args)
+        levels.append(level)
+        latency = level["latency"]
+        print(f"{rps:>10g} {level['offered_rps']:>8.1f} {level['achieved_rps']:>9.1f} {level['ok']:>6} "
+              f"{level['sent'] - level['ok'] + level['dropped']:>7} {latency['p50_ms'] or 0:>8.0f} "
+              f"{latency['p95_ms'] or 0:>8.0f} {latency['p99_ms'] or 0:>8.0f} {level['backlog_seconds']:>9.1f} "
+              f"{level['upstream']['peak_in_flight']:>14}" + ("" if level["sustained"] else "  ⚠️ saturated"))
+        if level["sustained"]:
+            report["max_sustained_rps"] = rps
+        elif report["saturated_at_rps"] is None:
+            report["saturated_at_rps"] = rps
+            if not args.keep_going:
+                break
+
+    if report["saturated_at_rps"] is None:
+        print(f"✅ Sustained every level (up to {report['max_sustained_rps']:g} rps)")
+    else:
+        highest = report["max_sustained_rps"]
+        print(f"📉 Saturated at {report['saturated_at_rps']:g} rps; highest sustained level: "
+              + (f"{highest:g} rps" if highest is not None else "none"))
+    return dict(report, levels=levels)
+
+
+def run_rag_setup(args, fake_url: str) -> dict:
+    """Upload synthetic corpora of each size with rag_setup.py and time them."""
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    os.environ.setdefault("OPENAI_BASE_URL", f"{fake_url}/v1")
+    from rag_setup import setup_rag_system
+
+    print(f"🚀 Timing rag_setup.py uploads to {fake_url} ({args.file_kb} KB per file)")
+    print(f"{'files':>7} {'seconds':>8} {'files/s':>8} {'MB/s':>7} {'calls':>6} {'429/5xx':>8} {'peak in flight':>15}")
+    levels = []
+    cwd = os.getcwd()
+    for count in args.files:
+        with tempfile.TemporaryDirectory() as workdir:
+            # rag_setup.py keeps its manifest in the working directory; keep the real one untouched
+            os.chdir(workdir)
+            try:
+                corpus = os.path.join(workdir, "corpus")
+                os.makedirs(corpus)
+                line = "Kaladin stood at the edge of the chasm and watched the storm roll in. "
+                for i in range(count):
+                    with open(os.path.join(corpus, f"chapter_{i:04d}.txt"), "w", encoding="utf-8") as f:
+                        f.write(line * max(1, args.file_kb * 1024 // len(line)))
+                httpx.post(f"{fake_url}/reset", timeout=10)
+                start = time.perf_counter()
+                with open(os.path.join(workdir, "rag_setup.log"), "w") as log, contextlib.redirect_stdout(log):
+                    vector_store_id = setup_rag_system(corpus_dirs=[corpus], book_id="load-test", fresh=True)
+                seconds = time.perf_counter() - start
+                upstream = httpx.get(f"{fake_url}/stats", timeout=10).json()
+            finally:
+                os.chdir(cwd)
+
+        level = {
+            "files": count,
+            "file_kb": args.file_kb,
+            "seconds": round(seconds, 2),
+            "files_per_second": round(count / seconds, 2),
+            "mb_per_second": round(count * args.file_kb / 1024 / seconds, 3),
+            "succeeded": vector_store_id is not None,
+            "upstream": {k: upstream[k] for k in ("requests", "errors", "peak_in_flight")},
+        }
+        levels.append(level)
+        print(f"{count:>7} {seconds:>8.2f} {level['files_per_second']:>8.1f} {level['mb_per_second']:>7.2f} "
+              f"{upstream['requests']:>6} {upstream['errors']:>8} {upstream['peak_in_flight']:>15}")
+    return {"levels": levels}
+
+
+def compare(report: dict, baseline_path: str) -> None:
+    """Print each level's change against the same level of an earlier run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("command") != report["command"]:
+        print(f"⚠️  Baseline is a {baseline.get('command')} run; not comparing")
+        return
+    key = "target_rps" if report["command"] == "ask" else "files"
+    before = {level[key]: level for level in baseline["levels"]}
+    print(f"\n📊 Compared with {baseline_path} ({baseline.get('started_at')})")
+    for level in report["levels"]:
+        old = before.get(level[key])
+        if old is None:
+            continue
+        if report["command"] == "ask":
+            changes = [("achieved rps", old["achieved_rps"], level["achieved_rps"]),
+                       ("p50 ms", old["latency"]["p50_ms"], level["latency"]["p50_ms"]),
+                       ("p99 ms", old["latency"]["p99_ms"], level["latency"]["p99_ms"])]
+        else:
+            changes = [("files/s", old["files_per_second"], level["files_per_second"])]
+        text = ", ".join(f"{name} {a} -> {b}" + (f" ({(b - a) / a:+.0%})" if a and b is not None else "")
+                         for name, a, b in changes)
+        print(f"  {key} {level[key]:g}: {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the backend against a local fake OpenAI server')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--latency', default='0.2',
+                        help='Upstream latency in seconds or a distribution, e.g. lognormal:0.3,0.5 (default: 0.2)')
+    common.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream calls that fail')
+    common.add_argument('--error-status', type=int, nargs='+', default=[429],
+                        help='Statuses of failed upstream calls (default: 429)')
+    common.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='Upstream answer generation speed in words per second (default: 0)')
+    common.add_argument('--output-tokens', type=int, default=0,
+                        help='Upstream answer length in words (default: 0, a short echo)')
+    common.add_argument('--fake-url', default=None, help='Use a running fake_openai.py instead of starting one')
+    common.add_argument('--fake-port', type=int, default=8100, help='Port for the in-process fake server')
+    common.add_argument('-o', '--output', default='load_test_results.json',
+                        help='JSON results file (default: load_test_results.json)')
+    common.add_argument('--baseline', default=None, help='Earlier results file to compare against')
+
+    ask = subparsers.add_parser('ask', parents=[common], help='Open-loop load on /ask at target request rates')
+    ask.add_argument('--rps', type=float, nargs='+', default=[5, 10, 20, 40, 80],
+                     help='Target request rates, tested in order (default: 5 10 20 40 80)')
+    ask.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds per level (default: 10)')
+    ask.add_argument('--arrivals', choices=['poisson', 'constant'], default='poisson',
+                     help='Random (poisson) or evenly spaced arrivals (default: poisson)')
+    ask.add_argument('--stream', action='store_true', help='Load /ask/stream and report time to first token')
+    ask.add_argument('--queries', default=None,
+                     help='JSON list of questions (default: eval_questions.json if present)')
+    ask.add_argument('--repeat-questions', action='store_true',
+                     help='Send questions verbatim, so the cache and coalescing can absorb repeats')
+    ask.add_argument('--slo-ms', type=float, default=None, help='p99 latency a sustained level must stay under')
+    ask.add_argument('--tolerance', type=float, default=0.1,
+                     help='Throughput shortfall that counts as saturated (default: 0.1 = 10%%)')
+    ask.add_argument('--max-error-rate', type=float, default=0.01,
+                     help='Error rate that counts as saturated (default: 0.01)')
+    ask.add_argument('--keep-going', action='store_true', help='Run every level, even past saturation')
+    ask.add_argument('--max-outstanding', type=int, default=1000,
+                     help='Requests in flight before new ones are dropped (default: 1000)')
+    ask.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds (default: 60)')
+    ask.add_argument('--seed', type=int, default=0, help='Seed for the arrival schedule (default: 0)')
+    ask.add_argument('--app-url', default=None, help='Load a running backend instead of starting one')
+    ask.add_argument('--app-port', type=int, default=8101, help='Port for the in-process backend')
+
+    rag = subparsers.add_parser('rag-setup', parents=[common], help='Time rag_setup.py uploads')
+    rag.add_argument('--files', type=int, nargs='+', default=[50, 200], help='Corpus sizes (default: 50 200)')
+    rag.add_argument('--file-kb', type=int, default=8, help='Size of each synthetic file in KB (default: 8)')
+
+    args = parser.parse_args()
+    if args.command == 'ask' and (min(args.rps) <= 0 or args.duration <= 0):
+        parser.error('--rps and --duration must be positive')
+
+    app_url, fake_url = getattr(args, 'app_url', None), args.fake_url
+    if fake_url is None or (args.command == 'ask' and app_url is None):
+        if args.fake_url is not None or app_url is not None:
+            parser.error('--app-url and --fake-url must be given together')
+        app_url, fake_url = start_in_process(args)
+    upstream = configure_fake(fake_url, args)
+
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    result = run_ask(args, app_url, fake_url) if args.command == 'ask' else run_rag_setup(args, fake_url)
+    report = {
+        "command": args.command,
+        "started_at": started_at,
+        "host": {"cpus": os.cpu_count(), "python": sys.version.split()[0]},
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "upstream_settings": upstream,
+        **result,
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Local Retrieval Index for Book Companion
+Builds an in-process BM25 index (plus optional, optionally quantized passage
+embeddings; see vector_index.py) over the extracted book content so questions
+can be answered without a remote vector store.
+
+A saved index keeps passage texts in a chunk store (see chunk_store.py) inside
+the index directory; loading it memory-maps the texts, so every worker shares
+one copy and only holds the postings and passage metadata itself.
+"""
+
+import heapq
+import math
+import os
+import pickle
+import re
+import shutil
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from chunk_store import ChunkStore, ChunkStoreWriter
+from vector_index import EmbeddingCache, VectorIndex, embed_texts
+
+CORPUS_DIRS = ["epub_extracted_chapters/", "pdf_extracted_pages/"]
+SUMMARY_FILENAME = "extraction_summary.txt"
+
+INDEX_FILENAME = "index.pkl"
+PASSAGES_DIRNAME = "passages"  # chunk store of passage texts, record i = passage i
+
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her his how i in "
+    "is it its of on or she that the their them they this to was were what when where "
+    "which who whom why will with you".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_document(text: str, chunk_words: int = 200, overlap: int = 40) -> List[str]:
+    """Split a document into overlapping windows of roughly chunk_words words."""
+    words = text.split()
+    if len(words) <= chunk_words:
+        return [" ".join(words)] if words else []
+
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def load_passages_from_store(store_dir: str, chunk_words: int = 200, overlap: int = 40) -> List[dict]:
+    """Split every record of a chunk store into passages, keeping title and page."""
+    from chunk_store import ChunkStore
+
+    passages = []
+    with ChunkStore(store_dir) as store:
+        for i in range(len(store)):
+            record = store.record(i)
+            for chunk_num, chunk in enumerate(chunk_document(store.text(i), chunk_words, overlap)):
+                passages.append({
+                    "id": len(passages),
+                    "source": record["source"],
+                    "title": record["title"],
+                    "page": record["page"],
+                    "chunk": chunk_num,
+                    "text": chunk,
+                })
+    return passages
+
+
+def load_passages(corpus_dirs: Optional[List[str]] = None,
+                  chunk_words: int = 200, overlap: int = 40) -> List[dict]:
+    """Read every extracted .txt file and split it into passages, with chapter titles from the summary."""
+    from chunk_store import read_summary_titles
+
+    passages = []
+    for directory in corpus_dirs or CORPUS_DIRS:
+        dir_path = Path(directory)
+        if not dir_path.exists():
+            continue
+        titles = read_summary_titles(dir_path)
+        for file_path in sorted(dir_path.glob("*.txt")):
+            if file_path.name == SUMMARY_FILENAME:
+                continue
+            text = file_path.read_text(encoding="utf-8")
+            for chunk_num, chunk in enumerate(chunk_document(text, chunk_words, overlap)):
+                passages.append({
+                    "id": len(passages),
+                    "source": file_path.name,
+                    "title": titles.get(file_path.name, ""),
+                    "chunk": chunk_num,
+                    "text": chunk,
+                })
+    return passages
+
+
+def load_passages_from_chunks(chunks_path: str) -> List[dict]:
+    """Load passages from chunking.py JSONL output as-is, without re-chunking."""
+    from chunking import read_jsonl
+
+    return [
+        {
+            "id": i,
+            "source": chunk["source"],
+            "title": chunk.get("title", ""),
+            "page": chunk.get("page_start", 0),
+            "page_end": chunk.get("page_end", 0),
+            "chunk": chunk.get("id", i),
+            "tokens": chunk.get("tokens", 0),
+            "text": chunk["text"],
+        }
+        for i, chunk in enumerate(read_jsonl(chunks_path))
+    ]
+
+
+class StoredPassages:
+    """The passages of a loaded index: metadata in memory, texts from its memory-mapped chunk store"""
+
+    def __init__(self, metadata: List[dict], store: ChunkStore):
+        self.metadata = metadata
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def __getitem__(self, i: int) -> dict:
+        return dict(self.metadata[i], text=self.store.text(i))
+
+    def __iter__(self):
+        for i in range(len(self.metadata)):
+            yield self[i]
+
+
+class LocalIndex:
+    """BM25 inverted index over book passages with optional passage embeddings (a VectorIndex)"""
+
+    def __init__(self, passages: List[dict], k1: float = 1.5, b: float = 0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.embeddings = None
+
+        # term -> list of (passage id, term frequency)
+        self.postings: Dict[str, List[tuple]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+
+        for passage in passages:
+            tokens = tokenize(passage["text"])
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((passage["id"], tf))
+
+        self.postings = dict(self.postings)
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        num_docs = len(passages)
+        self.idf = {
+            term: math.log(1 + (num_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def bm25_scores(self, query: str) -> Dict[int, float]:
+        """Score every passage that shares at least one term with the query."""
+        scores: Dict[int, float] = defaultdict(float)
+        k1, b, avg = self.k1, self.b, self.avg_doc_length or 1.0
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = k1 * (1 - b + b * self.doc_lengths[doc_id] / avg)
+                scores[doc_id] += idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int = 5, query_embedding=None,
+               embedding_weight: float = 0.5) -> List[dict]:
+        """Return the top-k passages for a query, each with a retrieval score."""
+        scores = self.bm25_scores(query)
+
+        if query_embedding is not None and self.embeddings is not None:
+            # Blend max-normalised BM25 with cosine similarity
+            top_bm25 = max(scores.values()) if scores else 1.0
+            blended = self.embeddings.similarities(query_embedding) * embedding_weight
+            for doc_id, score in scores.items():
+                blended[doc_id] += (1 - embedding_weight) * score / top_bm25
+            top_ids = (-blended).argsort()[:k]
+            ranked = [(int(i), float(blended[i])) for i in top_ids]
+        else:
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+        return [dict(self.passages[doc_id], score=score) for doc_id, score in ranked]
+
+    def lexical_search(self, query: str, k: int = 5) -> List[dict]:
+        """Top-k passages by BM25 alone."""
+        scores = self.bm25_scores(query)
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [dict(self.passages[doc_id], score=score) for doc_id, score in ranked]
+
+    def vector_search(self, query_embedding, k: int = 5, rescore: int = 0) -> List[dict]:
+        """Top-k passages by cosine similarity alone; empty without embeddings."""
+        if query_embedding is None:
+            return []
+        return self.vector_search_many([query_embedding], k, rescore)[0]
+
+    def vector_search_many(self, query_embeddings: List, k: int = 5, rescore: int = 0) -> List[List[dict]]:
+        """
+        vector_search for several queries in one pass over the embeddings.
+        rescore > k re-scores that many quantized candidates exactly.
+        """
+        if self.embeddings is None:
+            return [[] for _ in query_embeddings]
+        ids, scores = self.embeddings.search(query_embeddings, k, rescore)
+        return [
+            [dict(self.passages[int(doc_id)], score=float(score)) for doc_id, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def add_embeddings(self, embed_fn: Callable[[List[str]], List[List[float]]], batch_size: int = 256,
+                       codec: str = "float32", subspaces: int = 0, cache: Optional[EmbeddingCache] = None,
+                       model: str = "") -> int:
+        """
+        Embed every passage (reusing cached embeddings of unchanged chunks) and
+        store them with the given codec. Returns how many came from the cache.
+        """
+        matrix, reused = embed_texts([p["text"] for p in self.passages], embed_fn, batch_size, cache, model)
+        self.embeddings = VectorIndex.build(matrix, codec, subspaces)
+        return reused
+
+    def save(self, index_dir: str) -> Path:
+        """Persist the index (passage texts as a chunk store, and embeddings, if any) to a directory."""
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        # Written aside and swapped in file by file: a worker may have the old texts memory-mapped
+        staging = index_path / f"{PASSAGES_DIRNAME}.tmp"
+        metadata = []
+        with ChunkStoreWriter(str(staging)) as writer:
+            for passage in self.passages:
+                writer.add(passage["text"], passage["source"], passage.get("title", ""), passage.get("page", 0))
+                metadata.append({k: v for k, v in passage.items() if k != "text"})
+        passages_path = index_path / PASSAGES_DIRNAME
+        passages_path.mkdir(exist_ok=True)
+        for file_path in staging.iterdir():
+            os.replace(file_path, passages_path / file_path.name)
+        shutil.rmtree(staging)
+
+        if self.embeddings is not None:
+            self.embeddings.save(str(index_path))
+
+        state = {k: v for k, v in self.__dict__.items() if k not in ("embeddings", "passages")}
+        state["passage_metadata"] = metadata
+        # Recorded so a rebuild without embeddings never picks up an earlier build's vectors
+        state["has_embeddings"] = self.embeddings is not None
+        tmp_path = index_path / f"{INDEX_FILENAME}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path / INDEX_FILENAME)
+
+        if self.embeddings is None:
+            VectorIndex.remove(str(index_path))
+        return index_path
+
+    @classmethod
+    def load(cls, index_dir: str) -> "LocalIndex":
+        """Load an index previously written by save()."""
+        index_path = Path(index_dir)
+        with open(index_path / INDEX_FILENAME, "rb") as f:
+            state = pickle.load(f)
+
+        index = cls.__new__(cls)
+        metadata = state.pop("passage_metadata", None)
+        # Indexes saved before this was recorded kept whatever embeddings the directory held
+        has_embeddings = state.pop("has_embeddings", True)
+        index.__dict__.update(state)
+        if metadata is not None:
+            index.passages = StoredPassages(metadata, ChunkStore(str(index_path / PASSAGES_DIRNAME)))
+        # else: an index saved before passage texts moved to a chunk store, with the texts in the pickle
+        # Memory-mapped, so workers share one copy of the codes through the page cache
+        index.embeddings = VectorIndex.load(str(index_path)) if has_embeddings else None
+        return index
+
+
+def openai_embed_fn(client, model: str) -> Callable[[List[str]], List[List[float]]]:
+    """Build an embedding function backed by the OpenAI embeddings endpoint."""
+    def embed(texts: List[str]) -> List[List[float]]:
+        response = client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
+    return embed
+
+
+def build_prompt(question: str, passages: List[dict], facts: str = "") -> str:
+    """Combine retrieved passages, precomputed facts (see entity_index.py) and the user's question into a model input."""
+    context = "\n\n".join(
+        f"[{i}] ({p['source']})\n{p['text']}" for i, p in enumerate(passages, 1)
+    )
+    return (
+        "Answer the question about the book using only the excerpts below. "
+        "If the excerpts do not contain the answer, say so.\n\n"
+        + (f"Facts from the book's index:\n{facts}\n\n" if facts else "")
+        + f"Excerpts:\n{context}\n\n"
+        f"Question: {question}"
+    )
+
+
+def build_local_index(index_dir: str, corpus_dirs: Optional[List[str]] = None,
+                      embed_fn=None, chunk_words: int = 200, overlap: int = 40,
+                      store_dir: Optional[str] = None, chunks_path: Optional[str] = None,
+                      codec: str = "float32", subspaces: int = 0, embedding_cache: Optional[EmbeddingCache] = None,
+                      embedding_model: str = "") -> LocalIndex:
+    """
+    Build a LocalIndex over the extracted corpus (or a chunk store, or chunking.py
+    output) and save it to disk. With embed_fn, passage embeddings are stored with
+    codec ("float32", "int8" or "pq"), reusing embedding_cache entries for unchanged chunks.
+    """
+    start = time.perf_counter()
+    if chunks_path:
+        passages = load_passages_from_chunks(chunks_path)
+    elif store_dir:
+        passages = load_passages_from_store(store_dir, chunk_words, overlap)
+    else:
+        passages = load_passages(corpus_dirs, chunk_words, overlap)
+    print(f"📁 Loaded {len(passages)} passages")
+
+    index = LocalIndex(passages)
+    print(f"🔎 Built BM25 index with {len(index.postings)} terms "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    if embed_fn is not None:
+        print("🧮 Computing passage embeddings...")
+        reused = index.add_embeddings(embed_fn, codec=codec, subspaces=subspaces, cache=embedding_cache,
+                                      model=embedding_model)
+        print(f"✅ Embedded {len(passages) - reused} passages ({reused} unchanged, from the cache); "
+              f"{index.embeddings.codec} codes take {index.embeddings.nbytes / 1e6:.2f} MB")
+
+    saved_to = index.save(index_dir)
+    print(f"💾 Local index saved to {saved_to}")
+    return index
@@ -1,14 +1,194 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response as HTTPResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from starlette.background import BackgroundTask
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import gc
+import json
+import math
+import time
 import uvicorn
-from openai import OpenAI
 from config import config
+from answer_cache import cache_key, create_answer_cache, normalize_query
+from book_registry import BookRegistry, IndexCache, UnknownBookError, registry_lock
+from coalesce import create_coalescer
+from entity_index import EntityIndex
+from ingest import UploadTooLargeError, create_ingest_queue
+from metrics import (PROMETHEUS_CONTENT_TYPE, ENTITY_LOOKUPS, MetricsMiddleware, record_stage, record_usage,
+                     registry, span)
+from routing import BudgetExceededError, create_router
+from sessions import create_session_store
 import pathlib
 import os
 
-app = FastAPI(title="Book Companion API", version="1.0.0")
+# Process-wide state. Nothing here is built at import time: the lifespan (or
+# preload() for fork-based servers) fills it in, and the client is built on first use.
+client = None
+reranker = None
+router = None
+answer_cache = None
+coalescer = None
+session_store = None
+ingest_queue = None
+VECTOR_STORE_ID = None
+book_registry = None
+# books.json modification time when book_registry was loaded, to pick up other workers' changes
+registry_mtime = None
+# Serializes this worker's books.json updates; registry_lock() serializes them across workers
+registry_update_lock = asyncio.Lock()
+
+# Local index handles per book, loaded on first use with LRU eviction
+index_cache = IndexCache(config.INDEX_CACHE_SIZE)
+
+# Entity indexes by path, loaded on first use (None when a book's index has not been built)
+entity_indexes = {}
+# Entities whose facts are added to a question's context
+ENTITY_CONTEXT_LIMIT = 3
+
+# Bound the number of questions in flight against the model at once
+request_semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
+
+
+def get_client():
+    """The shared async OpenAI client with a pooled HTTP connection, built on first use."""
+    global client
+    if client is None:
+        # Imported here: the openai package is a large share of cold-start import time
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        client = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            base_url=config.OPENAI_BASE_URL,
+            timeout=config.OPENAI_TIMEOUT,
+            max_retries=config.OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=config.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.OPENAI_MAX_KEEPALIVE,
+                ),
+            ),
+        )
+    return client
+
+
+def get_reranker():
+    """The configured passage reranker (None for RERANKER=none), built on first use."""
+    global reranker
+    if reranker is None and config.RERANKER != "none":
+        from retrieval import create_reranker
+        reranker = create_reranker(config.RERANKER, config.RERANK_MODEL)
+    return reranker
+
+
+def get_router():
+    """The model router with its per-minute token budget, built on first use."""
+    global router
+    if router is None:
+        router = create_router(config)
+    return router
+
+
+def registry_file_mtime() -> Optional[int]:
+    try:
+        return os.stat(config.BOOK_REGISTRY_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_book_registry() -> BookRegistry:
+    """Read books.json and remember when it was written."""
+    global registry_mtime
+    registry_mtime = registry_file_mtime()
+    registry = BookRegistry.load(config.BOOK_REGISTRY_PATH)
+    # Without books.json, serve the single book from vector_store_id.txt / LOCAL_INDEX_DIR
+    registry.ensure_default(VECTOR_STORE_ID, config.LOCAL_INDEX_DIR, config.ENTITY_INDEX_PATH)
+    return registry
+
+
+def refresh_book_registry() -> None:
+    """Reload books.json if it changed since it was loaded (a book ingested by another worker)."""
+    global book_registry
+    if book_registry is not None and registry_file_mtime() != registry_mtime:
+        # Swapped in one assignment: requests in flight keep the entries they already resolved
+        book_registry = load_book_registry()
+
+
+def load_retrieval_backend() -> None:
+    """Load the book registry and, for the local backend, the default book's index; once per process."""
+    global VECTOR_STORE_ID, book_registry
+
+    if VECTOR_STORE_ID is None:
+        try:
+            with open("vector_store_id.txt", "r") as f:
+                VECTOR_STORE_ID = f.read().strip()
+            print(f"✅ Loaded vector store ID: {VECTOR_STORE_ID}")
+        except FileNotFoundError:
+            print("⚠️  No vector store ID found. Please run rag_setup.py first.")
+
+    if book_registry is None:
+        book_registry = load_book_registry()
+        print(f"✅ Loaded book registry with {len(book_registry)} books")
+
+    if config.RETRIEVAL_BACKEND == "local":
+        index_dir = book_registry.resolve()[0].get("local_index_dir")
+        try:
+            if index_dir and index_cache.peek(index_dir) is None:
+                index = index_cache.get(index_dir)
+                print(f"✅ Loaded local index with {len(index)} passages from {index_dir}")
+        except FileNotFoundError:
+            print("⚠️  No local index found. Please run rag_setup.py --local first.")
+
+
+def preload() -> None:
+    """
+    Load the index in the parent process before workers fork (gunicorn --preload),
+    so every worker shares its memory pages. gc.freeze() moves the loaded objects
+    out of the collector's reach, so collections in the workers do not touch (and
+    copy) those pages.
+    """
+    load_retrieval_backend()
+    gc.freeze()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global answer_cache, coalescer, session_store, ingest_queue
+
+    # Validate configuration; a missing API key only fails model calls, not startup
+    config.validate(require_api_key=False)
+    if not config.OPENAI_API_KEY:
+        print("⚠️  OPENAI_API_KEY is not set; model calls will fail until it is.")
+
+    load_retrieval_backend()
+
+    # Answer cache in front of the model call (None when CACHE_BACKEND=none)
+    if answer_cache is None:
+        answer_cache = create_answer_cache(config)
+    # Identical questions in flight at once share one model call (None when COALESCE_BACKEND=none)
+    if coalescer is None:
+        coalescer = create_coalescer(config)
+    # Conversations that continue across questions (requests with a session_id)
+    if session_store is None:
+        session_store = create_session_store(config)
+    # Books uploaded to POST /ingest are extracted and indexed in worker processes
+    if ingest_queue is None:
+        ingest_queue = create_ingest_queue(config)
+
+    yield
+    ingest_queue.shutdown()
+    if router is not None:
+        router.close()
+    # Release pooled upstream connections on shutdown
+    if client is not None:
+        await client.close()
+
+
+app = FastAPI(title="Book Companion API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,66 +199,921 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Validate configuration
-config.validate()
-
-# Initialize OpenAI client
-client = OpenAI(api_key=config.OPENAI_API_KEY)
+# Time every request; optionally log slow ones with a sampled profile
+app.add_middleware(
+    MetricsMiddleware,
+    slow_seconds=config.SLOW_REQUEST_SECONDS,
+    profile_rate=config.SLOW_REQUEST_PROFILE_RATE,
+    log_dir=config.SLOW_REQUEST_LOG_DIR,
+)
 
-# Load vector store ID
-VECTOR_STORE_ID = None
-try:
-    with open("vector_store_id.txt", "r") as f:
-        VECTOR_STORE_ID = f.read().strip()
-    print(f"✅ Loaded vector store ID: {VECTOR_STORE_ID}")
-except FileNotFoundError:
-    print("⚠️  No vector store ID found. Please run rag_setup.py first.")
-    VECTOR_STORE_ID = None
+if config.PRELOAD_INDEX:
+    preload()
 
 # Pydantic models
 class BookQuery(BaseModel):
     query: str
+    # Search one book, or every book in a series; neither means the default book
+    book_id: Optional[str] = None
+    series_id: Optional[str] = None
+    # Conversations (see sessions.py): start_session to get a session_id for follow-ups,
+    # then send that session_id with each follow-up so it sees the earlier turns
+    start_session: bool = False
+    session_id: Optional[str] = None
+
+class Source(BaseModel):
+    file: str
+    # Chapter title, when the index recorded one
+    title: Optional[str] = None
+    score: Optional[float] = None
+    book_id: Optional[str] = None
 
 class QuestionResponse(BaseModel):
     answer: str
+    sources: List[Source] = []
+    session_id: Optional[str] = None
 
+class BatchQuery(BaseModel):
+    queries: List[BookQuery]
+    # "online" answers now with bounded concurrency; "batch_api" submits an OpenAI Batch job
+    mode: Literal["online", "batch_api"] = "online"
 
-@app.post("/ask")
-async def ask_question(request: BookQuery):
+class BatchItemResult(BaseModel):
+    index: int
+    query: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+
+class BatchResponse(BaseModel):
+    status: str = "completed"
+    batch_id: Optional[str] = None
+    unique_queries: int
+    results: List[BatchItemResult] = []
+
+
+# Batch API jobs submitted by this process: batch id -> queries and dedupe mapping
+batch_jobs = {}
+
+
+async def embed_query(query: str) -> list:
+    """Embed a question with the configured embedding model."""
+    embedding = await get_client().embeddings.create(model=config.EMBEDDING_MODEL, input=[query])
+    return embedding.data[0].embedding
+
+
+def resolve_books(book_id: Optional[str] = None, series_id: Optional[str] = None) -> List[dict]:
+    """Registry entries a question should search; unknown IDs are a 404."""
+    if book_registry is None:
+        raise HTTPException(status_code=503, detail="Book registry not loaded")
+    refresh_book_registry()
+    try:
+        return book_registry.resolve(book_id, series_id)
+    except UnknownBookError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def open_session(request: BookQuery, books: List[dict]):
     """
-    Endpoint that sends a question about the book to OpenAI for analysis.
-    Uses RAG (Retrieval-Augmented Generation) with vector store for accurate responses.
+    The session a question continues or starts, or None. IDs are only ever
+    issued here, so an unknown (or expired) one is refused with a 404.
     """
-    try:
-        if not VECTOR_STORE_ID:
+    if request.session_id is not None:
+        session = session_store.get(request.session_id, session_scope(books))
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired session: {request.session_id}")
+        return session
+    if request.start_session:
+        return session_store.create(session_scope(books))
+    return None
+
+
+def session_scope(books: List[dict]) -> str:
+    """The books a conversation is about; asking about other books starts the session over."""
+    return ",".join(sorted(book["book_id"] for book in books))
+
+
+def cache_scope(books: List[dict], model: str) -> str:
+    """Everything besides the question that determines the answer: retrieval sources and model."""
+    key = "local_index_dir" if config.RETRIEVAL_BACKEND == "local" else "vector_store_id"
+    source = ",".join(sorted(str(book.get(key)) for book in books))
+    return f"{config.RETRIEVAL_BACKEND}:{source}|{model}"
+
+
+async def lookup_cached_answer(query: str, books: List[dict], model: str):
+    """
+    Check the exact tier, then the semantic tier if enabled.
+    Returns (cached value or None, question embedding computed for the semantic tier or None).
+    """
+    if answer_cache is None:
+        return None, None
+
+    # The SQLite backend can wait on other workers' writes; keep that off the event loop
+    scope = cache_scope(books, model)
+    cached = await asyncio.to_thread(answer_cache.lookup, query, scope)
+    if cached is not None:
+        return cached, None
+
+    embedding = None
+    if answer_cache.semantic_enabled:
+        embedding = await embed_query(query)
+        cached = await asyncio.to_thread(answer_cache.lookup_semantic, embedding, scope)
+        if cached is not None:
+            return cached, embedding
+
+    answer_cache.record_miss()
+    return None, embedding
+
+
+async def store_cached_answer(query: str, books: List[dict], model: str, answer: str, sources: list, usage,
+                              latency: float, embedding=None) -> None:
+    if answer_cache is None or not answer:
+        return
+    await asyncio.to_thread(answer_cache.store, query, cache_scope(books, model), {
+        "answer": answer,
+        "sources": [s.model_dump() for s in sources],
+        "usage": usage,
+        "latency": latency,
+    }, embedding)
+
+
+async def load_book_index(book: dict):
+    """A book's local index from the LRU cache, loading it off the event loop on a miss."""
+    index_dir = book.get("local_index_dir")
+    if not index_dir:
+        raise HTTPException(status_code=500, detail=f"No local index registered for book {book['book_id']}")
+    index = index_cache.peek(index_dir)
+    if index is None:
+        try:
+            index = await asyncio.to_thread(index_cache.get, index_dir)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=500,
+                detail="Local index not loaded. Please run rag_setup.py --local first."
+            )
+    return index
+
+
+def get_entity_index(book: dict) -> Optional[EntityIndex]:
+    """A book's entity index, or None if it has not been built (run entity_index.py)."""
+    path = book.get("entity_index")
+    if not path:
+        return None
+    if path not in entity_indexes:
+        try:
+            entity_indexes[path] = EntityIndex.load(path)
+        except FileNotFoundError:
+            entity_indexes[path] = None
+    return entity_indexes[path]
+
+
+def entity_answer(query: str, books: List[dict]) -> Optional[dict]:
+    """
+    Answer a first-appearance or mention-count question about one book from its
+    entity index, without retrieval or the model; None for any other question.
+    """
+    if not config.ENTITY_ANSWERS or len(books) != 1:
+        return None
+    index = get_entity_index(books[0])
+    result = index.answer(query) if index is not None else None
+    if result is None:
+        return None
+
+    answer, chapters = result
+    ENTITY_LOOKUPS.inc(kind="answer")
+    sources = [Source(file=c["source"], title=c["title"] or None, book_id=books[0]["book_id"]) for c in chapters]
+    return {"answer": answer, "sources": [s.model_dump() for s in sources], "usage": None, "cached": False}
+
+
+def entity_facts(query: str, books: List[dict]) -> str:
+    """Index facts (mentions, chapters, first appearance) for the entities a question names, one per line."""
+    lines = []
+    for book in books:
+        index = get_entity_index(book)
+        if index is None:
+            continue
+        for key in index.find_in_query(query, limit=ENTITY_CONTEXT_LIMIT - len(lines)):
+            label = f"[{book.get('title') or book['book_id']}] " if len(books) > 1 else ""
+            lines.append(label + index.describe(key))
+    if lines:
+        ENTITY_LOOKUPS.inc(kind="context")
+    return "\n".join(lines)
+
+
+async def search_vector_stores(query: str, books: List[dict]) -> List[List[dict]]:
+    """Search each book's vector store concurrently; one ranked candidate list per book."""
+    async def search(book: dict) -> List[dict]:
+        page = await get_client().vector_stores.search(
+            vector_store_id=book["vector_store_id"], query=query, max_num_results=config.RETRIEVAL_CANDIDATES,
+        )
+        return [
+            {"source": hit.filename, "text": " ".join(c.text for c in hit.content), "score": hit.score,
+             "book_id": book["book_id"]}
+            for hit in page.data
+        ]
+
+    return list(await asyncio.gather(*(search(book) for book in books)))
+
+
+async def retrieve_passages(query: str, books: List[dict], route, query_embedding: Optional[list] = None,
+                            extra_rankings: Optional[List[List[dict]]] = None) -> List[dict]:
+    """
+    Gather lexical and vector candidates for every book, then fuse, rerank and
+    pack the route's top_k passages into its context budget (see retrieval.py).
+    extra_rankings (a session's earlier excerpts) are fused with the searches.
+
+    Local backend: BM25 plus, when the index has embeddings, cosine similarity.
+    OpenAI backend: vector store search plus BM25 from the book's local index,
+    when one has been built.
+    """
+    from retrieval import select_passages
+
+    def tagged(passages: List[dict], book: dict) -> List[dict]:
+        return [dict(p, book_id=book["book_id"]) for p in passages]
+
+    candidates = config.RETRIEVAL_CANDIDATES
+    rankings = []
+    if config.RETRIEVAL_BACKEND == "local":
+        indexes = [await load_book_index(book) for book in books]
+        if any(index.embeddings is not None for index in indexes) and query_embedding is None:
+            query_embedding = await embed_query(query)
+        for book, index in zip(books, indexes):
+            rankings.append(tagged(index.lexical_search(query, candidates), book))
+            if index.embeddings is not None:
+                rankings.append(tagged(index.vector_search(query_embedding, candidates,
+                                                           rescore=config.LOCAL_RESCORE_CANDIDATES), book))
+    else:
+        rankings.extend(await search_vector_stores(query, books))
+        for book in books:
+            index_dir = book.get("local_index_dir")
+            if index_dir and os.path.isdir(index_dir):
+                index = await load_book_index(book)
+                rankings.append(tagged(index.lexical_search(query, candidates), book))
+    rankings.extend(extra_rankings or [])
+
+    reranker = get_reranker()
+    select = functools.partial(select_passages, query, rankings, reranker, candidates=candidates,
+                               token_budget=route.context_tokens, max_passages=route.top_k)
+    # A cross-encoder is CPU-bound model inference; keep it off the event loop
+    if reranker is not None and reranker.runs_model:
+        return await asyncio.to_thread(select)
+    return select()
+
+
+async def prepare_model_request(query: str, books: List[dict], route, query_embedding: Optional[list] = None,
+                                session=None):
+    """
+    Build the Responses API arguments for a question over one or more books on a route
+    (see routing.py), continuing the session's conversation if one is given.
+    Returns (request kwargs, sources known before the model call).
+    """
+    from local_index import build_prompt
+
+    request_kwargs = {"model": route.model}
+    if route.max_output_tokens:
+        request_kwargs["max_output_tokens"] = route.max_output_tokens
+    facts = entity_facts(query, books)
+
+    if config.RETRIEVAL_BACKEND == "openai":
+        if not all(book.get("vector_store_id") for book in books):
             raise HTTPException(
                 status_code=500, 
                 detail="RAG system not initialized. Please run rag_setup.py first."
             )
 
-        # Use RAG with vector store
-        response = client.responses.create(
-            model="gpt-4o",
-            input=request.query,
-            tools=[{
+        if config.OPENAI_FILE_SEARCH and len(books) == 1:
+            # Let the model search the vector store itself; sources come back with the response
+            request_kwargs["tools"] = [{
                 "type": "file_search",
-                "vector_store_ids": [VECTOR_STORE_ID],
-                "max_num_results": 5
+                "vector_store_ids": [books[0]["vector_store_id"]],
+                "max_num_results": route.top_k
             }]
-        )
+            prompt = f"Facts from the book's index:\n{facts}\n\nQuestion: {query}" if facts else query
+            if session is not None:
+                return session.prepare(query, [], request_kwargs, lambda q, p: prompt), []
+            return dict(request_kwargs, input=prompt), []
 
+    # Retrieve passages here and send only those to the model
+    if session is not None:
+        passages = await retrieve_passages(session.retrieval_query(query), books, route, query_embedding,
+                                           session.carried_rankings())
+    else:
+        passages = await retrieve_passages(query, books, route, query_embedding)
+    sources = [Source(file=p["source"], title=p.get("title") or None, score=p["score"], book_id=p.get("book_id"))
+               for p in passages]
+    if session is not None:
+        return session.prepare(query, passages, request_kwargs, lambda q, p: build_prompt(q, p, facts)), sources
+    return dict(request_kwargs, input=build_prompt(query, passages, facts)), sources
+
+
+def file_search_sources(response) -> list:
+    """Collect file_search results attached to a completed response."""
+    sources = []
+    for item in response.output or []:
+        if item.type == "file_search_call":
+            for result in item.results or []:
+                sources.append(Source(file=result.filename or result.file_id, score=result.score))
+    return sources
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def route_question(query: str, books: List[dict]):
+    """Route a question and reserve its tokens; a spent per-minute budget is a 429."""
+    try:
+        return get_router().decide(query, books)
+    except BudgetExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+async def generate_answer(query: str, books: List[dict], query_embedding: Optional[list] = None,
+                          stream: bool = False, session=None):
+    """
+    Route, retrieve and call the model for one question, then cache the answer
+    (or, for a turn of a session, record it in the session instead).
+    Yields ("delta", {"text"}) events when streaming, then ("done", result) with
+    result = {"answer", "sources", "usage", "cached"}; raises on failure.
+    """
+    decision = route_question(query, books)
+    recorded, start, request_kwargs = False, None, {}
+    try:
+        with span("queue"):
+            await request_semaphore.acquire()
+        try:
+            with span("retrieval"):
+                request_kwargs, sources = await prepare_model_request(query, books, decision.route, query_embedding,
+                                                                      session)
+            start = time.perf_counter()
+            if stream:
+                if "tools" in request_kwargs:
+                    request_kwargs["include"] = ["file_search_call.results"]
+                response = None
+                events = await get_client().responses.create(**request_kwargs, stream=True)
+                async for event in events:
+                    if event.type == "response.output_text.delta":
+                        yield "delta", {"text": event.delta}
+                    elif event.type == "response.completed":
+                        response = event.response
+                    elif event.type in ("response.failed", "error"):
+                        raise HTTPException(status_code=500, detail="Model call failed")
+                if response is None:
+                    raise HTTPException(status_code=500, detail="Model stream ended without a response")
+            else:
+                response = await get_client().responses.create(**request_kwargs)
+            latency = time.perf_counter() - start
+        finally:
+            request_semaphore.release()
+            if start is not None:
+                record_stage("model", time.perf_counter() - start)
+
+        usage = response.usage.model_dump() if response.usage else None
+        get_router().record(decision, query, len(sources), usage)
+        recorded = True
         answer = response.output_text
         if not answer:
             raise HTTPException(status_code=500, detail="No answer received from OpenAI")
 
-        return QuestionResponse(answer=answer)
+        record_usage(usage)
+        sources = sources or file_search_sources(response)
+        if session is not None:
+            # Answers that depend on earlier turns are not cached
+            session.record(query, answer, response.id)
+        else:
+            await store_cached_answer(query, books, decision.route.model, answer, sources, usage, latency,
+                                      query_embedding)
+        yield "done", {"answer": answer, "sources": [s.model_dump() for s in sources], "usage": usage,
+                       "cached": False}
+    except Exception:
+        # The previous response may be gone (expired or never stored); start the chain over next turn
+        if session is not None and "previous_response_id" in request_kwargs:
+            session.reset_chain()
+        raise
+    finally:
+        if not recorded:
+            get_router().release(decision)
+
 
+def answer_events(query: str, books: List[dict], model: str, query_embedding: Optional[list] = None,
+                  stream: bool = False):
+    """
+    The events of generate_answer, shared with every identical question in
+    flight (same normalized question, books and model; see coalesce.py).
+    """
+    produce = functools.partial(generate_answer, query, books, query_embedding, stream)
+    if coalescer is None:
+        return produce()
+    return coalescer.run(cache_key(query, cache_scope(books, model)), produce)
+
+
+def flight_error(data: dict) -> Exception:
+    """The exception behind an error event, rebuilt when it came from another worker."""
+    if data.get("exception") is not None:
+        return data["exception"]
+    if data.get("http"):
+        return HTTPException(status_code=data["status"], detail=data["detail"], headers=data.get("headers"))
+    return RuntimeError(data["detail"])
+
+
+async def answer_question(query: str, books: List[dict], session=None) -> dict:
+    """
+    Answer one question about the given books through the entity index, the
+    answer cache and the model. Returns {"answer", "sources", "usage", "cached"};
+    raises on failure. A question in a session goes straight to the model as the
+    next turn of the conversation; its answer depends on the turns before it.
+    """
+    if session is not None:
+        # One turn at a time per session, so each continues the previous answer
+        async with session.lock:
+            async for kind, data in generate_answer(query, books, session=session):
+                if kind == "done":
+                    return data
+        raise HTTPException(status_code=500, detail="No answer received from OpenAI")
+
+    with span("entities"):
+        direct = entity_answer(query, books)
+    if direct is not None:
+        return direct
+
+    model = get_router().route_for(query, books).model
+    with span("cache"):
+        cached, query_embedding = await lookup_cached_answer(query, books, model)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    async for kind, data in answer_events(query, books, model, query_embedding):
+        if kind == "done":
+            return data
+        if kind == "error":
+            raise flight_error(data)
+    raise HTTPException(status_code=500, detail="No answer received from OpenAI")
+
+
+def error_detail(error: Exception) -> str:
+    return error.detail if isinstance(error, HTTPException) else str(error)
+
+
+@app.post("/ask")
+async def ask_question(request: BookQuery):
+    """
+    Endpoint that sends a question about the book to OpenAI for analysis.
+    Uses RAG (Retrieval-Augmented Generation) with vector store for accurate responses.
+    """
+    try:
+        books = resolve_books(request.book_id, request.series_id)
+        session = open_session(request, books)
+        result = await answer_question(request.query, books, session)
+        with span("serialize"):
+            return JSONResponse(QuestionResponse(answer=result["answer"], sources=result["sources"],
+                                                 session_id=session and session.session_id).model_dump())
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+
+
+def dedupe_queries(queries: List[BookQuery]):
+    """
+    Collapse queries that normalize to the same text and target the same books.
+    Returns (unique BookQuery items, index into them for every input position).
+    """
+    unique, positions, slots = [], {}, []
+    for item in queries:
+        key = (item.book_id, item.series_id, normalize_query(item.query))
+        if key not in positions:
+            positions[key] = len(unique)
+            unique.append(item)
+        slots.append(positions[key])
+    return unique, slots
+
+
+def batch_results(queries: List[str], slots: List[int], answers: dict, errors: dict, cached: dict = None) -> list:
+    """Fan answers for unique queries back out to every input position, in input order."""
+    cached = cached or {}
+    return [
+        BatchItemResult(index=i, query=query, answer=answers.get(slot), error=errors.get(slot),
+                        cached=cached.get(slot, False))
+        for i, (query, slot) in enumerate(zip(queries, slots))
+    ]
+
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchQuery):
+    """
+    Answer a list of questions in one request. Identical questions (after
+    normalization) are answered once. Results come back in input order, each with
+    either an answer or an error. With mode="batch_api" the questions are submitted
+    as an OpenAI Batch job instead; poll GET /ask/batch/{batch_id} for the results.
+    """
+    if len(request.queries) > config.BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries: {len(request.queries)} (limit {config.BATCH_MAX_QUERIES})"
+        )
+
+    queries = [item.query for item in request.queries]
+    unique, slots = dedupe_queries(request.queries)
+
+    if request.mode == "batch_api":
+        try:
+            return await submit_batch_job(queries, unique, slots)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error submitting batch: {str(e)}")
+
+    # Batched questions are independent: session_id is ignored here
+    # Each batch gets its own window so one large batch cannot take every model slot
+    batch_semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+    answers, errors, cached = {}, {}, {}
+
+    async def run(slot: int, item: BookQuery):
+        async with batch_semaphore:
+            try:
+                result = await answer_question(item.query, resolve_books(item.book_id, item.series_id))
+                answers[slot] = result["answer"]
+                cached[slot] = result["cached"]
+            except Exception as e:
+                errors[slot] = f"Error processing question: {error_detail(e)}"
+
+    await asyncio.gather(*(run(slot, item) for slot, item in enumerate(unique)))
+    with span("serialize"):
+        response = BatchResponse(unique_queries=len(unique),
+                                 results=batch_results(queries, slots, answers, errors, cached))
+        return JSONResponse(response.model_dump())
+
+
+async def submit_batch_job(queries: List[str], unique: List[BookQuery], slots: List[int]) -> BatchResponse:
+    """Upload one Responses API request per unique query as JSONL and create a Batch job."""
+    # Batch jobs run outside the per-minute budget, so they take their route without reserving tokens
+    lines, errors, models = [], {}, {}
+    for slot, item in enumerate(unique):
+        try:
+            books = resolve_books(item.book_id, item.series_id)
+            route = get_router().route_for(item.query, books)
+            request_kwargs, _ = await prepare_model_request(item.query, books, route)
+            models[slot] = route.model
+        except Exception as e:
+            errors[slot] = f"Error processing question: {error_detail(e)}"
+            continue
+        lines.append(json.dumps({"custom_id": f"q{slot}", "method": "POST", "url": "/v1/responses",
+                                 "body": request_kwargs}))
+
+    if not lines:
+        return BatchResponse(unique_queries=len(unique), results=batch_results(queries, slots, {}, errors))
+
+    input_file = await get_client().files.create(
+        file=("ask_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+    )
+    batch = await get_client().batches.create(
+        input_file_id=input_file.id, endpoint="/v1/responses", completion_window="24h",
+    )
+    batch_jobs[batch.id] = {"queries": queries, "unique": unique, "slots": slots, "errors": errors, "models": models}
+    return BatchResponse(status=batch.status, batch_id=batch.id, unique_queries=len(unique))
+
+
+@app.get("/ask/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """Status of a Batch API job; once it has finished, the per-query results."""
+    from openai.types.responses import Response
+
+    job = batch_jobs.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch: {batch_id}")
+
+    try:
+        batch = await get_client().batches.retrieve(batch_id)
+        response = BatchResponse(status=batch.status, batch_id=batch_id, unique_queries=len(job["unique"]))
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return response
+
+        answers, errors = {}, dict(job["errors"])
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await get_client().files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                slot = int(record["custom_id"][1:])
+                result = record.get("response") or {}
+                if result.get("status_code") == 200:
+                    answers[slot] = Response.model_validate(result["body"]).output_text
+                    item = job["unique"][slot]
+                    await store_cached_answer(item.query, resolve_books(item.book_id, item.series_id),
+                                              job["models"][slot], answers[slot], [], result["body"].get("usage"), 0.0)
+                else:
+                    error = record.get("error") or (result.get("body") or {}).get("error") or {}
+                    errors[slot] = f"Error processing question: {error.get('message', 'request failed')}"
+
+        # Anything the batch never got to (expired, cancelled) is reported as such
+        for slot in range(len(job["unique"])):
+            if slot not in answers and slot not in errors:
+                errors[slot] = f"Batch {batch.status} before this question was answered"
+
+        response.results = batch_results(job["queries"], job["slots"], answers, errors)
+        return response
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving batch: {str(e)}")
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: BookQuery):
+    """
+    Streaming variant of /ask. Sends the answer as server-sent events:
+    `delta` events with partial text, then one `done` event with sources and usage
+    (or an `error` event if the model call fails).
+    """
+    try:
+        books = resolve_books(request.book_id, request.series_id)
+        session = open_session(request, books)
+        if session is not None:
+            return await stream_session_turn(request.query, books, session)
+        with span("entities"):
+            cached = entity_answer(request.query, books)
+        if cached is None:
+            model = get_router().route_for(request.query, books).model
+            with span("cache"):
+                cached, query_embedding = await lookup_cached_answer(request.query, books, model)
+        if cached is not None:
+            async def cached_stream():
+                yield sse_event("delta", {"text": cached["answer"]})
+                yield sse_event("done", {"sources": cached["sources"], "usage": cached["usage"],
+                                         "cached": cached.get("cached", True)})
+            return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+        # Wait for the first event so routing and retrieval errors are still HTTP errors
+        events = answer_events(request.query, books, model, query_embedding, stream=True)
+        first = await anext(events)
+        if first[0] == "error":
+            raise flight_error(first[1])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
 
+    return StreamingResponse(
+        stream_events(first, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_session_turn(query: str, books: List[dict], session) -> StreamingResponse:
+    """
+    Stream the next turn of a session; its ID is in the X-Session-ID header.
+    The session stays locked until the stream ends, so a follow-up sent
+    meanwhile waits for this answer.
+    """
+    await session.lock.acquire()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            session.lock.release()
+
+    try:
+        events = generate_answer(query, books, stream=True, session=session)
+        first = await anext(events)
+    except BaseException:
+        release()
+        raise
+
+    async def event_stream():
+        try:
+            async for chunk in stream_events(first, events):
+                yield chunk
+        finally:
+            # A client that left mid-answer: end the model call before the next turn may start
+            await events.aclose()
+            release()
+
+    # The background task covers a client that disconnects before the stream starts
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Session-ID": session.session_id},
+        background=BackgroundTask(release),
+    )
+
+
+async def stream_events(first: tuple, events):
+    """Server-sent events for an answer's events, starting with the one already received."""
+    streamed = False
+    try:
+        kind, data = first
+        while True:
+            if kind == "delta":
+                streamed = True
+                yield sse_event("delta", data)
+            elif kind == "done":
+                # Joined a non-streaming request for the same question: send its answer whole
+                if not streamed:
+                    yield sse_event("delta", {"text": data["answer"]})
+                yield sse_event("done", {"sources": data["sources"], "usage": data["usage"]})
+                return
+            elif kind == "error":
+                yield sse_event("error", {"detail": f"Error processing question: {error_detail(flight_error(data))}"})
+                return
+            kind, data = await anext(events)
+    except StopAsyncIteration:
+        yield sse_event("error", {"detail": "Model stream ended without a response"})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Error processing question: {str(e)}"})
+
+
+async def publish_ingested_book(job: dict) -> None:
+    """
+    Register a finished ingestion job's indexes and switch this worker to them.
+    The new local index is loaded before the switch, so no question waits for
+    it; other workers see the new books.json on their next question.
+    """
+    global book_registry, registry_mtime
+    result = job["result"]
+    if config.RETRIEVAL_BACKEND == "local":
+        await asyncio.to_thread(index_cache.get, result["local_index_dir"])
+    if result.get("entity_index"):
+        entity_indexes[result["entity_index"]] = await asyncio.to_thread(EntityIndex.load, result["entity_index"])
+
+    def register() -> tuple:
+        # Reloaded under the lock: another job may have registered a book since this worker last read the file
+        with registry_lock(config.BOOK_REGISTRY_PATH):
+            registry = BookRegistry.load(config.BOOK_REGISTRY_PATH)
+            registry.ensure_default(VECTOR_STORE_ID, config.LOCAL_INDEX_DIR, config.ENTITY_INDEX_PATH)
+            previous = registry.books.get(job["book_id"], {})
+            registry.register(job["book_id"], title=job["title"], series_id=job["series_id"], **result)
+            registry.save(config.BOOK_REGISTRY_PATH)
+            return registry, previous, registry_file_mtime()
+
+    async with registry_update_lock:
+        registry, previous, registry_mtime = await asyncio.to_thread(register)
+        book_registry = registry
+    # The replaced entity index is not looked up again (its index cache entry ages out by LRU)
+    if previous.get("entity_index") not in (None, result.get("entity_index")):
+        entity_indexes.pop(previous["entity_index"], None)
+
+
+@app.post("/ingest", status_code=202)
+async def ingest_book(request: Request, filename: str, book_id: Optional[str] = None, title: Optional[str] = None,
+                      series_id: Optional[str] = None, embeddings: bool = False):
+    """
+    Upload an EPUB or PDF as the raw request body and queue it for extraction
+    and indexing. When the job is done the book is registered (book_id defaults
+    to one made from the file name) and served without a restart; an existing
+    book with the same ID switches to the new index. Poll GET /ingest/jobs/{job_id}.
+    """
+    try:
+        job = ingest_queue.create(filename, book_id, title, series_id, embeddings)
+        await ingest_queue.receive(job, request.stream())
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ingest_queue.submit(job, publish_ingested_book)
+    return job
+
+
+@app.get("/ingest/jobs")
+async def list_ingest_jobs(book_id: Optional[str] = None, limit: int = 50):
+    """Ingestion jobs from every worker, newest first, with the queue's counters"""
+    # Both read every job's status file, so keep them off the event loop
+    def read_jobs():
+        return dict(ingest_queue.stats(), results=ingest_queue.jobs(book_id, max(1, min(limit, 500))))
+
+    return await asyncio.to_thread(read_jobs)
+
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """An ingestion job's stage, stage timings, records extracted, throughput and result or error"""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown ingestion job: {job_id}")
+    return job
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Answer cache hit/miss counters and the latency and tokens they saved"""
+    if answer_cache is None:
+        return {"backend": "none"}
+    return await asyncio.to_thread(answer_cache.stats)
+
+
+@app.get("/coalesce/stats")
+async def coalesce_stats():
+    """Questions in flight, upstream calls made and requests that shared another request's call"""
+    if coalescer is None:
+        return {"backend": "none"}
+    return coalescer.stats()
+
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Live sessions in this worker and how many were created, evicted and expired"""
+    return session_store.stats()
+
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """Forget a conversation; the next question with its ID starts a new one"""
+    if not session_store.drop(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown session: {session_id}")
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.get("/entities")
+async def list_entities(name: Optional[str] = None, book_id: Optional[str] = None, series_id: Optional[str] = None,
+                        limit: int = 20):
+    """
+    Named entities from the entity index: with a name, its mention count, first
+    appearance and chapters in each book; without one, the most-mentioned entities.
+    """
+    books = resolve_books(book_id, series_id)
+    indexed = [(book, get_entity_index(book)) for book in books]
+    indexed = [(book, index) for book, index in indexed if index is not None]
+    if not indexed:
+        raise HTTPException(status_code=404, detail="No entity index built. Please run entity_index.py first.")
+
+    if name is None:
+        return {"results": [{"book_id": book["book_id"], "entities": index.top(max(1, min(limit, 500)))}
+                            for book, index in indexed]}
+
+    results = []
+    for book, index in indexed:
+        entity = index.get(name)
+        if entity is not None:
+            results.append(dict(entity, book_id=book["book_id"]))
+    if not results:
+        raise HTTPException(status_code=404, detail=f"Unknown entity: {name}")
+    return {"results": results}
+
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Routes, decisions per route, budget usage and the estimated cost saved by routing"""
+    return get_router().stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Request latency and stage histograms plus token counters, in Prometheus text format"""
+    return HTTPResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving requests"""
     return {"status": "healthy"}
 
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: the default book's retrieval backend (vector store ID or local index) is loaded"""
+    book = None
+    if book_registry is not None:
+        try:
+            book = book_registry.resolve()[0]
+        except UnknownBookError:
+            pass
+
+    if book is None:
+        ready, detail = False, "Book registry not loaded"
+    elif config.RETRIEVAL_BACKEND == "local":
+        index = index_cache.peek(book.get("local_index_dir") or "")
+        ready = index is not None
+        detail = f"{len(index)} passages" if ready else "Local index not loaded"
+    else:
+        ready = bool(book.get("vector_store_id"))
+        detail = book.get("vector_store_id") if ready else "Vector store ID not loaded"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "backend": config.RETRIEVAL_BACKEND, "detail": detail},
+    )
+
+
+@app.get("/books")
+async def list_books():
+    """Registered books, their series, and which local indexes are currently loaded"""
+    if book_registry is None:
+        raise HTTPException(status_code=503, detail="Book registry not loaded")
+    return {
+        "default_book": book_registry.default_book,
+        "books": [
+            {k: entry.get(k) for k in ("book_id", "title", "series_id")}
+            for _, entry in sorted(book_registry.books.items())
+        ],
+        "index_cache": index_cache.stats(),
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Request Metrics for Book Companion
+Per-request timing spans (queue, cache, retrieval, model, serialize), token-usage
+counters and request latency histograms, rendered in the Prometheus text format
+for GET /metrics. Includes an ASGI middleware that times every request and,
+when enabled, logs slow requests with a sampled cProfile dump.
+"""
+
+import asyncio
+import cProfile
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """The set of metrics exposed on /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "book_companion_request_seconds", "End-to-end HTTP request latency, including streamed bodies",
+    ["method", "path", "status"],
+)
+STAGE_SECONDS = registry.histogram(
+    "book_companion_stage_seconds", "Time spent in each stage of a request",
+    ["path", "stage"],
+)
+TOKENS = registry.counter(
+    "book_companion_tokens_total", "Model tokens reported in response usage",
+    ["kind"],
+)
+
+ROUTE_DECISIONS = registry.counter(
+    "book_companion_route_decisions_total", "Questions per route and model (routed, downgraded or rejected)",
+    ["route", "model", "outcome"],
+)
+ROUTE_SAVED_USD = registry.counter(
+    "book_companion_route_saved_usd_total", "Estimated model cost saved by routing, against the baseline route",
+    ["route"],
+)
+
+ENTITY_LOOKUPS = registry.counter(
+    "book_companion_entity_lookups_total", "Questions answered from the entity index or given its facts as context",
+    ["kind"],
+)
+
+COALESCED_REQUESTS = registry.counter(
+    "book_companion_coalesced_requests_total",
+    "Requests that shared an identical in-flight request's upstream call instead of making their own",
+    ["scope"],
+)
+
+SESSION_PASSAGES_REUSED = registry.counter(
+    "book_companion_session_passages_reused_total",
+    "Retrieved excerpts not re-sent because the session's previous response already holds them",
+)
+
+INGEST_JOBS = registry.counter(
+    "book_companion_ingest_jobs_total", "Ingestion jobs finished by this worker, by outcome (ready or failed)",
+    ["outcome"],
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestTrace:
+    """Spans recorded while handling one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.spans.append((stage, seconds))
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add an already-measured stage to the current request (a no-op outside a request)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as one stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(usage: Optional[dict]) -> None:
+    """Add a Responses API usage object (as a dict) to the token counters."""
+    if not usage:
+        return
+    TOKENS.inc(usage.get("input_tokens") or 0, kind="input")
+    TOKENS.inc(usage.get("output_tokens") or 0, kind="output")
+    cached = (usage.get("input_tokens_details") or {}).get("cached_tokens") or 0
+    TOKENS.inc(cached, kind="cached_input")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times each request end to end (until the last body chunk
+    is sent, so streamed answers are included) and records its spans.
+
+    With slow_seconds set, requests slower than that are appended to
+    <log_dir>/slow_requests.jsonl. A profile_rate fraction of requests also run
+    under cProfile, and the profile is dumped next to the log if the request was slow.
+    """
+
+    def __init__(self, app, slow_seconds: Optional[float] = None, profile_rate: float = 0.0,
+                 log_dir: str = "slow_requests"):
+        self.app = app
+        self.slow_seconds = slow_seconds
+        self.profile_rate = profile_rate if slow_seconds is not None else 0.0
+        self.log_dir = Path(log_dir)
+        self._profiling = threading.Lock()
+        self._in_flight = 0
+        # Requests that ran alongside the one being profiled, or None when no profile is running
+        self._profile_overlap: Optional[int] = None
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        # Only one cProfile can be active per interpreter; skip the sample if one is running
+        if not self.profile_rate or random.random() >= self.profile_rate:
+            return None
+        if not self._profiling.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _log_slow(self, scope, path: str, status: int, elapsed: float, trace: RequestTrace,
+                  profiler: Optional[cProfile.Profile], overlapping: int) -> None:
+        """Append the request to the slow-request log (file I/O; run it in a thread)."""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        # Batched requests record a stage once per question; report the total per stage
+        spans = {}
+        for stage, seconds in trace.spans:
+            spans[stage] = spans.get(stage, 0.0) + seconds
+        entry = {
+            "time": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": path,
+            "status": status,
+            "seconds": round(elapsed, 4),
+            "spans": {stage: round(seconds, 4) for stage, seconds in spans.items()},
+        }
+        if profiler is not None:
+            name = path.strip("/").replace("/", "_") or "root"
+            profile_path = self.log_dir / f"slow_{int(entry['time'] * 1000)}_{name}.prof"
+            profiler.dump_stats(str(profile_path))
+            entry["profile"] = str(profile_path)
+            entry["profile_overlapping_requests"] = overlapping
+        with open(self.log_dir / "slow_requests.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"🐢 Slow request: {scope['method']} {scope['path']} took {elapsed:.2f}s")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        self._in_flight += 1
+        if self._profile_overlap is not None:
+            self._profile_overlap += 1
+        profiler = self._start_profiler()
+        if profiler is not None:
+            self._profile_overlap = self._in_flight - 1
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - trace.start
+            _current_trace.reset(token)
+            self._in_flight -= 1
+            overlapping = 0
+            if profiler is not None:
+                profiler.disable()
+                overlapping, self._profile_overlap = self._profile_overlap, None
+                self._profiling.release()
+
+            # Label by route template (/ask/batch/{batch_id}) to keep label cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], path=path, status=status)
+            for stage, seconds in trace.spans:
+                STAGE_SECONDS.observe(seconds, path=path, stage=stage)
+
+            if self.slow_seconds is not None and elapsed >= self.slow_seconds:
+                await asyncio.to_thread(self._log_slow, scope, path, status, elapsed, trace, profiler, overlapping)
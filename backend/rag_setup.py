@@ -7,80 +7,242 @@ from the extracted book content.
 
 import os
 import json
+import hashlib
+import argparse
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
 from config import config
+from book_registry import BookRegistry, registry_lock
+from local_index import build_local_index, openai_embed_fn
+from vector_index import create_embedding_cache
+from uploader import AdaptiveUploader, print_report
 
-def setup_rag_system():
-    """Set up the RAG system with vector store and file uploads"""
+MANIFEST_PATH = "rag_manifest.json"
+VECTOR_STORE_ID_PATH = "vector_store_id.txt"
 
-    # Initialize OpenAI client
-    client = OpenAI(api_key=config.OPENAI_API_KEY) # TODO (cursor):
 
-    print("🚀 Setting up RAG system for Book Companion...")
+def file_sha256(file_path: Path) -> str:
+    """Content hash used to detect changed files"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Load the upload manifest: {"vector_store_id": ..., "files": {path: {sha256, file_id, vector_store_id}}}"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"vector_store_id": None, "files": {}}
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH) -> None:
+    # Write to a temp file first so an interrupted run never leaves a truncated manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def collect_corpus_files(corpus_dirs: list = None) -> list:
+    """All text files from both extraction directories (or the given ones, e.g. chunking.py --dir output)"""
+    all_files = []
+    for directory in corpus_dirs or ["pdf_extracted_pages/", "epub_extracted_chapters/"]:
+        dir_path = Path(directory)
+        if dir_path.exists():
+            all_files.extend(dir_path.glob("*.txt"))
+    return sorted(all_files)
+
+
+def diff_against_manifest(all_files: list, manifest: dict) -> dict:
+    """Classify files as new, changed, unchanged or deleted relative to the manifest"""
+    known = manifest["files"]
+    diff = {"new": [], "changed": [], "unchanged": [], "deleted": [], "hashes": {}}
+
+    for file_path in all_files:
+        key = file_path.as_posix()
+        digest = file_sha256(file_path)
+        diff["hashes"][key] = digest
+        if key not in known:
+            diff["new"].append(file_path)
+        elif known[key]["sha256"] != digest:
+            diff["changed"].append(file_path)
+        else:
+            diff["unchanged"].append(file_path)
+
+    current = set(diff["hashes"])
+    diff["deleted"] = sorted(key for key in known if key not in current)
+    return diff
+
+
+def print_diff(diff: dict) -> None:
+    print(f"📁 Found {len(diff['hashes'])} text files")
+    print(f"   🆕 New: {len(diff['new'])}")
+    print(f"   ✏️  Changed: {len(diff['changed'])}")
+    print(f"   ✅ Unchanged: {len(diff['unchanged'])}")
+    print(f"   🗑️  Deleted: {len(diff['deleted'])}")
+    for label, items in (("+", diff["new"]), ("~", diff["changed"]), ("-", diff["deleted"])):
+        for item in items:
+            print(f"  {label} {item.as_posix() if isinstance(item, Path) else item}")
+
+
+def manifest_path_for(book_id: str = None) -> str:
+    return f"rag_manifest.{book_id}.json" if book_id else MANIFEST_PATH
+
+
+def get_or_create_vector_store(client, manifest: dict, book_id: str = None, fresh: bool = False):
+    """Reuse the book's store (books.json, or vector_store_id.txt without a book ID) if it still exists, otherwise create one"""
+    if fresh:
+        existing_id = None
+    elif book_id:
+        registry = BookRegistry.load(config.BOOK_REGISTRY_PATH)
+        existing_id = registry.books.get(book_id, {}).get("vector_store_id")
+    else:
+        try:
+            with open(VECTOR_STORE_ID_PATH, "r") as f:
+                existing_id = f.read().strip()
+        except FileNotFoundError:
+            existing_id = None
+
+    if existing_id:
+        try:
+            vs = client.vector_stores.retrieve(existing_id)
+            print(f"♻️  Reusing vector store: {vs.id}")
+            if manifest.get("vector_store_id") != vs.id:
+                # Manifest describes a different store; everything must be re-uploaded
+                manifest["files"] = {}
+            manifest["vector_store_id"] = vs.id
+            return vs
+        except Exception as e:
+            print(f"⚠️  Could not reuse vector store {existing_id}: {e}")
 
-    # 1) Create a vector store
     print("📚 Creating vector store...")
+    vs = client.vector_stores.create(name=f"BookCompanion-{book_id}" if book_id else "BookCompanion-StormlightArchive")
+    print(f"✅ Vector store created with ID: {vs.id}")
+    manifest["vector_store_id"] = vs.id
+    manifest["files"] = {}
+    return vs
+
+
+def detach_file(uploader, vs_id: str, file_id: str) -> None:
+    """Remove a file from the vector store and delete the uploaded file object"""
+    client = uploader.client
+    try:
+        uploader.call_with_retries(client.vector_stores.files.delete, file_id=file_id, vector_store_id=vs_id)
+    except Exception as e:
+        print(f"⚠️  Could not detach {file_id}: {e}")
+    try:
+        uploader.call_with_retries(client.files.delete, file_id)
+    except Exception as e:
+        print(f"⚠️  Could not delete {file_id}: {e}")
+
+
+def setup_rag_system(dry_run: bool = False, corpus_dirs: list = None, book_id: str = None, fresh: bool = False,
+                     smoke_test: bool = True):
+    """Set up the RAG system with vector store and file uploads.
+
+    Only new or changed files (by content hash in rag_manifest.json) are uploaded;
+    files that disappeared from the corpus are detached from the store. With
+    dry_run, print what would change without calling the API. With a book_id the
+    book gets its own vector store and manifest (rag_manifest.<book_id>.json).
+    With fresh, everything goes into a new store and the current one is left
+    untouched, so it keeps serving until the registry points at the new one.
+    With smoke_test (the default) a sample query is run against the store afterwards.
+    """
+
+    print("🚀 Setting up RAG system for Book Companion...")
+
+    manifest_path = manifest_path_for(book_id)
+    manifest = load_manifest(manifest_path)
+    all_files = collect_corpus_files(corpus_dirs)
+
+    if dry_run:
+        print("🔍 Dry run: comparing corpus against manifest...")
+        print_diff(diff_against_manifest(all_files, manifest))
+        return manifest.get("vector_store_id")
+
+    # Initialize OpenAI client
+    client = OpenAI(api_key=config.OPENAI_API_KEY) # TODO (cursor):
+
+    # 1) Reuse or create a vector store
     try:
-        vs = client.vector_stores.create(name="BookCompanion-StormlightArchive")
-        print(f"✅ Vector store created with ID: {vs.id}")
+        vs = get_or_create_vector_store(client, manifest, book_id, fresh)
     except Exception as e:
         print(f"❌ Error creating vector store: {e}")
         return None
 
-    # 2) Upload & attach files (concurrent)
-    def upload_one_file(file_path: Path, vs_id: str):
-        """Upload a single file and attach it to the vector store"""
-        try:
-            # Create file in OpenAI
-            with open(file_path, "rb") as f:
-                file_obj = client.files.create(file=f, purpose="assistants")
+    diff = diff_against_manifest(all_files, manifest)
+    print_diff(diff)
 
-            # Attach to vector store
-            client.vector_stores.files.create(vector_store_id=vs_id, file_id=file_obj.id)
-            return {"filename": file_path.name, "status": "success", "file_id": file_obj.id}
-        except Exception as e:
-            return {"filename": file_path.name, "status": "error", "error": str(e)}
+    uploader = AdaptiveUploader(
+        client,
+        max_concurrency=config.UPLOAD_MAX_CONCURRENCY,
+        max_retries=config.UPLOAD_MAX_RETRIES,
+    )
 
-    # Get all text files from both directories
-    pdf_dir = Path("pdf_extracted_pages/")
-    epub_dir = Path("epub_extracted_chapters/")
+    # 2) Detach deleted and changed files
+    for key in diff["deleted"]:
+        detach_file(uploader, vs.id, manifest["files"].pop(key)["file_id"])
+        print(f"🗑️  Detached: {key}")
+    for file_path in diff["changed"]:
+        detach_file(uploader, vs.id, manifest["files"][file_path.as_posix()]["file_id"])
+    save_manifest(manifest, manifest_path)
 
-    all_files = []
-    if pdf_dir.exists():
-        all_files.extend(pdf_dir.glob("*.txt"))
-    if epub_dir.exists():
-        all_files.extend(epub_dir.glob("*.txt"))
+    # 3) Upload new and changed files with adaptive concurrency, then attach them in batches
+    to_upload = [p for p in diff["new"] + diff["changed"] if p.exists()]
+    print(f"📤 Uploading {len(to_upload)} new or changed files")
+
+    def print_upload(result):
+        if result["status"] == "success":
+            print(f"✅ Uploaded: {result['filename']}")
+        else:
+            print(f"❌ Failed: {result['filename']} - {result['error']}")
 
-    print(f"📁 Found {len(all_files)} text files to upload")
+    results = uploader.upload_files(to_upload, on_result=print_upload)
+    successful_uploads = [r for r in results if r["status"] == "success"]
+    failed_uploads = [r for r in results if r["status"] != "success"]
 
-    # Upload files concurrently
-    successful_uploads = []
-    failed_uploads = []
+    attach_failures = uploader.attach_files(vs.id, [r["file_id"] for r in successful_uploads])
+    for result in successful_uploads:
+        if result["file_id"] in attach_failures:
+            failed_uploads.append(dict(result, status="error", error=attach_failures[result["file_id"]]))
+    successful_uploads = [r for r in successful_uploads if r["file_id"] not in attach_failures]
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(upload_one_file, p, vs.id) for p in all_files if p.exists()]
+    for result in successful_uploads:
+        key = result["path"].as_posix()
+        manifest["files"][key] = {
+            "sha256": diff["hashes"][key],
+            "file_id": result["file_id"],
+            "vector_store_id": vs.id,
+        }
+    for result in failed_uploads:
+        # A changed file whose re-upload failed is no longer attached
+        manifest["files"].pop(result["path"].as_posix(), None)
 
-        for future in as_completed(futures):
-            result = future.result()
-            if result["status"] == "success":
-                successful_uploads.append(result)
-                print(f"✅ Uploaded: {result['filename']}")
-            else:
-                failed_uploads.append(result)
-                print(f"❌ Failed: {result['filename']} - {result['error']}")
+    save_manifest(manifest, manifest_path)
+    print_report(uploader.report())
 
     print(f"\n📊 Upload Summary:")
     print(f"   ✅ Successful: {len(successful_uploads)}")
     print(f"   ❌ Failed: {len(failed_uploads)}")
+    print(f"   ⏭️  Skipped (unchanged): {len(diff['unchanged'])}")
 
     if failed_uploads:
         print("\nFailed uploads:")
         for fail in failed_uploads:
             print(f"  - {fail['filename']}: {fail['error']}")
 
-    # 3) Test the RAG system
+    # 4) Test the RAG system
+    if smoke_test and not run_smoke_test(client, vs.id):
+        return None
+    return vs.id
+
+
+def run_smoke_test(client, vector_store_id: str) -> bool:
+    """Run a sample search and file_search query against the store; False if either fails."""
     print("\n🧪 Testing RAG system...")
     try:
         # Test search
@@ -88,7 +250,7 @@ def setup_rag_system():
         print(f"🔍 Testing search for: '{search_query}'")
 
         search_results = client.vector_stores.search(
-            vector_store_id=vs.id,
+            vector_store_id=vector_store_id,
             query=search_query
         )
 
@@ -103,7 +265,7 @@ def setup_rag_system():
             input="Who is Cenn and what role does he play in the Stormlight Archive?",
             tools=[{
                 "type": "file_search",
-                "vector_store_ids": [vs.id],
+                "vector_store_ids": [vector_store_id],
                 "max_num_results": 5
             }]
         )
@@ -118,11 +280,11 @@ def setup_rag_system():
         print(f"Available attributes: {dir(rag_response)}")
 
         print("\n🎉 RAG system is working!")
-        return vs.id
+        return True
 
     except Exception as e:
         print(f"❌ Error testing RAG system: {e}")
-        return None
+        return False
 
 def query_rag(question: str, vector_store_id: str):
     """Query the RAG system with a question"""
@@ -136,27 +298,109 @@ def query_rag(question: str, vector_store_id: str):
                 "type": "file_search",
                 "vector_store_ids": [vector_store_id],
                 "max_num_results": 5
-            }]
+            }],
+            include=["file_search_call.results"]
         )
 
+        sources = [
+            {"file": result.filename or result.file_id, "score": result.score}
+            for item in response.output or [] if item.type == "file_search_call"
+            for result in item.results or []
+        ]
         return {
             "answer": response.output_text,
-            "sources": []
+            "sources": sources
         }
 
     except Exception as e:
         return {"error": str(e)}
 
+def setup_local_index(index_dir: str, with_embeddings: bool = False, store_dir: str = None,
+                      chunks_path: str = None):
+    """Build the local retrieval index instead of uploading files"""
+    print("🚀 Building local retrieval index for Book Companion...")
+
+    embed_fn = None
+    if with_embeddings:
+        client = OpenAI(api_key=config.OPENAI_API_KEY)
+        embed_fn = openai_embed_fn(client, config.EMBEDDING_MODEL)
+
+    index = build_local_index(index_dir, embed_fn=embed_fn, store_dir=store_dir, chunks_path=chunks_path,
+                              codec=config.LOCAL_EMBEDDING_CODEC, subspaces=config.LOCAL_PQ_SUBSPACES,
+                              embedding_cache=create_embedding_cache(config) if with_embeddings else None,
+                              embedding_model=config.EMBEDDING_MODEL)
+
+    # Test the local index
+    search_query = "Cenn character"
+    print(f"\n🔍 Testing search for: '{search_query}'")
+    for i, hit in enumerate(index.search(search_query, k=3)):
+        print(f"  {i+1}. {hit['source']} (score: {hit['score']:.3f})")
+
+    return index
+
+
+def register_book(book_id: str, title: str = None, series_id: str = None,
+                  vector_store_id: str = None, local_index_dir: str = None) -> None:
+    """Record a book's indexes in books.json so main.py can route questions to it"""
+    with registry_lock(config.BOOK_REGISTRY_PATH):
+        registry = BookRegistry.load(config.BOOK_REGISTRY_PATH)
+        registry.register(book_id, title=title, series_id=series_id,
+                          vector_store_id=vector_store_id, local_index_dir=local_index_dir)
+        registry.save(config.BOOK_REGISTRY_PATH)
+    print(f"📚 Registered book '{book_id}' in {config.BOOK_REGISTRY_PATH}")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Set up retrieval for Book Companion')
+    parser.add_argument('--local', action='store_true',
+                       help='Build a local retrieval index instead of uploading to an OpenAI vector store')
+    parser.add_argument('--embeddings', action='store_true',
+                       help='Also compute passage embeddings for the local index (requires numpy), '
+                            f'stored as {config.LOCAL_EMBEDDING_CODEC} (LOCAL_EMBEDDING_CODEC)')
+    parser.add_argument('--index-dir', default=None,
+                       help=f'Output directory for the local index (default: {config.LOCAL_INDEX_DIR}, '
+                            f'or {config.LOCAL_INDEX_DIR}/<book-id> with --book-id)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Show which files would be uploaded, re-uploaded or detached, without calling the API')
+    parser.add_argument('--store', default=None,
+                       help='Build the local index from a chunk store instead of the extracted .txt files')
+    parser.add_argument('--chunks', default=None,
+                       help='Build the local index from chunking.py JSONL output instead of re-chunking')
+    parser.add_argument('--corpus-dir', action='append', default=None,
+                       help='Upload .txt files from this directory (repeatable), e.g. chunking.py --dir output')
+    parser.add_argument('--book-id', default=None,
+                       help=f'Index this corpus as its own book and register it in {config.BOOK_REGISTRY_PATH}')
+    parser.add_argument('--title', default=None, help='Book title for the registry (with --book-id)')
+    parser.add_argument('--series', default=None, help='Series ID for the registry (with --book-id)')
+
+    args = parser.parse_args()
+
+    if args.local:
+        index_dir = args.index_dir or (
+            os.path.join(config.LOCAL_INDEX_DIR, args.book_id) if args.book_id else config.LOCAL_INDEX_DIR
+        )
+        setup_local_index(index_dir, with_embeddings=args.embeddings, store_dir=args.store,
+                          chunks_path=args.chunks)
+        if args.book_id:
+            register_book(args.book_id, args.title, args.series, local_index_dir=index_dir)
+        print("💡 Set RETRIEVAL_BACKEND=local to serve questions from this index.")
+        raise SystemExit(0)
+
+    if args.dry_run:
+        setup_rag_system(dry_run=True, corpus_dirs=args.corpus_dir, book_id=args.book_id)
+        raise SystemExit(0)
+
     # Set up the RAG system
-    vector_store_id = setup_rag_system()
+    vector_store_id = setup_rag_system(corpus_dirs=args.corpus_dir, book_id=args.book_id)
 
-    if vector_store_id:
+    if vector_store_id and args.book_id:
+        register_book(args.book_id, args.title, args.series, vector_store_id=vector_store_id)
+    elif vector_store_id:
         print(f"\n💾 Vector Store ID: {vector_store_id}")
         print("💡 You can now use this ID in your main.py to query the RAG system!")
 
         # Save the vector store ID for later use
-        with open("vector_store_id.txt", "w") as f:
+        with open(VECTOR_STORE_ID_PATH, "w") as f:
             f.write(vector_store_id)
         print("💾 Vector store ID saved to vector_store_id.txt")
     else:
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Retrieval Pipeline for Book Companion
+Turns candidate passages from several retrievers into the few passages sent to
+the model:
+
+    1. fuse    lexical (BM25) and vector candidate lists with reciprocal rank fusion
+    2. rerank  the fused candidates with a cheap lexical scorer or a local cross-encoder
+    3. pack    the best passages into a token budget
+
+Each retriever's scores live on its own scale (BM25, cosine, vector store
+relevance), so fusion works on ranks only. The scores of the final passages
+come from the reranker (or from fusion with RERANKER=none) and are what /ask
+reports as source citations.
+"""
+
+from typing import Dict, List, Optional
+
+from chunking import count_tokens
+from local_index import tokenize
+
+# Damping constant from the original RRF paper; higher values flatten rank differences
+RRF_K = 60
+
+RERANKERS = ("none", "lexical", "cross-encoder")
+
+
+def passage_key(passage: dict) -> tuple:
+    """Identity of a passage across retrievers (local hits share an id; vector store hits only text)."""
+    if "id" in passage:
+        return passage.get("book_id"), passage["id"]
+    return passage.get("book_id"), passage["source"], passage["text"]
+
+
+def reciprocal_rank_fusion(rankings: List[List[dict]], k: int = RRF_K) -> List[dict]:
+    """Merge ranked candidate lists; a passage scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: Dict[tuple, dict] = {}
+    for ranking in rankings:
+        for rank, passage in enumerate(ranking, 1):
+            entry = fused.setdefault(passage_key(passage), dict(passage, score=0.0))
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda p: p["score"], reverse=True)
+
+
+class LexicalReranker:
+    """
+    Scores query-term coverage: the share of distinct query terms a passage
+    contains, plus a bonus for query bigrams it contains verbatim (names and
+    phrases), with the fused rank as a tie-breaker. Costs microseconds per
+    passage and needs no model.
+    """
+
+    runs_model = False
+
+    def __init__(self, bigram_weight: float = 0.5, prior_weight: float = 0.3):
+        self.bigram_weight = bigram_weight
+        self.prior_weight = prior_weight
+
+    def rerank(self, query: str, passages: List[dict]) -> List[dict]:
+        terms = tokenize(query)
+        unique_terms = set(terms)
+        bigrams = set(zip(terms, terms[1:]))
+        if not unique_terms or not passages:
+            return passages
+
+        top_prior = passages[0]["score"] or 1.0
+        rescored = []
+        for passage in passages:
+            tokens = tokenize(passage["text"])
+            token_set = set(tokens)
+            coverage = len(unique_terms & token_set) / len(unique_terms)
+            phrase = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            score = ((coverage + self.bigram_weight * phrase) / (1 + self.bigram_weight)
+                     + self.prior_weight * passage["score"] / top_prior)
+            rescored.append(dict(passage, score=score))
+        return sorted(rescored, key=lambda p: p["score"], reverse=True)
+
+
+class CrossEncoderReranker:
+    """Scores (query, passage) pairs with a local sentence-transformers cross-encoder."""
+
+    runs_model = True
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise RuntimeError(
+                "sentence-transformers is required for RERANKER=cross-encoder (pip install sentence-transformers)"
+            ) from None
+        self.model = CrossEncoder(model_name)
+
+    def rerank(self, query: str, passages: List[dict]) -> List[dict]:
+        if not passages:
+            return passages
+        scores = self.model.predict([(query, p["text"]) for p in passages])
+        rescored = [dict(p, score=float(s)) for p, s in zip(passages, scores)]
+        return sorted(rescored, key=lambda p: p["score"], reverse=True)
+
+
+def create_reranker(name: str, model_name: Optional[str] = None):
+    """The reranker for a RERANKER setting, or None for "none"."""
+    if name == "lexical":
+        return LexicalReranker()
+    if name == "cross-encoder":
+        return CrossEncoderReranker(model_name)
+    return None
+
+
+def passage_tokens(passage: dict) -> int:
+    """Token count of a passage; chunking.py output carries it, other passages are counted here."""
+    return passage.get("tokens") or count_tokens(passage["text"])
+
+
+def pack_passages(passages: List[dict], token_budget: int, max_passages: int) -> List[dict]:
+    """
+    Keep passages in rank order while they fit the token budget, skipping any
+    that would overflow it. The best passage is always kept, even if it alone is
+    over budget, so the model never gets an empty context. A budget of 0 only
+    applies max_passages.
+    """
+    if not token_budget:
+        return passages[:max_passages]
+
+    packed, used = [], 0
+    for passage in passages:
+        if len(packed) >= max_passages:
+            break
+        tokens = passage_tokens(passage)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(passage)
+        used += tokens
+    return packed
+
+
+def select_passages(query: str, rankings: List[List[dict]], reranker=None, candidates: int = 20,
+                    token_budget: int = 0, max_passages: int = 5) -> List[dict]:
+    """Fuse candidate rankings, rerank the top candidates and pack them into the budget."""
+    fused = reciprocal_rank_fusion(rankings)[:candidates]
+    if reranker is not None:
+        fused = reranker.rerank(query, fused)
+    return pack_passages(fused, token_budget, max_passages)
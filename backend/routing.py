@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Model Routing for Book Companion
+Classifies each question with cheap text heuristics and picks a route: the
+model, how many passages to retrieve, the context and output-token caps. Simple
+lookups ("Who is Cenn?") go to the small model with fewer passages; analytical
+questions ("Why does Kaladin distrust lighteyes?") and questions spanning
+several books get the large model and the full context.
+
+Every route fits a per-request token budget, and a per-minute token budget
+(per process) downgrades analytical questions to the lookup route when it is
+nearly spent and rejects questions once nothing fits. Each decision is counted
+in /metrics, summed in /routing/stats and, when a log path is set (it is off by
+default: entries include the question), appended to a JSONL file together with
+its usage and its estimated saving against sending every question to the large
+model with the full context. The log rotates by size and is written by a
+background thread, so requests only queue their entry.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from metrics import ROUTE_DECISIONS, ROUTE_SAVED_USD
+
+# USD per million (input, output) tokens; models not listed are not costed
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Instructions, excerpt labels and the question around the passages in build_prompt
+PROMPT_OVERHEAD_TOKENS = 100
+
+ANALYTICAL_RE = re.compile(
+    r"\b(why|how (?:does|did|do|is|was|has|have|would|could)|explain|analy[sz]e|analysis|compare|comparison|"
+    r"contrast|differ(?:ence|ent)?|theme|themes|significan(?:ce|t)|symbol\w*|motivat\w*|relationship\w*|"
+    r"evolv\w*|develop\w*|impact|influence\w*|interpret\w*|meaning|role of|foreshadow\w*|implication\w*)\b"
+)
+# Questions longer than this many words are treated as analytical
+LOOKUP_MAX_WORDS = 20
+
+
+class Route:
+    """How one class of question is answered"""
+
+    def __init__(self, name: str, model: str, top_k: int, max_output_tokens: Optional[int],
+                 context_tokens: int):
+        self.name = name
+        self.model = model
+        self.top_k = top_k
+        self.max_output_tokens = max_output_tokens
+        self.context_tokens = context_tokens
+
+    def estimated_tokens(self, query_tokens: int) -> int:
+        """Upper bound on the tokens one request on this route can use."""
+        return PROMPT_OVERHEAD_TOKENS + query_tokens + self.context_tokens + (self.max_output_tokens or 0)
+
+    def to_dict(self) -> dict:
+        return {"route": self.name, "model": self.model, "top_k": self.top_k,
+                "max_output_tokens": self.max_output_tokens, "context_budget": self.context_tokens}
+
+
+def classify(query: str, num_books: int = 1) -> tuple:
+    """("lookup" or "analysis", reason) for a question."""
+    text = query.lower()
+    if num_books > 1:
+        return "analysis", "multiple books"
+    match = ANALYTICAL_RE.search(text)
+    if match:
+        return "analysis", f"cue '{match.group(1)}'"
+    if len(text.split()) > LOOKUP_MAX_WORDS:
+        return "analysis", "long question"
+    if text.count("?") > 1:
+        return "analysis", "several questions"
+    return "lookup", "short factual question"
+
+
+def cost_usd(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+class TokenRateLimiter:
+    """
+    Tokens used in a sliding 60-second window. A request reserves its estimated
+    tokens up front and settles to its real usage afterwards. The window is per
+    process, so with N workers the effective limit is N times the setting.
+    """
+
+    def __init__(self, tokens_per_minute: int, window_seconds: float = 60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+        self._entries = deque()  # [timestamp, tokens]
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        while self._entries and self._entries[0][0] <= now - self.window_seconds:
+            self._used -= self._entries.popleft()[1]
+
+    def used(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._used
+
+    def reserve(self, tokens: int) -> Optional[list]:
+        """A reservation handle, or None if the tokens do not fit in the current window."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if self._used + tokens > self.tokens_per_minute:
+                return None
+            entry = [now, tokens]
+            self._entries.append(entry)
+            self._used += tokens
+            return entry
+
+    def settle(self, reservation: list, actual_tokens: int) -> None:
+        """Replace a reservation's estimate with the tokens the request really used."""
+        with self._lock:
+            if reservation in self._entries:
+                self._used += actual_tokens - reservation[1]
+            reservation[1] = actual_tokens
+
+    def retry_after(self) -> float:
+        """Seconds until the oldest reservation leaves the window."""
+        with self._lock:
+            if not self._entries:
+                return 0.0
+            return max(0.0, self._entries[0][0] + self.window_seconds - time.monotonic())
+
+
+class BudgetExceededError(Exception):
+    """No route fits the per-minute token budget right now"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Token budget exhausted; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class Decision:
+    """A routed question: its route, why, and its token reservation"""
+
+    def __init__(self, route: Route, reason: str, downgraded: bool = False, reservation: Optional[list] = None):
+        self.route = route
+        self.reason = reason
+        self.downgraded = downgraded
+        self.reservation = reservation
+        self.start = time.perf_counter()
+
+
+class Router:
+    """Routes questions and keeps the per-minute budget, counters and decision log"""
+
+    def __init__(self, routes: dict, baseline: Route, tokens_per_minute: int = 0,
+                 log_path: Optional[str] = None, count_tokens=None, log_max_bytes: int = 50 << 20,
+                 log_backups: int = 3):
+        self.routes = routes
+        self.baseline = baseline
+        self.limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        self.log_path = log_path
+        self._log, self._log_listener = None, None
+        if log_path:
+            self._open_log(log_path, log_max_bytes, log_backups)
+        self.count_tokens = count_tokens or (lambda text: len(text.split()))
+        self._lock = threading.Lock()
+        self.decisions = {name: 0 for name in routes}
+        self.downgrades = 0
+        self.rejections = 0
+        self.saved_usd = 0.0
+        self.cost_usd = 0.0
+
+    def _open_log(self, log_path: str, max_bytes: int, backups: int) -> None:
+        # Requests put entries on a queue; the listener thread does the file I/O and rotation
+        handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue = queue.SimpleQueue()
+        self._log = logging.getLogger(f"{__name__}.decisions.{id(self)}")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        self._log.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._log_listener = logging.handlers.QueueListener(log_queue, handler)
+        self._log_listener.start()
+
+    def close(self) -> None:
+        """Flush and close the decision log."""
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            for handler in self._log_listener.handlers:
+                handler.close()
+            self._log_listener = None
+
+    def route_for(self, query: str, books: List[dict]) -> Route:
+        """The route a question would take, ignoring the per-minute budget (for cache scoping)."""
+        name, _ = classify(query, len(books))
+        return self.routes.get(name) or self.routes["analysis"]
+
+    def decide(self, query: str, books: List[dict]) -> Decision:
+        """Pick a route and reserve its tokens; raises BudgetExceededError if nothing fits."""
+        name, reason = classify(query, len(books))
+        route = self.routes.get(name) or self.routes["analysis"]
+        decision = Decision(route, reason)
+        if self.limiter is None:
+            return self._count(decision)
+
+        query_tokens = self.count_tokens(query)
+        candidates = [route] + ([self.routes["lookup"]] if route.name != "lookup" and "lookup" in self.routes else [])
+        for candidate in candidates:
+            reservation = self.limiter.reserve(candidate.estimated_tokens(query_tokens))
+            if reservation is not None:
+                decision.route = candidate
+                decision.reservation = reservation
+                decision.downgraded = candidate is not route
+                if decision.downgraded:
+                    decision.reason += "; downgraded by the per-minute budget"
+                return self._count(decision)
+
+        with self._lock:
+            self.rejections += 1
+        ROUTE_DECISIONS.inc(route=route.name, model=route.model, outcome="rejected")
+        raise BudgetExceededError(self.limiter.retry_after())
+
+    def _count(self, decision: Decision) -> Decision:
+        with self._lock:
+            self.decisions[decision.route.name] = self.decisions.get(decision.route.name, 0) + 1
+            self.downgrades += decision.downgraded
+        outcome = "downgraded" if decision.downgraded else "routed"
+        ROUTE_DECISIONS.inc(route=decision.route.name, model=decision.route.model, outcome=outcome)
+        return decision
+
+    def release(self, decision: Decision) -> None:
+        """Return an unused reservation (the request failed before the model call)."""
+        if self.limiter is not None and decision.reservation is not None:
+            self.limiter.settle(decision.reservation, 0)
+
+    def record(self, decision: Decision, query: str, passages: int, usage: Optional[dict]) -> None:
+        """Settle the reservation, tally cost and savings, and append the decision to the log."""
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens") or 0
+        output_tokens = usage.get("output_tokens") or 0
+        if self.limiter is not None and decision.reservation is not None:
+            self.limiter.settle(decision.reservation, input_tokens + output_tokens)
+
+        # Baseline: the same question on the large model with the baseline's passage count and
+        # context budget, scaled from this request's passages (output assumed unchanged)
+        route = decision.route
+        context_tokens = max(0, input_tokens - PROMPT_OVERHEAD_TOKENS - self.count_tokens(query))
+        baseline_context = context_tokens
+        if passages:
+            baseline_context = max(context_tokens, min(self.baseline.context_tokens or float("inf"),
+                                                       context_tokens / passages * self.baseline.top_k))
+        baseline_input = input_tokens - context_tokens + baseline_context
+        cost = cost_usd(route.model, input_tokens, output_tokens)
+        baseline_cost = cost_usd(self.baseline.model, baseline_input, output_tokens)
+        saved = baseline_cost - cost if cost is not None and baseline_cost is not None else None
+
+        with self._lock:
+            if cost is not None:
+                self.cost_usd += cost
+            if saved is not None:
+                self.saved_usd += saved
+        if saved is not None:
+            ROUTE_SAVED_USD.inc(saved, route=route.name)
+
+        if self._log is not None:
+            entry = dict(
+                route.to_dict(),
+                time=time.time(),
+                query=query,
+                reason=decision.reason,
+                downgraded=decision.downgraded,
+                passages=passages,
+                context_tokens=context_tokens,
+                baseline_input_tokens=round(baseline_input),
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                seconds=round(time.perf_counter() - decision.start, 4),
+                cost_usd=cost,
+                baseline_cost_usd=baseline_cost,
+                saved_usd=saved,
+            )
+            self._log.info(json.dumps(entry))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "routes": {name: route.to_dict() for name, route in self.routes.items()},
+                "decisions": dict(self.decisions),
+                "downgrades": self.downgrades,
+                "rejections": self.rejections,
+                "cost_usd": round(self.cost_usd, 6),
+                "saved_usd": round(self.saved_usd, 6),
+            }
+        if self.limiter is not None:
+            stats["tokens_per_minute"] = self.limiter.tokens_per_minute
+            stats["tokens_used_last_minute"] = self.limiter.used()
+        return stats
+
+
+def create_router(config) -> Router:
+    """
+    Routes from config. The baseline, and the only route with ROUTING off, is
+    ANALYSIS_MODEL with RETRIEVAL_TOP_K passages and no output cap.
+    """
+    from chunking import count_tokens
+
+    def context_tokens(max_output_tokens: Optional[int]) -> int:
+        # The per-request budget covers prompt, passages and answer
+        available = config.REQUEST_TOKEN_BUDGET - PROMPT_OVERHEAD_TOKENS - (max_output_tokens or 0)
+        if config.CONTEXT_TOKEN_BUDGET:
+            available = min(available, config.CONTEXT_TOKEN_BUDGET)
+        return max(0, available)
+
+    baseline = Route("analysis", config.ANALYSIS_MODEL, config.RETRIEVAL_TOP_K, None, context_tokens(None))
+    if not config.ROUTING:
+        routes = {"analysis": baseline}
+    else:
+        lookup_cap = config.LOOKUP_MAX_OUTPUT_TOKENS or None
+        analysis_cap = config.ANALYSIS_MAX_OUTPUT_TOKENS or None
+        routes = {
+            "lookup": Route("lookup", config.LOOKUP_MODEL, config.LOOKUP_TOP_K, lookup_cap,
+                            context_tokens(lookup_cap)),
+            "analysis": Route("analysis", config.ANALYSIS_MODEL, config.RETRIEVAL_TOP_K, analysis_cap,
+                              context_tokens(analysis_cap)),
+        }
+    return Router(routes, baseline, config.TOKENS_PER_MINUTE, config.ROUTING_LOG_PATH or None, count_tokens,
+                  config.ROUTING_LOG_MAX_MB << 20, config.ROUTING_LOG_BACKUPS)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Conversation Sessions for Book Companion
+Follow-up questions ("what happens to him next?") carry a session ID, and the
+session remembers enough of the conversation to answer them without the
+client resending anything. IDs are issued by the server (a random UUID, sent
+back with the first turn), and a question naming an ID this worker did not
+issue, or that has expired, is refused rather than starting a session under a
+name someone chose or guessed:
+
+    chain  each turn continues the previous model response through the
+           Responses API previous_response_id, so the model already holds
+           the earlier questions, answers and excerpts. Only excerpts it has
+           not seen yet are sent again.
+    local  nothing is kept server-side at OpenAI: the last few questions and
+           answers go into the prompt, and the previous turn's excerpts
+           stay candidates for the next one instead of being searched again.
+
+In both modes retrieval searches with the previous question prepended, so a
+follow-up that only says "him" still finds the right chapters. Sessions live
+in an in-process LRU with an idle TTL, and each one remembers a bounded number
+of turns and excerpts, so memory stays flat however long people chat. Workers
+do not share sessions; route a session to one worker (sticky sessions) when
+running several.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from metrics import SESSION_PASSAGES_REUSED
+from retrieval import passage_key
+
+SESSION_MODES = ("chain", "local")
+
+
+class Session:
+    """The state of one conversation about one set of books"""
+
+    def __init__(self, session_id: str, scope: str, mode: str = "chain", max_turns: int = 4,
+                 max_passages: int = 50):
+        self.session_id = session_id
+        self.scope = scope
+        self.mode = mode
+        self.max_passages = max_passages
+        self.lock = asyncio.Lock()
+        self.last_access = time.time()
+
+        self.previous_response_id: Optional[str] = None
+        self.turns = deque(maxlen=max_turns)  # (question, answer)
+        # Excerpts the model has seen (chain) or the previous turn used (local), by passage_key
+        self.passages: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._pending: List[dict] = []
+
+    def retrieval_query(self, query: str) -> str:
+        """The question to search with: the previous question gives a follow-up its subject."""
+        if not self.turns:
+            return query
+        return f"{self.turns[-1][0]} {query}"
+
+    def carried_rankings(self) -> List[List[dict]]:
+        """Local mode: the previous turn's excerpts as an extra ranking for fusion."""
+        if self.mode != "local" or not self.passages:
+            return []
+        return [list(self.passages.values())]
+
+    def prepare(self, query: str, passages: List[dict], request_kwargs: dict, build_prompt) -> dict:
+        """
+        Fill in the request for a turn: chain mode continues the previous
+        response and leaves out excerpts the model already has; local mode
+        puts recent turns in front of the prompt.
+        """
+        if self.mode == "chain":
+            new = [p for p in passages if passage_key(p) not in self.passages]
+            SESSION_PASSAGES_REUSED.inc(len(passages) - len(new))
+            self._pending = new
+            if self.previous_response_id:
+                request_kwargs["previous_response_id"] = self.previous_response_id
+                # Older turns are dropped rather than failing once the conversation outgrows the context
+                request_kwargs["truncation"] = "auto"
+                if not new and passages:
+                    request_kwargs["input"] = (f"Follow-up question (the excerpts from earlier in this conversation "
+                                               f"still apply): {query}")
+                    return request_kwargs
+            request_kwargs["input"] = build_prompt(query, new)
+            return request_kwargs
+
+        self._pending = passages
+        history = "\n".join(f"Q: {question}\nA: {answer}" for question, answer in self.turns)
+        prompt = build_prompt(query, passages)
+        request_kwargs["input"] = f"Conversation so far:\n{history}\n\n{prompt}" if history else prompt
+        return request_kwargs
+
+    def record(self, query: str, answer: str, response_id: Optional[str]) -> None:
+        """Remember a completed turn and the excerpts it sent."""
+        self.turns.append((query, answer))
+        self.previous_response_id = response_id
+        if self.mode == "local":
+            self.passages.clear()
+        for passage in self._pending:
+            self.passages[passage_key(passage)] = passage
+        while len(self.passages) > self.max_passages:
+            self.passages.popitem(last=False)
+        self._pending = []
+
+    def reset_chain(self) -> None:
+        """Forget the server-side response chain (after a failed call that continued it)."""
+        self.previous_response_id = None
+        self.passages.clear()
+        self._pending = []
+
+
+class SessionStore:
+    """In-process LRU of sessions with an idle TTL"""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 1800, mode: str = "chain", max_turns: int = 4,
+                 max_passages: int = 50):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.mode = mode
+        self.max_turns = max_turns
+        self.max_passages = max_passages
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def create(self, scope: str) -> Session:
+        """Start a session under a new, unguessable ID."""
+        now = time.time()
+        session = Session(uuid.uuid4().hex, scope, self.mode, self.max_turns, self.max_passages)
+        self.created += 1
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+        self._expire(now)
+        return session
+
+    def get(self, session_id: str, scope: str) -> Optional[Session]:
+        """
+        The session issued under an ID, or None if there is none (never issued
+        here, expired or evicted). A question about different books starts the
+        conversation over under the same ID.
+        """
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.scope != scope:
+            fresh = Session(session_id, scope, self.mode, self.max_turns, self.max_passages)
+            # Same lock: a turn still running about the old books finishes before the first new one
+            fresh.lock = session.lock
+            session = self._sessions[session_id] = fresh
+        self._sessions.move_to_end(session_id)
+        session.last_access = now
+        return session
+
+    def _expire(self, now: float) -> None:
+        # Least recently used first, so stop at the first session still within its TTL
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def drop(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "created": self.created,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+def create_session_store(config) -> SessionStore:
+    return SessionStore(config.SESSION_MAX, config.SESSION_TTL_SECONDS, config.SESSION_MODE,
+                        config.SESSION_HISTORY_TURNS, config.SESSION_MAX_PASSAGES)
@@ -0,0 +1,100 @@
+"""
+Shared fixtures. The backend modules import each other by bare name and read
+their configuration from the environment at import time, so the backend
+directory goes on sys.path and the environment is pointed at a scratch
+directory and a fake OpenAI server (fake_openai.py) before any of them is imported.
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="book-companion-tests-")
+FAKE_OPENAI_PORT = free_port()
+
+os.environ.update({
+    "OPENAI_API_KEY": "sk-test",
+    "OPENAI_BASE_URL": f"http://127.0.0.1:{FAKE_OPENAI_PORT}/v1",
+    "OPENAI_MAX_RETRIES": "0",
+    "RETRIEVAL_BACKEND": "local",
+    "LOCAL_INDEX_DIR": os.path.join(SCRATCH_DIR, "local_index"),
+    "BOOK_REGISTRY_PATH": os.path.join(SCRATCH_DIR, "books.json"),
+    "ENTITY_INDEX_PATH": os.path.join(SCRATCH_DIR, "entity_index.json"),
+    "EMBEDDING_CACHE_PATH": os.path.join(SCRATCH_DIR, "embedding_cache.sqlite3"),
+    "INGEST_DIR": os.path.join(SCRATCH_DIR, "ingest_jobs"),
+    "SLOW_REQUEST_LOG_DIR": os.path.join(SCRATCH_DIR, "slow_requests"),
+    "CACHE_BACKEND": "memory",
+    "COALESCE_BACKEND": "memory",
+    "ROUTING_LOG_PATH": "",
+    "PRELOAD_INDEX": "",
+})
+
+# A few chapters of a small made-up book, enough for BM25 to tell the chapters apart
+PASSAGES = [
+    {"id": 0, "source": "chapter_01.txt", "title": "The Shattered Plains", "page": 1,
+     "text": "Kaladin carried the bridge across the Shattered Plains while the Parshendi archers waited."},
+    {"id": 1, "source": "chapter_02.txt", "title": "Stormlight", "page": 2,
+     "text": "Shallan sketched the chasmfiend and studied how Stormlight glowed inside the gemstones."},
+    {"id": 2, "source": "chapter_03.txt", "title": "The Oathpact", "page": 3,
+     "text": "Dalinar read the Way of Kings and wondered whether the Oathpact could be restored."},
+]
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    """The fake OpenAI API (fake_openai.py) on a background thread, with a short latency."""
+    import fake_openai as fake
+
+    server = fake.start_in_thread(fake.app, port=FAKE_OPENAI_PORT)
+    fake.configure(latency=0.05, error_rate=0.0)
+    yield fake
+    server.should_exit = True
+
+
+@pytest.fixture(autouse=True)
+def reset_fake_openai():
+    """Every test starts with fresh fake-server counters and settings."""
+    yield
+    if "fake_openai" in sys.modules:
+        fake = sys.modules["fake_openai"]
+        fake.configure(latency=0.05, error_rate=0.0, error_statuses=[429], tokens_per_second=0, output_tokens=0)
+        fake.state.reset()
+
+
+@pytest.fixture(scope="session")
+def default_index():
+    """The default book's local index, built from PASSAGES."""
+    from local_index import LocalIndex
+
+    return LocalIndex([dict(p) for p in PASSAGES]).save(os.environ["LOCAL_INDEX_DIR"])
+
+
+@pytest.fixture(scope="session")
+def api(fake_openai, default_index):
+    """A TestClient for the API (lifespan included), answering through the fake OpenAI server."""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from answer_cache import AnswerCache, MemoryCacheBackend, SQLiteCacheBackend, cache_key, normalize_query
+
+ANSWER = {"answer": "A bridgeman.", "sources": [], "usage": {"total_tokens": 120}, "latency": 1.5}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryCacheBackend(**kwargs)
+        return SQLiteCacheBackend(str(tmp_path / "answer_cache.sqlite3"), **kwargs)
+    return make
+
+
+def test_normalize_query():
+    assert normalize_query("  Who IS   Cenn?! ") == "who is cenn"
+    assert cache_key("Who is Cenn?", "scope") == cache_key("who is cenn", "scope")
+    assert cache_key("Who is Cenn?", "scope") != cache_key("Who is Cenn?", "other scope")
+
+
+def test_exact_hits_ignore_case_and_punctuation(make_backend):
+    cache = AnswerCache(make_backend())
+    cache.store("Who is Kaladin?", "book|gpt-4o", ANSWER)
+    assert cache.lookup("who is kaladin", "book|gpt-4o") == ANSWER
+    assert cache.lookup("Who is Kaladin?", "book|gpt-4o-mini") is None
+    cache.record_miss()
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["exact_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+    assert (stats["saved_seconds"], stats["saved_tokens"]) == (1.5, 120)
+
+
+def test_entries_expire(make_backend):
+    backend = make_backend(ttl=0.05)
+    backend.set("key", ANSWER, "scope", [1.0, 0.0])
+    assert backend.get("key") == ANSWER
+    time.sleep(0.1)
+    assert backend.get("key") is None
+    assert backend.nearest("scope", [1.0, 0.0]) is None
+
+
+def test_least_recently_used_entries_are_evicted(make_backend):
+    backend = make_backend(max_entries=2)
+    backend.set("a", {"answer": "a"}, "scope")
+    time.sleep(0.01)
+    backend.set("b", {"answer": "b"}, "scope")
+    time.sleep(0.01)
+    backend.get("a")
+    time.sleep(0.01)
+    backend.set("c", {"answer": "c"}, "scope")
+    assert backend.get("b") is None
+    assert backend.get("a") == {"answer": "a"} and backend.get("c") == {"answer": "c"}
+    assert len(backend) == 2
+
+
+def test_semantic_hits_within_the_threshold(make_backend):
+    cache = AnswerCache(make_backend(), semantic_threshold=0.9)
+    cache.store("Who is Kaladin?", "scope", ANSWER, embedding=[1.0, 0.0, 0.0])
+    assert cache.lookup_semantic([0.99, 0.1, 0.0], "scope") == ANSWER
+    assert cache.lookup_semantic([0.0, 1.0, 0.0], "scope") is None
+    assert cache.lookup_semantic([1.0, 0.0, 0.0], "other scope") is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_expired_questions_do_not_shadow_live_ones(make_backend):
+    backend = make_backend(ttl=0.2)
+    cache = AnswerCache(backend, semantic_threshold=0.9)
+    cache.store("Who is Kaladin?", "scope", {"answer": "stale"}, embedding=[1.0, 0.0])
+    time.sleep(0.3)
+    cache.store("Who is Kaladin Stormblessed?", "scope", ANSWER, embedding=[0.95, 0.1])
+    assert cache.lookup_semantic([1.0, 0.0], "scope") == ANSWER
+
+
+def test_semantic_lookups_find_every_stored_question(make_backend):
+    cache = AnswerCache(make_backend(), semantic_threshold=0.99)
+    # More questions than the initial matrix holds, with one replaced along the way
+    for i in range(40):
+        cache.store(f"question {i}", "scope", {"answer": str(i)}, embedding=[float(i == j) for j in range(40)])
+    cache.store("question 7", "scope", {"answer": "seven"}, embedding=[float(j == 7) for j in range(40)])
+    assert cache.lookup_semantic([float(j == 7) for j in range(40)], "scope") == {"answer": "seven"}
+    assert cache.lookup_semantic([float(j == 39) for j in range(40)], "scope") == {"answer": "39"}
+
+
+def test_sqlite_semantic_lookups_see_other_workers_entries(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite3")
+    reader, writer = (AnswerCache(SQLiteCacheBackend(path), semantic_threshold=0.9) for _ in range(2))
+    assert reader.lookup_semantic([1.0, 0.0], "scope") is None
+    writer.store("Who is Kaladin?", "scope", ANSWER, embedding=[1.0, 0.0])
+    assert reader.lookup_semantic([0.99, 0.1], "scope") == ANSWER
+
+
+def test_counters_are_exact_under_threads(make_backend):
+    cache = AnswerCache(make_backend())
+    cache.store("Who is Kaladin?", "scope", ANSWER)
+
+    def work(_):
+        for _ in range(200):
+            cache.lookup("Who is Kaladin?", "scope")
+            cache.record_miss()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["misses"], stats["saved_tokens"]) == (1600, 1600, 1600 * 120)
+
+
+def test_sqlite_entries_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite3")
+    AnswerCache(SQLiteCacheBackend(path)).store("Who is Kaladin?", "scope", ANSWER)
+    assert AnswerCache(SQLiteCacheBackend(path)).lookup("Who is Kaladin?", "scope") == ANSWER
+
+
+def test_repeated_questions_are_answered_from_the_cache(api, fake_openai):
+    first = api.post("/ask", json={"query": "Who read the Way of Kings?"}).json()
+    requests = fake_openai.state.requests
+    # The same question differing only in case and punctuation
+    again = api.post("/ask", json={"query": "who read the WAY of kings"})
+    assert again.json()["answer"] == first["answer"]
+    assert fake_openai.state.requests == requests
+    assert api.get("/cache/stats").json()["exact_hits"] >= 1
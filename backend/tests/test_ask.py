@@ -0,0 +1,25 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_ask_answers_from_the_local_index(api, fake_openai):
+    response = api.post("/ask", json={"query": "Who carried the bridge across the Shattered Plains?"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["answer"].startswith("Fake answer to:")
+    assert result["sources"][0]["file"] == "chapter_01.txt"
+    assert result["session_id"] is None
+    assert fake_openai.state.requests == 1
+
+
+
+def test_questions_wait_on_the_model_concurrently(api, fake_openai):
+    fake_openai.configure(latency=0.5)
+    queries = ["Who is Navani?", "Who is Jasnah?", "Who is Adolin?", "Who is Renarin?"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        responses = list(pool.map(lambda q: api.post("/ask", json={"query": q}), queries))
+    assert {r.status_code for r in responses} == {200}
+    # One event loop, four model calls in flight at once
+    assert fake_openai.state.peak_in_flight == len(queries)
+    assert time.perf_counter() - start < 0.5 * len(queries)
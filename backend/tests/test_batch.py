@@ -0,0 +1,32 @@
+import time
+
+
+def test_batch_answers_each_distinct_question_once(api, fake_openai):
+    queries = ["Who is Teft?", "who is TEFT", "Who is Rock?", "Who is Teft?"]
+    response = api.post("/ask/batch", json={"queries": [{"query": q} for q in queries]})
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch["unique_queries"] == 2
+    assert [item["query"] for item in batch["results"]] == queries
+    assert all(item["answer"] and not item["error"] for item in batch["results"])
+    assert batch["results"][0]["answer"] == batch["results"][1]["answer"] == batch["results"][3]["answer"]
+    assert fake_openai.state.requests == 2
+
+
+def test_batch_api_jobs_are_polled_for_results(api, fake_openai):
+    queries = ["Who is Sigzil?", "Who is Sigzil?", "Who is Lopen?"]
+    submitted = api.post("/ask/batch", json={"queries": [{"query": q} for q in queries], "mode": "batch_api"})
+    assert submitted.status_code == 200
+    batch_id = submitted.json()["batch_id"]
+    assert submitted.json()["unique_queries"] == 2
+
+    deadline = time.time() + 10
+    while True:
+        batch = api.get(f"/ask/batch/{batch_id}").json()
+        if batch["status"] == "completed" or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    assert batch["status"] == "completed"
+    assert [item["query"] for item in batch["results"]] == queries
+    assert all(item["answer"] for item in batch["results"])
+    assert api.get("/ask/batch/batch_unknown").status_code == 404
@@ -0,0 +1,57 @@
+from chunking import chunk_group, count_tokens, group_records, split_sentences
+
+
+def page(number: int, text: str) -> dict:
+    return {"source": f"page_{number:04d}.txt", "title": "", "page": number, "text": text}
+
+
+def test_split_sentences_keeps_closing_quotes():
+    text = 'He said "Life before death." Then he left! Did he? Yes'
+    sentences = [text[start:end].strip() for start, end in split_sentences(text)]
+    assert sentences == ['He said "Life before death."', "Then he left!", "Did he?", "Yes"]
+
+
+def test_consecutive_pages_are_one_stream():
+    records = [page(1, "a"), page(2, "b"), page(4, "c"),
+               {"source": "chapter_01.txt", "title": "One", "page": 0, "text": "d"},
+               {"source": "chapter_02.txt", "title": "Two", "page": 0, "text": "e"}]
+    assert [[r["text"] for r in group] for group in group_records(records)] == [["a", "b"], ["c"], ["d"], ["e"]]
+
+
+def test_chunks_record_the_pages_they_span():
+    group = [page(1, "Kaladin ran. The storm was"), page(2, "coming fast. Syl laughed."),
+             page(3, "Bridge Four waited at the chasm.")]
+    chunks = list(chunk_group(group, max_tokens=8, overlap_tokens=0))
+    spans = {chunk["text"]: (chunk["page_start"], chunk["page_end"]) for chunk in chunks}
+
+    # The sentence cut at the page break is rejoined and credited to both pages
+    assert spans["The storm was coming fast."] == (1, 2)
+    assert spans["Kaladin ran."] == (1, 1)
+    assert spans["Bridge Four waited at the chasm."] == (3, 3)
+    assert all(chunk["source"] == "page_0001.txt" for chunk in chunks if chunk["page_start"] == 1)
+
+
+def test_chunks_respect_the_token_limit_and_overlap():
+    text = " ".join(f"Sentence number {i} is here." for i in range(40))
+    chunks = list(chunk_group([page(7, text)], max_tokens=30, overlap_tokens=6))
+    assert len(chunks) > 1
+    assert all(chunk["tokens"] <= 30 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last_sentence = previous["text"].rsplit(". ", 1)[-1]
+        assert chunk["text"].startswith(last_sentence)
+
+
+def test_overlap_never_pushes_a_chunk_over_the_limit():
+    # The 30-token sentence fits the overlap, but not alongside the 40-token one after it
+    lengths = [34, 30, 40, 20, 10]
+    text = " ".join(" ".join([f"s{n}"] * (n - 1)) + "." for n in lengths)
+    chunks = list(chunk_group([page(1, text)], max_tokens=64, overlap_tokens=32))
+    assert [chunk["tokens"] for chunk in chunks] == [64, 60, 30]
+    assert chunks[1]["text"].startswith("s40")
+
+
+def test_long_sentences_are_split_on_words():
+    text = " ".join(f"word{i}" for i in range(100))
+    chunks = list(chunk_group([page(1, text)], max_tokens=25, overlap_tokens=0))
+    assert all(count_tokens(chunk["text"]) <= 25 for chunk in chunks)
+    assert " ".join(chunk["text"] for chunk in chunks) == text
@@ -0,0 +1,144 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from coalesce import Coalescer, SQLiteFlightStore
+
+
+def slow_answer(calls: list, text: str = "answer", delay: float = 0.05):
+    async def produce():
+        calls.append(text)
+        await asyncio.sleep(delay)
+        yield "delta", {"text": text[:3]}
+        yield "delta", {"text": text[3:]}
+        yield "done", {"answer": text}
+    return produce
+
+
+async def collect(coalescer: Coalescer, key: str, produce) -> list:
+    return [event async for event in coalescer.run(key, produce)]
+
+
+def test_concurrent_requests_share_one_call():
+    async def scenario():
+        coalescer, calls = Coalescer(), []
+        results = await asyncio.gather(*(collect(coalescer, "q", slow_answer(calls)) for _ in range(5)))
+        return coalescer, calls, results
+
+    coalescer, calls, results = asyncio.run(scenario())
+    assert calls == ["answer"]
+    assert all(events == results[0] for events in results)
+    assert results[0][-1] == ("done", {"answer": "answer"})
+    assert coalescer.stats() == {"backend": "memory", "in_flight": 0, "upstream_calls": 1, "coalesced_requests": 4}
+
+
+def test_distinct_keys_and_later_requests_are_not_coalesced():
+    async def scenario():
+        coalescer, calls = Coalescer(), []
+        await asyncio.gather(collect(coalescer, "a", slow_answer(calls, "first")),
+                             collect(coalescer, "b", slow_answer(calls, "second")))
+        await collect(coalescer, "a", slow_answer(calls, "third"))
+        return calls
+
+    assert sorted(asyncio.run(scenario())) == ["first", "second", "third"]
+
+
+def test_errors_reach_every_follower():
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+        yield  # pragma: no cover
+
+    async def scenario():
+        coalescer = Coalescer()
+        return await asyncio.gather(*(collect(coalescer, "q", failing) for _ in range(3)))
+
+    for events in asyncio.run(scenario()):
+        (kind, data), = events
+        assert kind == "error"
+        assert data["detail"] == "upstream failed"
+        assert isinstance(data["exception"], RuntimeError)
+
+
+def test_leader_survives_a_disconnected_caller():
+    async def scenario():
+        coalescer, calls = Coalescer(), []
+        leader = asyncio.create_task(collect(coalescer, "q", slow_answer(calls, delay=0.1)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(collect(coalescer, "q", slow_answer(calls)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, calls
+
+    events, calls = asyncio.run(scenario())
+    assert calls == ["answer"]
+    assert events[-1] == ("done", {"answer": "answer"})
+
+
+@pytest.fixture
+def flight_db(tmp_path):
+    return str(tmp_path / "inflight.sqlite3")
+
+
+def test_store_claims_one_leader_per_key(flight_db):
+    store = SQLiteFlightStore(flight_db)
+    leading, flight_id = store.claim("q")
+    assert leading
+    assert store.claim("q") == (False, flight_id)
+    assert store.leader_alive("q", flight_id)
+
+    store.release("q", flight_id)
+    assert not store.leader_alive("q", flight_id)
+    leading, next_flight_id = store.claim("q")
+    assert leading and next_flight_id != flight_id
+
+
+def test_store_keeps_events_per_flight(flight_db):
+    store = SQLiteFlightStore(flight_db)
+    _, first = store.claim("q")
+    store.append(first, 1, "delta", {"text": "old"})
+    store.append(first, 2, "done", {"answer": "old"})
+    store.release("q", first)
+
+    # A new flight for the same question neither clears nor mixes with the earlier flight's events
+    _, second = store.claim("q")
+    store.append(second, 1, "delta", {"text": "new"})
+    assert [kind for _, kind, _ in store.events_since(first, 0)] == ["delta", "done"]
+    assert store.events_since(second, 0) == [(1, "delta", {"text": "new"})]
+    assert store.events_since(first, 1) == [(2, "done", {"answer": "old"})]
+
+
+def test_store_drops_exceptions_from_error_events(flight_db):
+    store = SQLiteFlightStore(flight_db)
+    _, flight_id = store.claim("q")
+    store.append(flight_id, 1, "error", {"status": 500, "detail": "boom", "exception": RuntimeError("boom")})
+    assert store.events_since(flight_id, 0) == [(1, "error", {"status": 500, "detail": "boom"})]
+
+
+def test_workers_coalesce_through_the_store(flight_db):
+    async def scenario():
+        # Two coalescers on one database file stand in for two server workers
+        workers = [Coalescer(SQLiteFlightStore(flight_db), poll_seconds=0.01) for _ in range(2)]
+        calls = []
+        results = await asyncio.gather(*(collect(worker, "q", slow_answer(calls, delay=0.2)) for worker in workers))
+        return workers, calls, results
+
+    workers, calls, results = asyncio.run(scenario())
+    assert calls == ["answer"]
+    for events in results:
+        assert "".join(data["text"] for kind, data in events if kind == "delta") == "answer"
+        assert events[-1] == ("done", {"answer": "answer"})
+    assert sum(w.leaders for w in workers) == 1
+    assert sum(w.followers for w in workers) == 1
+
+
+def test_identical_questions_in_flight_share_one_call(api, fake_openai):
+    fake_openai.configure(latency=0.5)
+    query = {"query": "What did Shallan sketch?"}
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda _: api.post("/ask", json=query), range(4)))
+    assert {r.status_code for r in responses} == {200}
+    assert len({r.json()["answer"] for r in responses}) == 1
+    assert fake_openai.state.requests == 1
+    assert api.get("/coalesce/stats").json()["coalesced_requests"] >= 3
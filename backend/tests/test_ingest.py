@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from ingest import IngestQueue, UploadTooLargeError, book_id_for, read_status, run_job, write_status
+from local_index import LocalIndex
+
+
+async def body(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture(scope="module")
+def epub_path(tmp_path_factory) -> str:
+    """A two-chapter EPUB written with ebooklib."""
+    from ebooklib import epub
+
+    book = epub.EpubBook()
+    book.set_identifier("bridge-four")
+    book.set_title("Bridge Four")
+    book.set_language("en")
+    chapters = []
+    for number, name in enumerate(["Teft", "Rock"], 1):
+        chapter = epub.EpubHtml(title=f"Chapter {number}", file_name=f"chapter_{number}.xhtml", lang="en")
+        body = " ".join([f"{name} said that the highstorm was coming, and he ran for the barracks."] * 8)
+        chapter.content = f"<html><body><h1>Chapter {number}</h1><p>{body}</p></body></html>"
+        book.add_item(chapter)
+        chapters.append(chapter)
+    book.toc = chapters
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav"] + chapters
+    path = str(tmp_path_factory.mktemp("uploads") / "bridge_four.epub")
+    epub.write_epub(path, book)
+    return path
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return IngestQueue(str(tmp_path / "jobs"), max_bytes=1000)
+
+
+def test_create_validates_the_upload(queue):
+    status = queue.create("Words of Radiance.epub", title="Words of Radiance")
+    assert (status["book_id"], status["kind"], status["status"]) == ("words-of-radiance", "epub", "receiving")
+    assert read_status(queue.job_dir(status["job_id"])) == status
+    assert queue.get(status["job_id"]) == status
+    assert queue.get("../etc") is None
+
+    with pytest.raises(ValueError, match="Unsupported file type"):
+        queue.create("notes.txt")
+    with pytest.raises(ValueError, match="Invalid book ID"):
+        queue.create("book.pdf", book_id="../books")
+    assert book_id_for("The Way of Kings (2010).pdf") == "the-way-of-kings-2010"
+
+
+def test_receive_writes_the_upload(queue):
+    status = queue.create("book.epub")
+    asyncio.run(queue.receive(status, body(b"a" * 300, b"b" * 300, b"c" * 300)))
+    with open(os.path.join(queue.job_dir(status["job_id"]), status["upload"]), "rb") as f:
+        assert f.read() == b"a" * 300 + b"b" * 300 + b"c" * 300
+    assert status["bytes"] == 900
+
+
+def test_receive_refuses_oversized_and_empty_uploads(queue):
+    status = queue.create("book.epub")
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(queue.receive(status, body(b"a" * 600, b"b" * 600)))
+    assert not os.path.exists(queue.job_dir(status["job_id"]))
+
+    status = queue.create("book.epub")
+    with pytest.raises(ValueError, match="Empty upload"):
+        asyncio.run(queue.receive(status, body()))
+    assert not os.path.exists(queue.job_dir(status["job_id"]))
+
+
+def test_run_job_builds_the_book_indexes(tmp_path, epub_path):
+    queue = IngestQueue(str(tmp_path / "jobs"))
+    status = queue.create("bridge_four.epub", title="Bridge Four")
+    with open(epub_path, "rb") as f:
+        asyncio.run(queue.receive(status, body(f.read())))
+    # What submit() hands to the worker pool
+    job_dir = queue.job_dir(status["job_id"])
+    write_status(job_dir, dict(status, status="queued"))
+
+    result = run_job(job_dir, {"backend": "local", "extract_workers": 1, "embeddings": False})
+    index = LocalIndex.load(result["local_index_dir"])
+    best = index.lexical_search("Rock barracks", 1)[0]["text"]
+    assert "Rock said" in best and "Teft" not in best
+
+    status = read_status(job_dir)
+    assert status["records"] == 2
+    assert {"extracting", "indexing"} <= set(status["stage_seconds"])
+    assert status["result"] == result
+
+
+def test_openai_jobs_upload_without_the_sample_query(tmp_path, monkeypatch, fake_openai, epub_path):
+    import rag_setup
+
+    monkeypatch.chdir(tmp_path)  # the upload manifest is written to the working directory
+    monkeypatch.setattr(rag_setup, "run_smoke_test", lambda *args: pytest.fail("ran the sample query"))
+    queue = IngestQueue(str(tmp_path / "jobs"))
+    status = queue.create("bridge_four.epub")
+    with open(epub_path, "rb") as f:
+        asyncio.run(queue.receive(status, body(f.read())))
+    job_dir = queue.job_dir(status["job_id"])
+    write_status(job_dir, dict(status, status="queued"))
+
+    result = run_job(job_dir, {"backend": "openai", "extract_workers": 1})
+    assert len(fake_openai.state.vector_stores[result["vector_store_id"]]["files"]) == 2
+
+
+def test_ingested_books_are_served_without_a_restart(api, fake_openai, epub_path):
+    with open(epub_path, "rb") as f:
+        response = api.post("/ingest", params={"filename": "bridge_four.epub", "title": "Bridge Four"},
+                            content=f.read())
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    deadline = time.time() + 60
+    while True:
+        job = api.get(f"/ingest/jobs/{job_id}").json()
+        if job["status"] in ("ready", "failed") or time.time() > deadline:
+            break
+        time.sleep(0.1)
+    assert job["status"] == "ready", job.get("error")
+
+    assert job["book_id"] == "bridge-four"
+    response = api.post("/ask", json={"query": "Who ran for the barracks?", "book_id": "bridge-four"})
+    assert response.status_code == 200
+    assert response.json()["sources"][0]["book_id"] == "bridge-four"
+    assert api.post("/ingest", params={"filename": "notes.txt"}, content=b"x").status_code == 400
@@ -0,0 +1,36 @@
+from local_index import LocalIndex, StoredPassages
+
+
+def test_local_index_keeps_passage_texts_out_of_the_pickle(tmp_path):
+    passages = [{"id": i, "source": f"chapter_{i:02d}.txt", "title": f"Chapter {i}", "page": i,
+                 "text": f"Passage {i} about {'Kaladin' if i % 2 else 'Shallan'} and the storm."}
+                for i in range(20)]
+    index = LocalIndex([dict(p) for p in passages])
+    index.add_embeddings(lambda texts: [[float(len(t)), float(i % 3), 1.0] for i, t in enumerate(texts)],
+                         codec="int8")
+    index.save(str(tmp_path))
+    assert b"about Kaladin" not in (tmp_path / "index.pkl").read_bytes()
+
+    loaded = LocalIndex.load(str(tmp_path))
+    assert isinstance(loaded.passages, StoredPassages)
+    assert list(loaded.passages) == passages
+    assert loaded.lexical_search("Kaladin storm", 3)[0]["text"].endswith("about Kaladin and the storm.")
+    assert len(loaded.vector_search([20.0, 0.0, 1.0], 3, rescore=10)) == 3
+
+
+def test_rebuild_without_embeddings_drops_the_old_vectors(tmp_path):
+    def passages(count):
+        return [{"id": i, "source": f"chapter_{i:02d}.txt", "title": "", "page": 0, "text": f"Passage {i} of the storm."}
+                for i in range(count)]
+
+    index = LocalIndex(passages(10))
+    index.add_embeddings(lambda texts: [[float(i), 1.0, 0.5] for i in range(len(texts))], codec="int8")
+    index.save(str(tmp_path))
+    assert LocalIndex.load(str(tmp_path)).embeddings is not None
+
+    # Rebuilt into the same directory with fewer passages and no embeddings
+    LocalIndex(passages(3)).save(str(tmp_path))
+    loaded = LocalIndex.load(str(tmp_path))
+    assert loaded.embeddings is None
+    assert not (tmp_path / "embeddings.npy").exists()
+    assert len(loaded.lexical_search("storm", 5)) == 3
@@ -0,0 +1,43 @@
+import asyncio
+import json
+import os
+
+from metrics import MetricsMiddleware, span
+
+
+async def slow_app(scope, receive, send):
+    with span("model"):
+        await asyncio.sleep(0.1)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def request(app, path: str, sent: list):
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": "GET", "path": path}, None, send)
+
+
+def test_slow_requests_are_logged_with_a_profile(tmp_path):
+    app = MetricsMiddleware(slow_app, slow_seconds=0.05, profile_rate=1.0, log_dir=str(tmp_path))
+
+    async def scenario():
+        sent = []
+        # The second request starts while the first is profiled, so it shows up in that profile
+        first = asyncio.create_task(request(app, "/ask", sent))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(first, request(app, "/ask", sent))
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert [m["status"] for m in sent if m["type"] == "http.response.start"] == [200, 200]
+    with open(tmp_path / "slow_requests.jsonl", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 2
+    assert all(entry["spans"]["model"] >= 0.1 and entry["status"] == 200 for entry in entries)
+
+    # Only one cProfile runs at a time
+    profiled, = [entry for entry in entries if "profile" in entry]
+    assert os.path.getsize(profiled["profile"]) > 0
+    assert profiled["profile_overlapping_requests"] == 1
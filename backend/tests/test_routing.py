@@ -0,0 +1,113 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from routing import BudgetExceededError, classify, create_router
+
+
+def router_config(**overrides) -> SimpleNamespace:
+    settings = dict(
+        ROUTING=True, LOOKUP_MODEL="gpt-4o-mini", LOOKUP_TOP_K=3, LOOKUP_MAX_OUTPUT_TOKENS=400,
+        ANALYSIS_MODEL="gpt-4o", RETRIEVAL_TOP_K=5, ANALYSIS_MAX_OUTPUT_TOKENS=1500, REQUEST_TOKEN_BUDGET=6000,
+        CONTEXT_TOKEN_BUDGET=1500, TOKENS_PER_MINUTE=0, ROUTING_LOG_PATH="", ROUTING_LOG_MAX_MB=50,
+        ROUTING_LOG_BACKUPS=3,
+    )
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+BOOK = [{"book_id": "way-of-kings"}]
+
+
+@pytest.mark.parametrize("query,books,expected", [
+    ("Who is Cenn?", 1, "lookup"),
+    ("Why does Kaladin distrust lighteyes?", 1, "analysis"),
+    ("Compare Kaladin and Dalinar", 1, "analysis"),
+    ("Who is Cenn?", 2, "analysis"),
+    ("Who is Cenn? Where is he from?", 1, "analysis"),
+])
+def test_classify(query, books, expected):
+    assert classify(query, books)[0] == expected
+
+
+def test_routes_pick_model_and_passages():
+    router = create_router(router_config())
+    lookup = router.decide("Who is Cenn?", BOOK)
+    analysis = router.decide("Why does Kaladin distrust lighteyes?", BOOK)
+    assert (lookup.route.model, lookup.route.top_k, lookup.route.max_output_tokens) == ("gpt-4o-mini", 3, 400)
+    assert (analysis.route.model, analysis.route.top_k) == ("gpt-4o", 5)
+    assert router.route_for("Who is Cenn?", BOOK) is lookup.route
+    assert router.stats()["decisions"] == {"lookup": 1, "analysis": 1}
+
+
+def test_routing_off_sends_everything_to_the_baseline():
+    router = create_router(router_config(ROUTING=False))
+    decision = router.decide("Who is Cenn?", BOOK)
+    assert decision.route is router.baseline
+    assert decision.route.model == "gpt-4o" and decision.route.max_output_tokens is None
+
+
+def test_budget_downgrades_then_rejects():
+    config = router_config(TOKENS_PER_MINUTE=3000)
+    router = create_router(config)
+    query = "Why does Kaladin distrust lighteyes?"
+    analysis_tokens = router.routes["analysis"].estimated_tokens(router.count_tokens(query))
+    lookup_tokens = router.routes["lookup"].estimated_tokens(router.count_tokens(query))
+    assert lookup_tokens < config.TOKENS_PER_MINUTE < analysis_tokens
+
+    decision = router.decide(query, BOOK)
+    assert decision.route.name == "lookup" and decision.downgraded
+    with pytest.raises(BudgetExceededError) as error:
+        router.decide(query, BOOK)
+    assert error.value.retry_after > 0
+    assert (router.downgrades, router.rejections) == (1, 1)
+
+    # A failed request gives its reservation back
+    router.release(decision)
+    assert router.decide(query, BOOK).downgraded
+
+
+def test_record_tallies_savings_against_the_baseline():
+    router = create_router(router_config())
+    decision = router.decide("Who is Cenn?", BOOK)
+    router.record(decision, "Who is Cenn?", 3, {"input_tokens": 1000, "output_tokens": 100})
+    stats = router.stats()
+    assert stats["cost_usd"] > 0
+    assert stats["saved_usd"] > 0
+
+
+def test_decision_log_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    router = create_router(router_config())
+    router.record(router.decide("Who is Cenn?", BOOK), "Who is Cenn?", 3, {"input_tokens": 500})
+    router.close()
+    assert list(tmp_path.iterdir()) == []
+
+    log_path = tmp_path / "routing.jsonl"
+    router = create_router(router_config(ROUTING_LOG_PATH=str(log_path)))
+    router.record(router.decide("Who is Cenn?", BOOK), "Who is Cenn?", 3, {"input_tokens": 500})
+    router.close()
+    entry, = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert entry["route"] == "lookup" and entry["query"] == "Who is Cenn?"
+    assert entry["input_tokens"] == 500
+
+
+def test_decision_log_rotates(tmp_path):
+    log_path = tmp_path / "routing.jsonl"
+    router = create_router(router_config(ROUTING_LOG_PATH=str(log_path), ROUTING_LOG_BACKUPS=2))
+    # Rotation by size is set in MB by config; shrink it on the open handler
+    router._log_listener.handlers[0].maxBytes = 2000
+    for _ in range(50):
+        router.record(router.decide("Who is Cenn?", BOOK), "Who is Cenn?", 3, {"input_tokens": 500})
+    router.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["routing.jsonl", "routing.jsonl.1", "routing.jsonl.2"]
+
+
+def test_routing_stats_count_decisions(api, fake_openai):
+    before = api.get("/routing/stats").json()["decisions"]
+    api.post("/ask", json={"query": "Who is Moash?"})
+    api.post("/ask", json={"query": "Why does Moash betray Kaladin?"})
+    after = api.get("/routing/stats").json()["decisions"]
+    assert after["lookup"] == before["lookup"] + 1
+    assert after["analysis"] == before["analysis"] + 1
@@ -0,0 +1,100 @@
+import time
+
+from local_index import build_prompt
+from sessions import SessionStore
+
+PASSAGES = [
+    {"source": "chapter_01.txt", "text": "Kaladin carried the bridge."},
+    {"source": "chapter_02.txt", "text": "Shallan sketched the chasmfiend."},
+]
+
+
+def test_ids_are_issued_by_the_store():
+    store = SessionStore()
+    first, second = store.create("book"), store.create("book")
+    assert first.session_id != second.session_id
+    assert len(first.session_id) == 32
+    assert store.get(first.session_id, "book") is first
+    assert store.get("chosen-by-the-client", "book") is None
+    assert store.stats()["created"] == 2
+
+
+def test_other_books_start_the_conversation_over():
+    store = SessionStore()
+    session = store.create("book-a")
+    session.record("Who is Kaladin?", "A bridgeman.", "resp_1")
+
+    fresh = store.get(session.session_id, "book-b")
+    assert fresh is not session
+    assert fresh.session_id == session.session_id
+    assert fresh.lock is session.lock
+    assert fresh.previous_response_id is None and not fresh.turns
+
+
+def test_idle_sessions_expire_and_the_oldest_are_evicted():
+    store = SessionStore(max_sessions=2, ttl=60)
+    oldest, middle = store.create("book"), store.create("book")
+    store.get(oldest.session_id, "book")
+    newest = store.create("book")
+    assert store.get(middle.session_id, "book") is None
+    assert store.evicted == 1
+
+    newest.last_access = oldest.last_access = time.time() - 120
+    assert store.get(newest.session_id, "book") is None
+    assert len(store) == 0
+    assert store.expired == 2
+
+
+def test_chain_mode_continues_the_response_and_sends_only_new_excerpts():
+    session = SessionStore(mode="chain").create("book")
+    request = session.prepare("Who is Kaladin?", PASSAGES[:1], {}, build_prompt)
+    assert "previous_response_id" not in request
+    assert "Kaladin carried the bridge." in request["input"]
+    session.record("Who is Kaladin?", "A bridgeman.", "resp_1")
+
+    assert session.retrieval_query("What does he carry?") == "Who is Kaladin? What does he carry?"
+    request = session.prepare("What does he carry?", PASSAGES, {}, build_prompt)
+    assert request["previous_response_id"] == "resp_1"
+    assert request["truncation"] == "auto"
+    assert "Kaladin carried the bridge." not in request["input"]
+    assert "Shallan sketched the chasmfiend." in request["input"]
+
+    # Nothing new to send: the question alone continues the conversation
+    session.record("What does he carry?", "A bridge.", "resp_2")
+    request = session.prepare("And then?", PASSAGES, {}, build_prompt)
+    assert request["input"].startswith("Follow-up question")
+
+
+def test_local_mode_repeats_recent_turns_and_carries_excerpts():
+    session = SessionStore(mode="local", max_turns=1).create("book")
+    session.prepare("Who is Kaladin?", PASSAGES[:1], {}, build_prompt)
+    session.record("Who is Kaladin?", "A bridgeman.", "resp_1")
+    session.prepare("Who is Shallan?", PASSAGES[1:], {}, build_prompt)
+    session.record("Who is Shallan?", "A scholar.", "resp_2")
+
+    request = session.prepare("Are they friends?", PASSAGES, {}, build_prompt)
+    assert "previous_response_id" not in request
+    assert request["input"].startswith("Conversation so far:\nQ: Who is Shallan?\nA: A scholar.")
+    assert "Who is Kaladin?" not in request["input"]
+    assert session.carried_rankings() == [PASSAGES[1:]]
+
+
+def test_sessions_are_issued_by_the_server(api, fake_openai):
+    first = api.post("/ask", json={"query": "Who is Kaladin?", "start_session": True}).json()
+    session_id = first["session_id"]
+    assert session_id
+
+    follow_up = api.post("/ask", json={"query": "What does he carry?", "session_id": session_id})
+    assert follow_up.status_code == 200
+    assert follow_up.json()["session_id"] == session_id
+
+    streamed = api.post("/ask/stream", json={"query": "And then?", "session_id": session_id})
+    assert streamed.headers["X-Session-ID"] == session_id
+    assert "event: done" in streamed.text
+
+    # Names the server never issued are refused rather than adopted
+    for path in ("/ask", "/ask/stream"):
+        response = api.post(path, json={"query": "Who is Kaladin?", "session_id": "my-session"})
+        assert response.status_code == 404
+    assert api.delete(f"/sessions/{session_id}").status_code == 200
+    assert api.post("/ask", json={"query": "Hello?", "session_id": session_id}).status_code == 404
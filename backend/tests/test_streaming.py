@@ -0,0 +1,18 @@
+import json
+
+
+def sse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_deltas_then_done(api, fake_openai):
+    response = api.post("/ask/stream", json={"query": "What did Dalinar read?"})
+    assert response.status_code == 200
+    events = sse_events(response.text)
+    assert [kind for kind, _ in events[:-1]] == ["delta"] * (len(events) - 1)
+    assert events[-1][0] == "done"
+    assert "".join(data["text"] for _, data in events[:-1]).startswith("Fake answer to:")
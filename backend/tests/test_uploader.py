@@ -0,0 +1,44 @@
+import os
+import random
+
+from openai import OpenAI
+
+from uploader import AdaptiveUploader, AIMDLimiter
+
+
+def test_limiter_grows_on_success_and_halves_on_overload():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=8, cooldown=0.0)
+    for _ in range(60):
+        limiter.on_success()
+    assert int(limiter.limit) == 8
+    limiter.on_overload()
+    assert int(limiter.limit) == 4
+    assert limiter.decreases == 1
+
+
+def test_uploads_survive_rate_limits(tmp_path, fake_openai):
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"chapter_{i:02d}.txt"
+        path.write_text(f"Chapter {i}: the highstorm came.")
+        paths.append(path)
+
+    random.seed(0)
+    fake_openai.configure(latency=0.01, error_rate=0.3, error_statuses=[429])
+    client = OpenAI(api_key="sk-test", base_url=os.environ["OPENAI_BASE_URL"])
+    uploader = AdaptiveUploader(client, initial_concurrency=4, max_concurrency=8, max_retries=10,
+                                base_delay=0.01, max_delay=0.1, cooldown=0.0)
+    results = uploader.upload_files(paths)
+    assert all(result["status"] == "success" for result in results)
+    assert {result["filename"] for result in results} == {path.name for path in paths}
+
+    report = uploader.report()
+    assert report["uploaded"] == 20
+    assert report["rate_limited"] == report["retries"] > 0
+    assert report["concurrency_decreases"] > 0
+
+    fake_openai.configure(error_rate=0.0)
+    vector_store = client.vector_stores.create(name="test")
+    file_ids = [result["file_id"] for result in results]
+    assert AdaptiveUploader(client, batch_size=8).attach_files(vector_store.id, file_ids) == {}
+    assert fake_openai.state.vector_stores[vector_store.id]["files"] == set(file_ids)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from vector_index import EmbeddingCache, VectorIndex, embed_texts, normalize
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    return normalize(np.random.default_rng(0).standard_normal((2000, 64)).astype(np.float32))
+
+
+@pytest.fixture(scope="module")
+def queries(embeddings):
+    # Near-duplicates of known passages, so the exact answer is known
+    noise = np.random.default_rng(1).standard_normal((50, 64)).astype(np.float32) * 0.05
+    return embeddings[:50] + noise
+
+
+def recall_at_1(index: VectorIndex, queries, rescore: int = 0) -> float:
+    ids, _ = index.search(queries, k=1, rescore=rescore)
+    return float(np.mean(ids[:, 0] == np.arange(len(queries))))
+
+
+@pytest.mark.parametrize("codec,min_recall", [("float32", 1.0), ("int8", 0.98), ("pq", 0.5)])
+def test_codecs_find_the_nearest_passage(embeddings, queries, codec, min_recall):
+    index = VectorIndex.build(embeddings, codec)
+    assert recall_at_1(index, queries) >= min_recall
+    # Exact re-scoring of the approximate candidates recovers full recall
+    assert recall_at_1(index, queries, rescore=100) == 1.0
+
+
+def test_quantized_codes_are_smaller(embeddings):
+    float32 = VectorIndex.build(embeddings, "float32").nbytes
+    assert VectorIndex.build(embeddings, "int8").nbytes < float32 / 3
+    # At this size the codebooks outweigh the codes
+    assert VectorIndex.build(embeddings, "pq").nbytes < float32 / 6
+
+
+def test_search_returns_best_first(embeddings, queries):
+    ids, scores = VectorIndex.build(embeddings, "int8").search(queries[:3], k=5, rescore=50)
+    assert ids.shape == scores.shape == (3, 5)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    assert np.allclose(scores[:, 0], np.einsum("qd,qd->q", normalize(queries[:3]), embeddings[ids[:, 0]]),
+                       atol=1e-5)
+
+
+def test_empty_searches(embeddings):
+    index = VectorIndex.build(embeddings, "int8")
+    ids, scores = index.search(np.zeros((0, 64)), k=5)
+    assert ids.shape == scores.shape == (0, 0)
+    with pytest.raises(ValueError):
+        VectorIndex.build(embeddings, "pq", subspaces=5)
+
+
+@pytest.mark.parametrize("codec", ["float32", "int8", "pq"])
+def test_saved_index_is_memory_mapped(tmp_path, embeddings, queries, codec):
+    index = VectorIndex.build(embeddings, codec)
+    index.save(str(tmp_path))
+    loaded = VectorIndex.load(str(tmp_path))
+    assert (loaded.codec, loaded.dim, len(loaded)) == (codec, 64, 2000)
+    assert isinstance(loaded.vectors, np.memmap)
+    for rescore in (0, 100):
+        assert np.array_equal(loaded.search(queries, 5, rescore)[0], index.search(queries, 5, rescore)[0])
+
+
+def test_embedding_cache_skips_unchanged_texts(tmp_path):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache.sqlite3"))
+    matrix, reused = embed_texts(["a", "bb", "a"], embed, cache=cache, model="m")
+    assert (matrix.shape, reused) == ((3, 2), 0)
+    assert calls == [["a", "bb"]]
+
+    matrix_again, reused = embed_texts(["bb", "ccc", "a"], embed, cache=cache, model="m")
+    assert reused == 2
+    assert calls[-1] == ["ccc"]
+    assert np.allclose(matrix_again[0], matrix[1])
+
+    # Embeddings from another model are not reused
+    embed_texts(["a"], embed, cache=cache, model="other")
+    assert calls[-1] == ["a"]
+    cache.close()
+
+
+def test_saving_over_a_mapped_index_leaves_it_readable(tmp_path, embeddings, queries):
+    VectorIndex.build(embeddings, "int8").save(str(tmp_path))
+    mapped = VectorIndex.load(str(tmp_path))
+    expected = mapped.search(queries, 5, rescore=100)[0]
+
+    # A worker still serving the old files while a rebuild with another codec replaces them
+    VectorIndex.build(embeddings[::-1], "float32").save(str(tmp_path))
+    assert np.array_equal(mapped.search(queries, 5, rescore=100)[0], expected)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["embeddings.json", "embeddings.npy"]
+    assert VectorIndex.load(str(tmp_path)).codec == "float32"
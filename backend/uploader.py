@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Adaptive Bulk Uploader for Book Companion
+Uploads corpus files to OpenAI with concurrency that grows while requests succeed
+and halves on rate limits or timeouts (AIMD), retries failures with jittered
+exponential backoff, and attaches uploaded files to a vector store in batches.
+
+Run it directly to exercise the scheduler against the local fake OpenAI server:
+    python uploader.py --error-rate 0.2 --latency 0.1
+"""
+
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import openai
+
+# Errors worth retrying; everything else (bad request, auth, ...) fails immediately
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# Errors that signal overload and should shrink the concurrency window
+BACKOFF_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+
+
+class AIMDLimiter:
+    """Concurrency window with additive increase and multiplicative decrease"""
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        # +1 slot per window's worth of successes, i.e. roughly +1 per round trip
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+            self._cond.notify_all()
+
+    def on_overload(self) -> None:
+        # Halve at most once per cooldown so one burst of 429s does not collapse the window
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreases += 1
+                self._last_decrease = now
+
+
+def backoff_delay(attempt: int, base: float, cap: float, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when the server sends it."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(cap, float(retry_after)) + random.uniform(0, base)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class AdaptiveUploader:
+    """Upload files and attach them to a vector store with adaptive concurrency"""
+
+    def __init__(self, client, initial_concurrency: int = 4, max_concurrency: int = 16,
+                 max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 batch_size: int = 100, cooldown: float = 1.0):
+        # The scheduler owns retries, so turn off the SDK's built-in ones
+        self.client = client.with_options(max_retries=0)
+        self.limiter = AIMDLimiter(initial_concurrency, 1, max_concurrency, cooldown)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self.stats = {"uploaded": 0, "failed": 0, "bytes": 0, "retries": 0, "rate_limited": 0,
+                      "attached": 0, "attach_failed": 0, "batches": 0, "seconds": 0.0}
+
+    def _count(self, key: str, amount=1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def call_with_retries(self, fn: Callable, *args, **kwargs):
+        """Run one API call under the concurrency window, retrying retryable errors."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                self.limiter.release()
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                if isinstance(e, BACKOFF_ERRORS):
+                    self.limiter.on_overload()
+                if attempt == self.max_retries:
+                    raise
+                self._count("retries")
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay, e))
+                continue
+            except Exception:
+                self.limiter.release()
+                raise
+            self.limiter.release()
+            self.limiter.on_success()
+            return result
+
+    def _upload_one(self, file_path: Path) -> dict:
+        def create():
+            with open(file_path, "rb") as f:
+                return self.client.files.create(file=f, purpose="assistants")
+        try:
+            file_obj = self.call_with_retries(create)
+            self._count("uploaded")
+            self._count("bytes", file_path.stat().st_size)
+            return {"path": file_path, "filename": file_path.name, "status": "success", "file_id": file_obj.id}
+        except Exception as e:
+            self._count("failed")
+            return {"path": file_path, "filename": file_path.name, "status": "error", "error": str(e)}
+
+    def upload_files(self, paths: List[Path], on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        """Upload file objects; returns one result dict per path (status success or error)."""
+        start = time.perf_counter()
+        results = []
+        # Threads are capped at the window's maximum; the limiter decides how many run at once
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [executor.submit(self._upload_one, p) for p in paths]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        self._count("seconds", time.perf_counter() - start)
+        return results
+
+    def attach_files(self, vector_store_id: str, file_ids: List[str]) -> dict:
+        """Attach files with the batch API; returns {file_id: error} for batches that failed."""
+        start = time.perf_counter()
+        failures = {}
+        for i in range(0, len(file_ids), self.batch_size):
+            batch = file_ids[i:i + self.batch_size]
+            try:
+                result = self.call_with_retries(
+                    self.client.vector_stores.file_batches.create_and_poll,
+                    vector_store_id=vector_store_id, file_ids=batch,
+                )
+                self._count("batches")
+                failed = result.file_counts.failed if result.file_counts else 0
+                self._count("attached", len(batch) - failed)
+                self._count("attach_failed", failed)
+                if result.status != "completed":
+                    for file_id in batch:
+                        failures[file_id] = f"batch {result.id} ended with status {result.status}"
+            except Exception as e:
+                self._count("attach_failed", len(batch))
+                for file_id in batch:
+                    failures[file_id] = str(e)
+        self._count("seconds", time.perf_counter() - start)
+        return failures
+
+    def report(self) -> dict:
+        """Throughput, retry counts and concurrency-window statistics."""
+        seconds = self.stats["seconds"] or 1e-9
+        return dict(
+            self.stats,
+            files_per_second=self.stats["uploaded"] / seconds,
+            mb_per_second=self.stats["bytes"] / seconds / 1e6,
+            final_concurrency=int(self.limiter.limit),
+            peak_concurrency=int(self.limiter.peak_limit),
+            concurrency_decreases=self.limiter.decreases,
+        )
+
+
+def print_report(report: dict) -> None:
+    print(f"\n📈 Upload throughput: {report['files_per_second']:.1f} files/s "
+          f"({report['mb_per_second']:.2f} MB/s over {report['seconds']:.1f}s)")
+    print(f"   🔁 Retries: {report['retries']} (rate limited: {report['rate_limited']})")
+    print(f"   🎚️  Concurrency: final {report['final_concurrency']}, peak {report['peak_concurrency']}, "
+          f"halved {report['concurrency_decreases']} times")
+    print(f"   📎 Attached: {report['attached']} in {report['batches']} batches "
+          f"(failed: {report['attach_failed']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exercise the adaptive uploader against the fake OpenAI server')
+    parser.add_argument('--error-rate', type=float, default=0.2,
+                       help='Fraction of requests the fake server rejects with 429 (default: 0.2)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                       help='Simulated latency per request in seconds (default: 0.05)')
+    parser.add_argument('--port', type=int, default=8100, help='Port for the fake OpenAI server')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Upper bound on concurrent uploads')
+
+    args = parser.parse_args()
+
+    import fake_openai
+    from openai import OpenAI
+    from rag_setup import collect_corpus_files
+
+    fake_openai.state.latency = args.latency
+    fake_openai.state.error_rate = args.error_rate
+    fake_openai.start_in_thread(fake_openai.app, port=args.port)
+    client = OpenAI(api_key="fake-key", base_url=f"http://127.0.0.1:{args.port}/v1")
+
+    files = collect_corpus_files()
+    print(f"🚀 Uploading {len(files)} files to the fake server "
+          f"({args.error_rate:.0%} 429s, {args.latency * 1000:.0f}ms latency)")
+
+    uploader = AdaptiveUploader(client, max_concurrency=args.max_concurrency, base_delay=0.05, max_delay=1.0)
+    vs = client.vector_stores.create(name="BookCompanion-UploadTest")
+    results = uploader.upload_files(files)
+    file_ids = [r["file_id"] for r in results if r["status"] == "success"]
+    uploader.attach_files(vs.id, file_ids)
+
+    report = uploader.report()
+    print_report(report)
+    print(f"   ❌ Failed uploads: {report['failed']}")
+    print(f"   🖥️  Fake server peak in flight: {fake_openai.state.peak_in_flight}")
+
+
+if __name__ == "__main__":
+    main()
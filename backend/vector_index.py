@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Quantized Embedding Index for Book Companion
+The embedding half of a local index (see local_index.py). A float32 matrix for
+a whole series is large, and every worker would hold its own copy, so vectors
+are stored compactly in .npy files that workers memory-map and share through
+the page cache:
+
+    float32  the normalised vectors as-is (exact, 4 bytes per dimension)
+    int8     each vector scaled to [-127, 127] with its own scale (1 byte per dimension)
+    pq       product quantization: the vector is cut into subspaces and each
+             piece stored as the index of its nearest of 256 centroids
+             (1 byte per subspace, e.g. 96 bytes for 1536 dimensions)
+
+Searches score a batch of queries against the codes block by block with NumPy
+matrix operations and keep a running top-k. With rescore=N, the best N
+candidates are scored again exactly against the float32 vectors, which stay
+on disk and are only read for those rows.
+
+Passage embeddings are computed in batches and cached in SQLite by the hash of
+model and text, so rebuilding an index after re-extraction only embeds the
+chunks that changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Embeddings are optional; BM25 works without numpy
+    np = None
+
+CODECS = ("float32", "int8", "pq")
+
+VECTORS_FILENAME = "embeddings.npy"  # float32 originals; indexes from before quantization have only this
+CODES_FILENAME = "embedding_codes.npy"
+SCALES_FILENAME = "embedding_scales.npy"
+CENTROIDS_FILENAME = "embedding_centroids.npy"
+META_FILENAME = "embeddings.json"
+FILENAMES = (VECTORS_FILENAME, CODES_FILENAME, SCALES_FILENAME, CENTROIDS_FILENAME, META_FILENAME)
+
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = 40 * PQ_CENTROIDS  # enough points per centroid for k-means
+PQ_ITERATIONS = 10
+BLOCK_BYTES = 8 << 20  # float32 scratch per block of rows while scoring
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy is required for embeddings (pip install numpy)")
+
+
+def normalize(matrix):
+    """Rows scaled to unit length (zero rows left as they are)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def chunk_hash(text: str, model: str = "") -> str:
+    """Cache key of a chunk's embedding: the same text under another model is a different vector."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Embeddings by chunk hash in a SQLite file, shared by every build on the machine"""
+
+    def __init__(self, path: str = "embedding_cache.sqlite3"):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, "np.ndarray"]:
+        found = {}
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, "np.ndarray"]]) -> None:
+        self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                               ((key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items))
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def embed_texts(texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]], batch_size: int = 256,
+                cache: Optional[EmbeddingCache] = None, model: str = "") -> Tuple["np.ndarray", int]:
+    """
+    Normalised embeddings of texts, calling embed_fn in batches for the
+    distinct texts the cache does not have. Returns (matrix, texts reused from the cache).
+    """
+    require_numpy()
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), 0
+    keys = [chunk_hash(text, model) for text in texts]
+    known = cache.get_many(list(set(keys))) if cache is not None else {}
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in known:
+            missing.setdefault(key, text)
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), batch_size):
+        batch = missing_keys[start:start + batch_size]
+        vectors = np.asarray(embed_fn([missing[key] for key in batch]), dtype=np.float32)
+        fresh = dict(zip(batch, vectors))
+        if cache is not None:
+            # Written per batch, so an interrupted build keeps what it paid for
+            cache.put_many(fresh.items())
+        known.update(fresh)
+
+    reused = sum(key not in missing for key in keys)
+    return normalize(np.stack([known[key] for key in keys])), reused
+
+
+def train_pq(matrix, subspaces: int, iterations: int = PQ_ITERATIONS, seed: int = 0):
+    """k-means centroids for each subspace: (subspaces, centroids, sub_dim)."""
+    rng = np.random.default_rng(seed)
+    sample = matrix if len(matrix) <= PQ_TRAIN_SAMPLE else matrix[rng.choice(len(matrix), PQ_TRAIN_SAMPLE,
+                                                                             replace=False)]
+    sample = sample.reshape(len(sample), subspaces, -1)
+    count = min(PQ_CENTROIDS, len(sample))
+    centroids = np.empty((subspaces, count, sample.shape[2]), dtype=np.float32)
+    for j in range(subspaces):
+        points = sample[:, j, :]
+        centers = points[rng.choice(len(points), count, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = nearest_centroids(points, centers)
+            sums = np.stack([np.bincount(assignment, weights=points[:, t], minlength=count)
+                             for t in range(points.shape[1])], axis=1)
+            counts = np.bincount(assignment, minlength=count)[:, None]
+            # Empty clusters keep their old center
+            centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+        centroids[j] = centers
+    return centroids
+
+
+def nearest_centroids(points, centers):
+    # argmin of squared distance; |p|^2 is the same for every center
+    return np.argmin((centers * centers).sum(axis=1) - 2 * points @ centers.T, axis=1)
+
+
+class VectorIndex:
+    """Quantized passage embeddings with batched top-k search and exact re-scoring"""
+
+    def __init__(self, codec: str, dim: int, codes, vectors=None, scales=None, centroids=None):
+        self.codec = codec
+        self.dim = dim
+        self.codes = codes
+        self.vectors = vectors  # float32 originals for re-scoring (memory-mapped once saved)
+        self.scales = scales
+        self.centroids = centroids
+
+    @classmethod
+    def build(cls, matrix, codec: str = "float32", subspaces: int = 0) -> "VectorIndex":
+        """
+        Quantize a matrix of embeddings. subspaces is the number of PQ pieces
+        (0 = about one per 16 dimensions); it must divide the dimension.
+        """
+        require_numpy()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown embedding codec: {codec} (expected one of {', '.join(CODECS)})")
+        matrix = normalize(matrix)
+        dim = matrix.shape[1] if matrix.ndim == 2 else 0
+
+        if codec == "float32":
+            return cls(codec, dim, matrix, vectors=matrix)
+        if codec == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+            return cls(codec, dim, codes, vectors=matrix, scales=scales.astype(np.float32))
+
+        # Default: the largest divisor of the dimension that gives pieces of at least 16 dimensions
+        subspaces = subspaces or next(s for s in range(max(1, dim // 16), 0, -1) if dim % s == 0)
+        if dim % subspaces:
+            raise ValueError(f"PQ subspaces ({subspaces}) must divide the embedding dimension ({dim})")
+        if not len(matrix):
+            return cls(codec, dim, np.zeros((0, subspaces), dtype=np.uint8), vectors=matrix,
+                       centroids=np.zeros((subspaces, 1, dim // subspaces), dtype=np.float32))
+        centroids = train_pq(matrix, subspaces)
+        pieces = matrix.reshape(len(matrix), subspaces, -1)
+        codes = np.stack([nearest_centroids(pieces[:, j, :], centroids[j]) for j in range(subspaces)], axis=1)
+        return cls(codec, dim, codes.astype(np.uint8), vectors=matrix, centroids=centroids)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of what a search reads for every passage (the codes and their side tables)."""
+        extra = [a.nbytes for a in (self.scales, self.centroids) if a is not None]
+        return int(self.codes.nbytes + sum(extra))
+
+    def _block_rows(self) -> int:
+        return max(1024, BLOCK_BYTES // (4 * max(1, self.dim)))
+
+    def _score_block(self, queries, start: int, stop: int, tables=None):
+        """Approximate similarity of each query to rows start:stop, shape (queries, rows)."""
+        block = self.codes[start:stop]
+        if self.codec == "float32":
+            return queries @ np.asarray(block).T
+        if self.codec == "int8":
+            return (queries @ block.astype(np.float32).T) * self.scales[start:stop]
+        # PQ: add up each subspace's precomputed query-to-centroid products
+        block = np.asarray(block)
+        scores = np.zeros((len(queries), len(block)), dtype=np.float32)
+        for j in range(block.shape[1]):
+            scores += tables[:, j, block[:, j]]
+        return scores
+
+    def _pq_tables(self, queries):
+        if self.codec != "pq":
+            return None
+        pieces = queries.reshape(len(queries), self.centroids.shape[0], -1)
+        return np.einsum("qjd,jcd->qjc", pieces, self.centroids)
+
+    def similarities(self, query_embedding):
+        """Approximate cosine similarity of one query to every passage."""
+        query = normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])
+        tables = self._pq_tables(query)
+        step = self._block_rows()
+        parts = [self._score_block(query, start, start + step, tables)[0] for start in range(0, len(self), step)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+    def search(self, query_embeddings, k: int = 5, rescore: int = 0) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Top-k passages for each query: (ids, scores), both (queries, k) with the
+        best first. rescore > k scores that many approximate candidates exactly
+        before picking the top k (no effect for float32).
+        """
+        queries = normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim))
+        k = min(k, len(self))
+        if k <= 0 or not len(queries):
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        exact = rescore > k and self.codec != "float32" and self.vectors is not None
+        keep = min(len(self), rescore) if exact else k
+
+        tables = self._pq_tables(queries)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        step = self._block_rows()
+        for start in range(0, len(self), step):
+            scores = self._score_block(queries, start, start + step, tables)
+            ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            best_ids, best_scores = top_k(np.hstack([best_ids, ids]), np.hstack([best_scores, scores]), keep)
+
+        if exact:
+            # Only the candidate rows of the memory-mapped originals are read
+            unique, positions = np.unique(best_ids, return_inverse=True)
+            rows = np.asarray(self.vectors[unique])[positions.reshape(best_ids.shape)]
+            best_scores = np.einsum("qd,qkd->qk", queries, rows)
+            best_ids, best_scores = top_k(best_ids, best_scores, k)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def save(self, index_dir: str) -> None:
+        """
+        Write the index files to a directory. Each is written aside and renamed
+        into place, so a worker with the old files memory-mapped keeps reading them intact.
+        """
+        index_path = Path(index_dir)
+        arrays = {VECTORS_FILENAME: np.asarray(self.vectors if self.vectors is not None else self.codes,
+                                               dtype=np.float32)}
+        if self.codec != "float32":
+            arrays[CODES_FILENAME] = self.codes
+        if self.scales is not None:
+            arrays[SCALES_FILENAME] = self.scales
+        if self.centroids is not None:
+            arrays[CENTROIDS_FILENAME] = self.centroids
+
+        staged = []
+        for name, array in arrays.items():
+            with open(index_path / f"{name}.tmp", "wb") as f:
+                np.save(f, array)
+            staged.append(name)
+        with open(index_path / f"{META_FILENAME}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"codec": self.codec, "dim": self.dim, "count": len(self)}, f)
+        staged.append(META_FILENAME)
+
+        for name in staged:
+            os.replace(index_path / f"{name}.tmp", index_path / name)
+        # Side tables of an earlier codec would otherwise sit next to the new files
+        for name in set(FILENAMES) - set(staged):
+            (index_path / name).unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["VectorIndex"]:
+        """Memory-map a saved index; None if the directory has no embeddings."""
+        index_path = Path(index_dir)
+        if np is None or not (index_path / VECTORS_FILENAME).exists():
+            return None
+        vectors = np.load(index_path / VECTORS_FILENAME, mmap_mode="r")
+        meta_path = index_path / META_FILENAME
+        meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {"codec": "float32"}
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        if meta["codec"] == "float32":
+            return cls("float32", dim, vectors, vectors=vectors)
+
+        def optional(name):
+            path = index_path / name
+            # The side tables are small; keep them in memory
+            return np.load(path) if path.exists() else None
+
+        return cls(meta["codec"], dim, np.load(index_path / CODES_FILENAME, mmap_mode="r"), vectors=vectors,
+                   scales=optional(SCALES_FILENAME), centroids=optional(CENTROIDS_FILENAME))
+
+    @staticmethod
+    def remove(index_dir: str) -> None:
+        """Delete a saved index's files from a directory, if there are any."""
+        for name in FILENAMES:
+            (Path(index_dir) / name).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {"codec": self.codec, "dim": self.dim, "vectors": len(self), "search_mb": round(self.nbytes / 1e6, 2)}
+
+
+def top_k(ids, scores, k: int):
+    """The k best (ids, scores) of each row, unordered."""
+    if scores.shape[1] <= k:
+        return ids, scores
+    picked = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(ids, picked, axis=1), np.take_along_axis(scores, picked, axis=1)
+
+
+def create_embedding_cache(config) -> Optional[EmbeddingCache]:
+    """The embedding cache described by config, or None if it is disabled."""
+    return EmbeddingCache(config.EMBEDDING_CACHE_PATH) if config.EMBEDDING_CACHE_PATH else None
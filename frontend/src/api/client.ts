@@ -1,4 +1,6 @@
-import { QuestionResponse } from '../types';
+import { QuestionResponse, StreamDoneEvent } from '../types';
+
+const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
 // Stub API client for development - no actual network calls
 export const bookApi = {
@@ -17,6 +19,67 @@ For now, this is just a placeholder to test the frontend functionality. The back
       answer: stubAnswer
     };
   },
+
+  // Streams the answer from /ask/stream, calling onDelta with each partial chunk of text
+  streamQuestion: async (
+    question: string,
+    onDelta: (text: string) => void,
+  ): Promise<QuestionResponse> => {
+    const response = await fetch(`${API_BASE_URL}/ask/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+      body: JSON.stringify({ query: question }),
+    });
+
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({}));
+      throw new Error(error.detail || `Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let done: StreamDoneEvent | null = null;
+
+    while (true) {
+      const { value, done: streamFinished } = await reader.read();
+      if (streamFinished) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Server-sent events are separated by a blank line
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let eventName = 'message';
+        let data = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) eventName = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (eventName === 'delta') {
+          answer += payload.text;
+          onDelta(payload.text);
+        } else if (eventName === 'done') {
+          done = payload;
+        } else if (eventName === 'error') {
+          throw new Error(payload.detail);
+        }
+      }
+    }
+
+    return {
+      answer,
+      sources: done?.sources ?? [],
+      usage: done?.usage ?? null,
+    };
+  },
 };
 
-export default bookApi; 
\ No newline at end of file
+export default bookApi; 
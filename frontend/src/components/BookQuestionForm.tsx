@@ -1,9 +1,10 @@
 import React, { useState } from 'react';
-import { useBookQuestion } from '../hooks/useBookQuestion';
+import { useStreamingBookQuestion } from '../hooks/useStreamingBookQuestion';
 
 const BookQuestionForm: React.FC = () => {
   const [question, setQuestion] = useState('');
-  const { mutate: askQuestion, isPending, error, data } = useBookQuestion();
+  const { mutate: askQuestion, isPending, error, data, partialAnswer } = useStreamingBookQuestion();
+  const answerText = isPending ? partialAnswer : data?.answer;
 
   const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
@@ -102,6 +103,12 @@ const BookQuestionForm: React.FC = () => {
     whiteSpace: 'pre-wrap',
   };
 
+  const sourcesStyle: React.CSSProperties = {
+    marginTop: '1rem',
+    color: '#6b7280',
+    fontSize: '0.875rem',
+  };
+
   const loadingStyle: React.CSSProperties = {
     textAlign: 'center',
     padding: '2rem',
@@ -168,18 +175,24 @@ const BookQuestionForm: React.FC = () => {
         </div>
       )}
 
-      {data && (
+      {answerText && (
         <div style={answerStyle}>
           <h2 style={answerTitleStyle}>Answer:</h2>
           <div>
             <p style={answerTextStyle}>
-              {data.answer}
+              {answerText}
             </p>
           </div>
+          {!isPending && data?.sources && data.sources.length > 0 && (
+            <div style={sourcesStyle}>
+              <strong>Sources:</strong>{' '}
+              {data.sources.map(source => source.title || source.file).join(', ')}
+            </div>
+          )}
         </div>
       )}
 
-      {isPending && (
+      {isPending && !partialAnswer && (
         <div style={loadingStyle}>
           <div style={spinnerStyle}></div>
           <p style={loadingTextStyle}>Thinking about your question...</p>
@@ -0,0 +1,25 @@
+import { useState } from 'react';
+import { useMutation } from '@tanstack/react-query';
+import { bookApi } from '../api/client';
+
+// Like useBookQuestion, but exposes the answer as it streams in via partialAnswer
+export const useStreamingBookQuestion = () => {
+  const [partialAnswer, setPartialAnswer] = useState('');
+
+  const mutation = useMutation({
+    mutationFn: (question: string) => {
+      setPartialAnswer('');
+      return bookApi.streamQuestion(question, (text) => {
+        setPartialAnswer(prev => prev + text);
+      });
+    },
+    onSuccess: (data, variables) => {
+      console.log('Question answered successfully:', { question: variables, answer: data.answer, sources: data.sources });
+    },
+    onError: (error) => {
+      console.error('Failed to get answer:', error);
+    },
+  });
+
+  return { ...mutation, partialAnswer };
+};
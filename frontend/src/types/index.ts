@@ -11,6 +11,26 @@ export interface QuestionRequest {
 
 export interface QuestionResponse {
   answer: string;
+  sources?: Source[];
+  usage?: Usage | null;
+}
+
+export interface Source {
+  file: string;
+  title?: string | null;
+  score?: number | null;
+}
+
+export interface Usage {
+  input_tokens: number;
+  output_tokens: number;
+  total_tokens: number;
+}
+
+// Final server-sent event from /ask/stream
+export interface StreamDoneEvent {
+  sources: Source[];
+  usage: Usage | null;
 }
 
 export interface ApiError {